@@ -0,0 +1,36 @@
+"""DeviceControlLogs time-range indexes
+
+Revision ID: 0001_device_control_log_indexes
+Revises: 
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_device_control_log_indexes'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # On a fresh database the table (and these indexes) are created by the
+    # autogenerated revision that setup.sh stacks on top of this one.
+    if not sa.inspect(op.get_bind()).has_table("DeviceControlLogs"):
+        return
+    op.create_index("ix_DeviceControlLogs_deviceId_createdAt", "DeviceControlLogs",
+                    ["deviceId", "createdAt"], if_not_exists=True)
+    op.create_index("ix_DeviceControlLogs_createdAt_brin", "DeviceControlLogs",
+                    ["createdAt"], postgresql_using="brin", if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_DeviceControlLogs_createdAt_brin",
+                  table_name="DeviceControlLogs", if_exists=True)
+    op.drop_index("ix_DeviceControlLogs_deviceId_createdAt",
+                  table_name="DeviceControlLogs", if_exists=True)
@@ -0,0 +1,38 @@
+import argparse
+
+from database.backups import BackupManager
+
+
+parser = argparse.ArgumentParser(
+    description="Incremental backups of the house, its devices and the device control logs.")
+parser.add_argument("command", choices=["backup", "restore", "verify"],
+                    help="backup writes the next segment, restore replays every segment in order, verify checks the segment checksums")
+parser.add_argument("--backup-dir", default="data/backups",
+                    help="directory holding manifest.json and the segments")
+parser.add_argument("--lag-seconds", type=float, default=300,
+                    help="how far the watermark trails the clock, longer than any transaction writing control logs")
+parser.add_argument("--batch-size", type=int, default=5000,
+                    help="logs read or written per round trip")
+parser.add_argument("--resume", action="store_true",
+                    help="restore: skip the segments an interrupted restore already applied")
+args = parser.parse_args()
+
+
+backup_manager = BackupManager(
+    args.backup_dir, lag_seconds=args.lag_seconds, batch_size=args.batch_size)
+
+if args.command == "backup":
+    segment = backup_manager.backup()
+    print(
+        f"[Backup] Segment {segment['number']}: {segment['logs']} log(s), {segment['devices']} device(s), {segment['bytes']} bytes, watermark {segment['watermark']}")
+elif args.command == "restore":
+    problems = backup_manager.verify()
+    if len(problems) > 0:
+        raise Exception("[Backup] " + " ".join(problems))
+    applied = backup_manager.restore(resume=args.resume)
+    print(f"[Backup] Restored {applied} segment(s).")
+else:
+    problems = backup_manager.verify()
+    for problem in problems:
+        print(f"[Backup] {problem}")
+    print(f"[Backup] {'All segments are intact.' if len(problems) == 0 else f'{len(problems)} problem(s) found.'}")
@@ -0,0 +1,202 @@
+'''Times `calculate_energy_consumption` over synthetic log histories and
+`get_scheduled_device_status` over synthetic schedules, against the
+implementations they replaced, and checks both give identical results.
+
+Everything is generated from a fixed seed and a fixed clock, no database
+is needed:
+
+    python -m benchmarks.bench_energy_schedule --sizes 1000 100000 1000000
+
+A history of 10M logs (`--sizes 10000000`) needs several GB of memory.
+'''
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+from helpers.data_models import DeviceControlLog
+from services.energy_consumption import calculate_energy_consumption
+from services.scheduled_device import get_scheduled_device_status
+
+# The fixed clock every history and schedule is generated against
+CLOCK = datetime(2026, 1, 5, tzinfo=timezone.utc)
+WATTAGES = [5.0, 60.0, 1500.5, None]
+
+
+def reference_calculate_energy_consumption(logs: List[DeviceControlLog], end_date: datetime):
+    '''`calculate_energy_consumption` before it was tuned, parsing every ON time.'''
+    total_energy_consumed = 0.0
+    last_on_times: Dict[str, datetime] = {}
+    last_on_wattages: Dict[str, float | None] = {}
+    for log in logs:
+        if log.status_changed_to and not log.status_changed_from:
+            last_on_times[log.device_id] = datetime.fromisoformat(
+                log.created_at)
+            last_on_wattages[log.device_id] = log.device_wattage
+        elif log.status_changed_from and not log.status_changed_to and log.device_id in last_on_times:
+            duration = datetime.fromisoformat(
+                log.created_at) - last_on_times.pop(log.device_id)
+            hours_on = duration.total_seconds() / 3600
+            energy_consumed = (
+                hours_on * log.device_wattage) if log.device_wattage is not None else 0.0
+            total_energy_consumed += energy_consumed
+    for device_id, last_on_time in last_on_times.items():
+        duration = end_date - last_on_time
+        hours_on = duration.total_seconds() / 3600
+        device_wattage = last_on_wattages[device_id]
+        energy_consumed = (
+            hours_on * device_wattage) if device_wattage is not None else 0.0
+        total_energy_consumed += energy_consumed
+    return total_energy_consumed
+
+
+def reference_get_scheduled_device_status(start_time: str, off_time: str, now: datetime) -> bool:
+    '''`get_scheduled_device_status` before it cached parsed times.'''
+    current_time = now.hour * 60 + now.minute
+    start_hour, start_minute = map(int, start_time.split(":"))
+    off_hour, off_minute = map(int, off_time.split(":"))
+    start_total_minutes = start_hour * 60 + start_minute
+    off_total_minutes = off_hour * 60 + off_minute
+    if start_total_minutes <= off_total_minutes:
+        return start_total_minutes <= current_time <= off_total_minutes
+    return current_time >= start_total_minutes or current_time <= off_total_minutes
+
+
+def generate_logs(size: int, devices: int, rng: random.Random) -> Tuple[List[DeviceControlLog], datetime]:
+    '''A history of `size` logs ending at `CLOCK`, returned with its end date.
+
+    Mostly alternating ON/OFF per device, with the irregularities real logs
+    have: repeated ONs, OFFs without an ON, unknown wattages and devices
+    left on at the end.
+    '''
+    logs: List[DeviceControlLog] = []
+    statuses: Dict[str, bool] = {}
+    created_at = CLOCK - timedelta(seconds=size * 30)
+    for _ in range(size):
+        device_id = f"device-{rng.randrange(devices)}"
+        is_on = statuses.get(device_id, False)
+        if rng.random() < 0.02:
+            # Out of order event, e.g. a retried switch
+            is_on = not is_on
+        created_at += timedelta(seconds=rng.randrange(1, 60),
+                                microseconds=rng.randrange(1_000_000))
+        log = DeviceControlLog()
+        log.device_control_log_id = f"log-{len(logs)}"
+        log.device_id = device_id
+        log.user_id = "bench-user"
+        log.status_changed_from = is_on
+        log.status_changed_to = not is_on
+        log.device_wattage = rng.choice(WATTAGES)
+        log.created_at = created_at.isoformat()
+        log.updated_at = log.created_at
+        logs.append(log)
+        statuses[device_id] = not is_on
+    return logs, created_at + timedelta(minutes=5)
+
+
+def generate_schedules(count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    '''Daytime, overnight and zero length windows.'''
+    schedules = [("00:00", "00:00"), ("00:00", "23:59"),
+                 ("23:59", "00:00"), ("12:00", "12:00")]
+    while len(schedules) < count:
+        schedules.append((f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+                          f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"))
+    return schedules[:count]
+
+
+def check_energy_equivalence(cases: int, rng: random.Random):
+    '''Compares both implementations on `cases` random small histories.'''
+    for case in range(cases):
+        logs, end_date = generate_logs(
+            rng.randrange(0, 200), rng.randrange(1, 6), rng)
+        expected = reference_calculate_energy_consumption(logs, end_date)
+        actual = calculate_energy_consumption(logs, end_date)
+        if actual != expected:
+            raise AssertionError(
+                f"calculate_energy_consumption differs on case {case}: {actual} != {expected}")
+
+
+def check_schedule_equivalence(schedules: List[Tuple[str, str]]):
+    '''Compares both implementations for every minute of a day.'''
+    for start_time, off_time in schedules:
+        for minute in range(24 * 60):
+            now = CLOCK + timedelta(minutes=minute)
+            expected = reference_get_scheduled_device_status(
+                start_time, off_time, now)
+            actual = get_scheduled_device_status(start_time, off_time, now)
+            if actual != expected:
+                raise AssertionError(
+                    f"get_scheduled_device_status differs for {start_time}-{off_time} at {now.time()}")
+
+
+def time_call(call: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--devices", type=int, default=32)
+    parser.add_argument("--schedules", type=int, default=64)
+    parser.add_argument("--schedule-calls", type=int, default=100_000)
+    parser.add_argument("--equivalence-cases", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_energy_schedule.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schedules = generate_schedules(args.schedules, rng)
+    check_energy_equivalence(args.equivalence_cases, rng)
+    check_schedule_equivalence(schedules)
+    print("[Benchmark] Replacements match the reference implementations.")
+
+    results = []
+    for size in args.sizes:
+        logs, end_date = generate_logs(size, args.devices, rng)
+        if calculate_energy_consumption(logs, end_date) != reference_calculate_energy_consumption(logs, end_date):
+            raise AssertionError(
+                f"calculate_energy_consumption differs on {size} logs")
+        reference_seconds = time_call(
+            lambda: reference_calculate_energy_consumption(logs, end_date), args.repeat)
+        seconds = time_call(
+            lambda: calculate_energy_consumption(logs, end_date), args.repeat)
+        results.append({"function": "calculate_energy_consumption", "logs": size,
+                        "reference_ms": reference_seconds * 1000, "median_ms": seconds * 1000,
+                        "logs_per_second": size / seconds if seconds > 0 else 0.0,
+                        "speedup": reference_seconds / seconds if seconds > 0 else 0.0})
+        print(f"calculate_energy_consumption | {size:>9} logs | reference {reference_seconds * 1000:10.2f} ms | "
+              f"current {seconds * 1000:10.2f} ms | {reference_seconds / seconds:5.2f}x")
+        del logs
+
+    times = [CLOCK + timedelta(minutes=rng.randrange(24 * 60))
+             for _ in range(args.schedule_calls)]
+    calls = [(schedules[index % len(schedules)], now)
+             for index, now in enumerate(times)]
+    reference_seconds = time_call(lambda: [reference_get_scheduled_device_status(start_time, off_time, now)
+                                           for (start_time, off_time), now in calls], args.repeat)
+    seconds = time_call(lambda: [get_scheduled_device_status(start_time, off_time, now)
+                                 for (start_time, off_time), now in calls], args.repeat)
+    results.append({"function": "get_scheduled_device_status", "calls": args.schedule_calls,
+                    "schedules": len(schedules), "reference_ms": reference_seconds * 1000,
+                    "median_ms": seconds * 1000, "speedup": reference_seconds / seconds if seconds > 0 else 0.0})
+    print(f"get_scheduled_device_status  | {args.schedule_calls:>9} calls | reference {reference_seconds * 1000:10.2f} ms | "
+          f"current {seconds * 1000:10.2f} ms | {reference_seconds / seconds:5.2f}x")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"seed": args.seed, "results": results}, f, indent=4)
+    print(f"[Benchmark] Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,85 @@
-from typing import List
-from gpiozero import OutputDevice
-
-import RPi.GPIO as GPIO  # type: ignore
+import json
+import threading
+import uuid
+from typing import Dict, List, Tuple
 
 from sqlalchemy.exc import SQLAlchemyError
 
-from database.actions import get_house_data
+from controller.expanders import ExpanderManager, get_expander_manager
+from controller.gpio_backend import GPIOBackend, OutputPin, get_gpio_backend
+from controller.relay_state import RelayStateStore, relay_state as default_relay_state
+from database.actions import get_house_data, set_device_statuses
 from helpers.data_models import House, Room, Device
+from helpers.request_models import ResponseStatusCodes
 from services.schedule import ScheduleDeviceAssistant
 
 
+def create_relay_output(pin_number: int, initial_value: bool, gpio_backend: GPIOBackend, expander_manager: ExpanderManager) -> OutputPin:
+    if expander_manager.owns(pin_number):
+        return expander_manager.create_output(pin_number, initial_value)
+    return gpio_backend.create_output(pin_number, active_high=False, initial_value=initial_value)
+
+
+def restore_relay_outputs(relay_state: RelayStateStore = default_relay_state, gpio_backend: GPIOBackend | None = None, expander_manager: ExpanderManager | None = None) -> Dict[int, OutputPin]:
+    '''Drives every relay to its last known state from the local state file.
+
+    Runs before the database is reached. The returned outputs are handed to
+    `ControllerDevice`, which adopts them instead of recreating the pins.
+    '''
+    gpio_backend = gpio_backend if gpio_backend is not None else get_gpio_backend()
+    expander_manager = expander_manager if expander_manager is not None else get_expander_manager()
+    gpio_backend.cleanup()
+    expander_manager.start()
+    outputs: Dict[int, OutputPin] = {}
+    for pin_number, status in relay_state.load().items():
+        try:
+            outputs[pin_number] = create_relay_output(
+                pin_number, status, gpio_backend, expander_manager)
+        except Exception as e:
+            print(f"[Relay State] Restoring pin {pin_number} failed. {e}")
+    expander_manager.flush()
+    print(
+        f"[Relay State] Restored {len(outputs)} relay(s) in {relay_state.last_load_duration_seconds * 1000:.1f} ms.")
+    return outputs
+
+
 class ControllerDevice:
 
     house: House | None = None
+    gpio_backend: GPIOBackend
+    expander_manager: ExpanderManager
+    relay_state: RelayStateStore
+
+    # Lookup indexes mirroring `house`, kept in sync by the add/remove methods
+    rooms_by_id: Dict[str, Room]
+    devices_by_id: Dict[str, Device]
+    devices_by_pin: Dict[int, Device]
+    scheduled_devices_by_id: Dict[str, Device]
+
+    # Serialized `/get-house` body, rebuilt lazily after `house_version` is
+    # bumped by a mutation. `boot_id` keeps ETags unique across restarts.
+    boot_id: str
+    house_version: int
+    house_snapshot: bytes | None
+    snapshot_lock: threading.Lock
 
-    def __init__(self):
+    def __init__(self, gpio_backend: GPIOBackend | None = None, expander_manager: ExpanderManager | None = None, relay_state: RelayStateStore = default_relay_state, restored_outputs: Dict[int, OutputPin] | None = None):
+        self.gpio_backend = gpio_backend if gpio_backend is not None else get_gpio_backend()
+        self.expander_manager = expander_manager if expander_manager is not None else get_expander_manager()
+        self.relay_state = relay_state
+        self.rooms_by_id = {}
+        self.devices_by_id = {}
+        self.devices_by_pin = {}
+        self.scheduled_devices_by_id = {}
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.house_version = 0
+        self.house_snapshot = None
+        self.snapshot_lock = threading.Lock()
         try:
             self.load_data()
-            self.release_all_rpi_gpio_resources()
-            self.initialize_output_devices()
+            if restored_outputs is None:
+                self.release_all_rpi_gpio_resources()
+            self.initialize_output_devices(restored_outputs)
         except Exception as e:
             print(f"Error initializing ControllerDevice: {e}")
             raise
@@ -30,36 +91,119 @@ class ControllerDevice:
                 raise Exception(
                     "[Controller] [DB] Unable to load controller data.")
             self.house = data
+            self.build_indexes()
+            self.mark_house_changed()
         except Exception as e:
             print(f"Error in load_data: {e}")
 
+    def build_indexes(self):
+        self.rooms_by_id.clear()
+        self.devices_by_id.clear()
+        self.devices_by_pin.clear()
+        self.scheduled_devices_by_id.clear()
+        if self.house is not None:
+            for room in self.house.rooms:
+                self.index_room(room)
+
+    def index_room(self, room: Room):
+        self.rooms_by_id[room.room_id] = room
+        for device in room.devices:
+            self.index_device(device)
+
+    def index_device(self, device: Device):
+        self.devices_by_id[device.device_id] = device
+        self.devices_by_pin[device.pin_number] = device
+        if device.is_scheduled:
+            self.scheduled_devices_by_id[device.device_id] = device
+
+    def unindex_device(self, device: Device):
+        self.devices_by_id.pop(device.device_id, None)
+        if self.devices_by_pin.get(device.pin_number) is device:
+            del self.devices_by_pin[device.pin_number]
+        self.scheduled_devices_by_id.pop(device.device_id, None)
+
+    def mark_house_changed(self):
+        with self.snapshot_lock:
+            self.house_version += 1
+            self.house_snapshot = None
+
+    def get_house_etag(self) -> str:
+        return f'"{self.boot_id}-{self.house_version}"'
+
+    def get_house_snapshot(self) -> Tuple[str, bytes] | None:
+        '''Returns the ETag and the serialized `/get-house` response body.'''
+        with self.snapshot_lock:
+            if self.house is None:
+                return None
+            if self.house_snapshot is None:
+                self.house_snapshot = json.dumps({
+                    "status": "success",
+                    "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+                    "message": "House data retrieved successfully.",
+                    "data": self.house.to_dict()
+                }).encode("utf-8")
+            return self.get_house_etag(), self.house_snapshot
+
     def release_all_rpi_gpio_resources(self):
-        GPIO.cleanup()
+        self.gpio_backend.cleanup()
+
+    def create_output(self, pin_number: int, initial_value: bool = False) -> OutputPin:
+        return create_relay_output(pin_number, initial_value, self.gpio_backend, self.expander_manager)
 
-    def initialize_output_devices(self):
+    def initialize_output_devices(self, restored_outputs: Dict[int, OutputPin] | None = None):
+        '''Creates every device's output at its status, adopting the outputs
+        restored from the relay state file.
+
+        The state file is written on every switch while the `Devices` table
+        is written behind, so a restored status wins and is saved back to
+        the table. Restored pins no device uses any more are switched off.
+        '''
+        restored_outputs = dict(
+            restored_outputs) if restored_outputs is not None else {}
+        restored_states = self.relay_state.get_states()
         try:
-            if self.house is not None:
-                for room in self.house.rooms:
-                    for device in room.devices:
-                        device.output_device = OutputDevice(
-                            device.pin_number, active_high=False)
+            self.expander_manager.start()
+            if self.house is None:
+                # Without the house the restored relays are left as they are
+                return
+            reconciled_statuses: Dict[str, bool] = {}
+            for device in self.devices_by_id.values():
+                restored_status = restored_states.get(device.pin_number)
+                if restored_status is not None and restored_status != device.status:
+                    device.status = restored_status
+                    reconciled_statuses[device.device_id] = restored_status
+                output_device = restored_outputs.pop(device.pin_number, None)
+                if output_device is None:
+                    output_device = self.create_output(
+                        device.pin_number, device.status)
+                device.output_device = output_device
+            for output_device in restored_outputs.values():
+                output_device.close()
+            self.expander_manager.flush()
+            self.relay_state.replace({device.pin_number: device.status
+                                      for device in self.devices_by_id.values()})
         except Exception as e:
             print(f"Error initializing output devices: {e}")
             raise Exception(f"Error initializing output devices: {e}")
 
+        if len(reconciled_statuses) > 0:
+            self.mark_house_changed()
+            result = set_device_statuses(reconciled_statuses)
+            if isinstance(result, SQLAlchemyError):
+                print(
+                    f"[Relay State] Saving {len(reconciled_statuses)} restored status(es) failed.")
+            else:
+                print(
+                    f"[Relay State] Reconciled {len(reconciled_statuses)} device status(es) with the relay state file.")
+
     def add_room(self, room: Room):
         if self.house is not None:
             self.house.rooms.append(room)
+            self.index_room(room)
+            self.mark_house_changed()
 
     def get_room(self, id: str):
-        try:
-            if self.house is not None:
-                for room in self.house.rooms:
-                    if room.room_id == id:
-                        return room
-        except Exception as e:
-            print(f"Error getting room: {e}")
-            return None
+        return self.rooms_by_id.get(id)
 
     def remove_room(self, room_id: str, schedule_assistant: ScheduleDeviceAssistant):
         if self.house is not None:
@@ -70,34 +214,36 @@ class ControllerDevice:
                         device.output_device.close()
                         schedule_assistant.remove_scheduled_device(
                             device.device_id)
+                    self.relay_state.forget(device.pin_number)
+                    self.unindex_device(device)
                 self.house.rooms.remove(room)
+                del self.rooms_by_id[room.room_id]
+                self.mark_house_changed()
 
     def add_device(self, device: Device):
         room = self.get_room(device.room_id)
         if room is not None:
-            device.output_device = OutputDevice(
-                device.pin_number, active_high=False)
+            device.output_device = self.create_output(
+                device.pin_number, device.status)
+            self.relay_state.record(device.pin_number, device.status)
             room.devices.append(device)
+            self.index_device(device)
+            self.mark_house_changed()
 
     def get_device(self, id: str):
-        try:
-            if self.house is not None:
-                for room in self.house.rooms:
-                    for device in room.devices:
-                        if device.device_id == id:
-                            return device
-        except Exception as e:
-            print(f"Error getting device: {e}")
-            return None
+        return self.devices_by_id.get(id)
+
+    def get_device_by_pin(self, pin_number: int):
+        return self.devices_by_pin.get(pin_number)
+
+    def is_pin_in_use(self, pin_number: int, device_id: str | None = None) -> bool:
+        '''Whether a device other than `device_id` drives the pin.'''
+        device = self.devices_by_pin.get(pin_number)
+        return device is not None and device.device_id != device_id
 
     def get_scheduled_devices(self) -> List[Device] | None:
-        scheduled_devices: List[Device] = []
         if self.house is not None:
-            for room in self.house.rooms:
-                for device in room.devices:
-                    if device.is_scheduled:
-                        scheduled_devices.append(device)
-            return scheduled_devices
+            return list(self.scheduled_devices_by_id.values())
 
     def switch_device(self, id: str, status: bool):
         try:
@@ -108,6 +254,11 @@ class ControllerDevice:
                     output_device.on()
                 else:
                     output_device.off()
+                if device is not None:
+                    self.relay_state.record(device.pin_number, status)
+                if device is not None and device.status != status:
+                    device.status = status
+                    self.mark_house_changed()
             else:
                 if device is None:
                     raise Exception(f"Device with id '{id}' not found.")
@@ -117,12 +268,62 @@ class ControllerDevice:
             print(f"Error switching device: {e}")
             raise Exception(f"Error switching device: {e}")
 
+    def switch_devices(self, switches: List[Tuple[str, bool]]) -> Tuple[List[Tuple[Device, bool]], Dict[str, str]]:
+        '''Drives every requested relay in one pass.
+
+        Returns the switched devices with their previous status, and an error
+        message per device id that could not be switched. A device listed
+        more than once takes its last status.
+        '''
+        switched: List[Tuple[Device, bool]] = []
+        errors: Dict[str, str] = {}
+        for device_id, status in dict(switches).items():
+            device = self.get_device(device_id)
+            if device is None:
+                errors[device_id] = f"Device with id '{device_id}' not found."
+                continue
+            if device.output_device is None:
+                errors[device_id] = "Output Device is not initialized."
+                continue
+            try:
+                if status:
+                    device.output_device.on()
+                else:
+                    device.output_device.off()
+            except Exception as e:
+                print(f"Error switching device: {e}")
+                errors[device_id] = f"Error switching device: {e}"
+                continue
+            switched.append((device, device.status))
+            device.status = status
+        self.relay_state.record_many(
+            [(device.pin_number, device.status) for device, _ in switched])
+        # Send expander writes now, one bus transaction per expander
+        self.expander_manager.flush()
+        if len(switched) > 0:
+            self.mark_house_changed()
+        return switched, errors
+
     def remove_device(self, device_id):
         device = self.get_device(device_id)
         if device is not None:
             output_device = device.output_device
             if output_device is not None:
                 output_device.close()
-            room = self.get_room(device.device_id)
+            self.relay_state.forget(device.pin_number)
+            room = self.get_room(device.room_id)
             if room is not None:
                 room.devices.remove(device)
+            self.unindex_device(device)
+            self.mark_house_changed()
+
+    def set_default_device(self, device: Device, is_default: bool):
+        '''Mirrors `configure_device`: changing a device's default flag clears it on the rest of the room.'''
+        if device.is_default == is_default:
+            return
+        room = self.get_room(device.room_id)
+        if room is not None:
+            for room_device in room.devices:
+                room_device.is_default = False
+        device.is_default = is_default
+        self.mark_house_changed()
@@ -0,0 +1,333 @@
+import abc
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from controller.gpio_backend import OutputPin
+from helpers.header_pins import HeaderPinConfig, HeaderPinType, gpio_pin_numbers
+
+
+class I2CBus():
+    def __init__(self, bus_number: int = 1):
+        from smbus2 import SMBus  # type: ignore
+        self.bus = SMBus(bus_number)
+        self.transaction_count = 0
+
+    def write_byte(self, address: int, value: int):
+        self.bus.write_byte(address, value)
+        self.transaction_count += 1
+
+    def write_block(self, address: int, register: int, values: List[int]):
+        self.bus.write_i2c_block_data(address, register, values)
+        self.transaction_count += 1
+
+
+class SPIBus():
+    def __init__(self, bus_number: int = 0, device: int = 0, speed_hz: int = 1_000_000):
+        import spidev  # type: ignore
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus_number, device)
+        self.spi.max_speed_hz = speed_hz
+        self.transaction_count = 0
+
+    def transfer(self, values: List[int]):
+        self.spi.xfer2(values)
+        self.transaction_count += 1
+
+
+class SimulatedBus():
+    '''Records every bus transaction instead of talking to hardware.'''
+
+    def __init__(self, max_transactions: int = 10_000):
+        self.transactions: Deque[Tuple[str, Any, float]] = deque(
+            maxlen=max_transactions)
+        self.transaction_count = 0
+
+    def record(self, kind: str, payload: Any):
+        self.transactions.append((kind, payload, time.perf_counter()))
+        self.transaction_count += 1
+
+    def write_byte(self, address: int, value: int):
+        self.record("write_byte", (address, value))
+
+    def write_block(self, address: int, register: int, values: List[int]):
+        self.record("write_block", (address, register, list(values)))
+
+    def transfer(self, values: List[int]):
+        self.record("transfer", list(values))
+
+
+class Expander(abc.ABC):
+    '''Shadow register of a relay expander, written out as a whole by `flush`.
+
+    Channel `n` is driven by pin number `base_pin + n`. Writes only update
+    the shadow state, so every change made between two flushes goes out in
+    one bus transaction.
+    '''
+    kind: str
+    base_pin: int
+    channel_count: int
+    active_high: bool
+    state: int
+    dirty: bool
+
+    def __init__(self, bus, base_pin: int, channel_count: int, active_high: bool):
+        self.bus = bus
+        self.base_pin = base_pin
+        self.channel_count = channel_count
+        self.active_high = active_high
+        # Every channel starts switched off
+        self.state = 0 if active_high else (1 << channel_count) - 1
+        self.dirty = True
+        self.flush_count = 0
+
+    def owns(self, pin_number: int) -> bool:
+        return self.base_pin <= pin_number < self.base_pin + self.channel_count
+
+    def set_channel(self, channel: int, value: bool):
+        bit = 1 << channel
+        level = value == self.active_high
+        state = self.state | bit if level else self.state & ~bit
+        if state != self.state:
+            self.state = state
+            self.dirty = True
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.write_state()
+        self.dirty = False
+        self.flush_count += 1
+
+    @abc.abstractmethod
+    def write_state(self):
+        '''Writes `state` to the expander in one bus transaction.'''
+
+    def get_stats(self):
+        return {
+            "type": self.kind,
+            "base_pin": self.base_pin,
+            "channels": self.channel_count,
+            "flushes": self.flush_count
+        }
+
+
+class MCP23017(Expander):
+    '''16 channel I2C expander, both ports written in one block write.'''
+    kind = "mcp23017"
+
+    IODIRA = 0x00
+    OLATA = 0x14
+
+    def __init__(self, bus, address: int, base_pin: int, active_high: bool):
+        super().__init__(bus, base_pin, 16, active_high)
+        self.address = address
+        # Latch the all-off state before the lines become outputs, the
+        # power-on OLAT of 0x00 would switch active low relays on meanwhile
+        self.write_state()
+        # All 16 lines are outputs
+        self.bus.write_block(self.address, self.IODIRA, [0x00, 0x00])
+        self.dirty = False
+
+    def write_state(self):
+        self.bus.write_block(self.address, self.OLATA, [
+                             self.state & 0xFF, (self.state >> 8) & 0xFF])
+
+
+class PCF8574(Expander):
+    '''8 channel quasi-bidirectional I2C expander, one byte per write.'''
+    kind = "pcf8574"
+
+    def __init__(self, bus, address: int, base_pin: int, active_high: bool):
+        super().__init__(bus, base_pin, 8, active_high)
+        self.address = address
+
+    def write_state(self):
+        self.bus.write_byte(self.address, self.state & 0xFF)
+
+
+class ShiftRegisterChain(Expander):
+    '''Daisy chained 74HC595s, the whole chain shifted out in one SPI transfer.'''
+    kind = "74hc595"
+
+    def __init__(self, bus, chips: int, base_pin: int, active_high: bool):
+        super().__init__(bus, base_pin, chips * 8, active_high)
+        self.chips = chips
+
+    def write_state(self):
+        # The byte of the last chip in the chain is shifted out first
+        self.bus.transfer([(self.state >> (chip * 8)) & 0xFF
+                           for chip in reversed(range(self.chips))])
+
+
+class ExpanderOutputPin(OutputPin):
+
+    def __init__(self, manager: "ExpanderManager", expander: Expander, pin_number: int, initial_value: bool):
+        self.manager = manager
+        self.expander = expander
+        self.pin_number = pin_number
+        self.channel = pin_number - expander.base_pin
+        self.active_high = expander.active_high
+        self.value = initial_value
+        self.write(initial_value)
+
+    def write(self, value: bool):
+        self.value = value
+        with self.manager.lock:
+            self.expander.set_channel(self.channel, value)
+        self.manager.request_flush()
+
+    def on(self):
+        self.write(True)
+
+    def off(self):
+        self.write(False)
+
+    def close(self):
+        self.write(False)
+
+
+class ExpanderManager():
+    '''Owns the configured expanders and flushes their pending writes.
+
+    A write wakes the flush thread, which waits `tick_seconds` so writes
+    arriving together coalesce, then flushes every dirty expander once.
+    `flush` can be called to send pending writes right away.
+    '''
+    expanders: List[Expander]
+    tick_seconds: float
+
+    lock: threading.RLock
+    condition: threading.Condition
+    flush_requested: bool = False
+    worker_thread: threading.Thread | None = None
+
+    def __init__(self, expanders: List[Expander], tick_seconds: float = 0.005):
+        self.expanders = expanders
+        self.tick_seconds = tick_seconds
+        self.lock = threading.RLock()
+        self.condition = threading.Condition()
+
+    def start(self):
+        if len(self.expanders) == 0 or (self.worker_thread is not None and self.worker_thread.is_alive()):
+            return
+        self.worker_thread = threading.Thread(target=self._flush_worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def _flush_worker(self):
+        while True:
+            with self.condition:
+                while not self.flush_requested:
+                    self.condition.wait()
+                self.flush_requested = False
+            time.sleep(self.tick_seconds)
+            self.flush()
+
+    def request_flush(self):
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify()
+
+    def flush(self):
+        with self.lock:
+            for expander in self.expanders:
+                try:
+                    expander.flush()
+                except Exception as e:
+                    print(
+                        f"[Expander] Writing {expander.kind} at pin {expander.base_pin} failed. {e}")
+
+    def get_expander(self, pin_number: int) -> Expander | None:
+        for expander in self.expanders:
+            if expander.owns(pin_number):
+                return expander
+        return None
+
+    def owns(self, pin_number: int) -> bool:
+        return self.get_expander(pin_number) is not None
+
+    def create_output(self, pin_number: int, initial_value: bool = False) -> OutputPin:
+        expander = self.get_expander(pin_number)
+        if expander is None:
+            raise Exception(f"[Expander] No expander drives pin {pin_number}.")
+        return ExpanderOutputPin(self, expander, pin_number, initial_value)
+
+    def get_pin_configs(self) -> List[HeaderPinConfig]:
+        return [HeaderPinConfig(header_pin_number=None, type=HeaderPinType.EXPANDER, gpio_pin_number=pin_number)
+                for expander in self.expanders
+                for pin_number in range(expander.base_pin, expander.base_pin + expander.channel_count)]
+
+    def get_stats(self):
+        with self.lock:
+            return [{**expander.get_stats(), "bus_transactions": expander.bus.transaction_count}
+                    for expander in self.expanders]
+
+
+def create_expanders(configs: List[Dict[str, Any]], simulated: bool) -> List[Expander]:
+    '''Builds the expanders described by `RELAY_EXPANDERS`, for example
+
+        [{"type": "mcp23017", "address": 32, "base_pin": 100},
+         {"type": "74hc595", "chips": 8, "base_pin": 200, "active_high": true}]
+
+    I2C expanders take an optional "bus" (default 1), shift register chains
+    "spi_bus" and "spi_device" (default 0). Expanders sharing a bus share
+    one bus object.
+    '''
+    expanders: List[Expander] = []
+    buses: Dict[Tuple, Any] = {}
+
+    def get_bus(key: Tuple, create):
+        if key not in buses:
+            buses[key] = SimulatedBus() if simulated else create()
+        return buses[key]
+
+    for config in configs:
+        kind = config["type"].lower()
+        base_pin = int(config["base_pin"])
+        active_high = bool(config.get("active_high", False))
+        if kind in [MCP23017.kind, PCF8574.kind]:
+            bus_number = int(config.get("bus", 1))
+            bus = get_bus(("i2c", bus_number),
+                          lambda: I2CBus(bus_number))
+            expander_class = MCP23017 if kind == MCP23017.kind else PCF8574
+            expander = expander_class(
+                bus, int(config["address"]), base_pin, active_high)
+        elif kind == ShiftRegisterChain.kind:
+            spi_bus, spi_device = int(config.get("spi_bus", 0)), int(
+                config.get("spi_device", 0))
+            bus = get_bus(("spi", spi_bus, spi_device),
+                          lambda: SPIBus(spi_bus, spi_device))
+            expander = ShiftRegisterChain(
+                bus, int(config.get("chips", 1)), base_pin, active_high)
+        else:
+            raise Exception(f"[Expander] Unknown expander type '{kind}'.")
+
+        pin_numbers = range(expander.base_pin,
+                            expander.base_pin + expander.channel_count)
+        if any(pin_number in gpio_pin_numbers or any(other.owns(pin_number) for other in expanders)
+               for pin_number in pin_numbers):
+            raise Exception(
+                f"[Expander] Pins {pin_numbers.start}-{pin_numbers.stop - 1} of {kind} overlap other pins.")
+        expanders.append(expander)
+    return expanders
+
+
+# Created on first use, like `controller.gpio_backend.get_gpio_backend`,
+# since building the expanders opens their buses
+_expander_manager: ExpanderManager | None = None
+_expander_manager_lock = threading.Lock()
+
+
+def get_expander_manager() -> ExpanderManager:
+    '''The expanders described by `RELAY_EXPANDERS`, created on the first call.'''
+    global _expander_manager
+    with _expander_manager_lock:
+        if _expander_manager is None:
+            _expander_manager = ExpanderManager(create_expanders(
+                json.loads(os.environ.get("RELAY_EXPANDERS", "[]")),
+                simulated=os.environ.get("GPIO_BACKEND") == "simulator"))
+        return _expander_manager
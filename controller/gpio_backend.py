@@ -0,0 +1,226 @@
+import abc
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+
+class OutputPin(abc.ABC):
+    '''A relay output. `value` is the logical state, True meaning on.'''
+    pin_number: int
+    active_high: bool
+    value: bool
+
+    @abc.abstractmethod
+    def on(self):
+        pass
+
+    @abc.abstractmethod
+    def off(self):
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+
+class GPIOBackend(abc.ABC):
+    '''Creates the relay outputs of `ControllerDevice`.'''
+    name: str
+
+    @abc.abstractmethod
+    def create_output(self, pin_number: int, active_high: bool = False, initial_value: bool = False) -> OutputPin:
+        pass
+
+    def cleanup(self):
+        '''Releases every pin left claimed by a previous run.'''
+
+    def get_stats(self):
+        return {"backend": self.name}
+
+
+class GpiozeroOutputPin(OutputPin):
+
+    def __init__(self, pin_number: int, active_high: bool, initial_value: bool):
+        from gpiozero import OutputDevice
+        self.pin_number = pin_number
+        self.active_high = active_high
+        self.output_device = OutputDevice(
+            pin_number, active_high=active_high, initial_value=initial_value)
+
+    @property
+    def value(self) -> bool:
+        return bool(self.output_device.value)
+
+    def on(self):
+        self.output_device.on()
+
+    def off(self):
+        self.output_device.off()
+
+    def close(self):
+        self.output_device.close()
+
+
+class GpiozeroBackend(GPIOBackend):
+    name = "gpiozero"
+
+    def create_output(self, pin_number: int, active_high: bool = False, initial_value: bool = False) -> OutputPin:
+        return GpiozeroOutputPin(pin_number, active_high, initial_value)
+
+    def cleanup(self):
+        import RPi.GPIO as GPIO  # type: ignore
+        GPIO.cleanup()
+
+
+class LgpioOutputPin(OutputPin):
+
+    def __init__(self, handle: int, pin_number: int, active_high: bool, initial_value: bool):
+        import lgpio  # type: ignore
+        self.lgpio = lgpio
+        self.handle = handle
+        self.pin_number = pin_number
+        self.active_high = active_high
+        self.value = initial_value
+        lgpio.gpio_claim_output(handle, pin_number,
+                                self.get_level(initial_value))
+
+    def get_level(self, value: bool) -> int:
+        return 1 if value == self.active_high else 0
+
+    def on(self):
+        self.lgpio.gpio_write(self.handle, self.pin_number, self.get_level(True))
+        self.value = True
+
+    def off(self):
+        self.lgpio.gpio_write(self.handle, self.pin_number, self.get_level(False))
+        self.value = False
+
+    def close(self):
+        self.lgpio.gpio_free(self.handle, self.pin_number)
+
+
+class LgpioBackend(GPIOBackend):
+    '''Writes the gpiochip lines directly through lgpio, skipping the
+    gpiozero device and pin factory layers on every switch.'''
+    name = "lgpio"
+
+    def __init__(self, chip: int = 0):
+        import lgpio  # type: ignore
+        self.lgpio = lgpio
+        self.chip = chip
+        self.handle = lgpio.gpiochip_open(chip)
+
+    def create_output(self, pin_number: int, active_high: bool = False, initial_value: bool = False) -> OutputPin:
+        return LgpioOutputPin(self.handle, pin_number, active_high, initial_value)
+
+    def cleanup(self):
+        # Lines are released when the chip handle is closed, reopen a fresh one
+        self.lgpio.gpiochip_close(self.handle)
+        self.handle = self.lgpio.gpiochip_open(self.chip)
+
+
+class SimulatedOutputPin(OutputPin):
+
+    def __init__(self, backend: "SimulatedBackend", pin_number: int, active_high: bool, initial_value: bool):
+        self.backend = backend
+        self.pin_number = pin_number
+        self.active_high = active_high
+        self.value = initial_value
+        self.closed = False
+        backend.record(pin_number, initial_value)
+
+    def on(self):
+        self.value = True
+        self.backend.record(self.pin_number, True)
+
+    def off(self):
+        self.value = False
+        self.backend.record(self.pin_number, False)
+
+    def close(self):
+        self.closed = True
+        self.backend.release(self.pin_number)
+
+
+class SimulatedBackend(GPIOBackend):
+    '''In-memory pins for running and load testing the server off a Pi.
+
+    Keeps the current state of every pin and the last `max_transitions`
+    writes as `(pin_number, value, perf_counter timestamp)`.
+    '''
+    name = "simulator"
+
+    pin_states: Dict[int, bool]
+    transitions: Deque[Tuple[int, bool, float]]
+    write_count: int
+    lock: threading.Lock
+
+    def __init__(self, max_transitions: int = 10_000):
+        self.pin_states = {}
+        self.transitions = deque(maxlen=max_transitions)
+        self.write_count = 0
+        self.lock = threading.Lock()
+
+    def create_output(self, pin_number: int, active_high: bool = False, initial_value: bool = False) -> OutputPin:
+        return SimulatedOutputPin(self, pin_number, active_high, initial_value)
+
+    def record(self, pin_number: int, value: bool):
+        with self.lock:
+            self.pin_states[pin_number] = value
+            self.transitions.append((pin_number, value, time.perf_counter()))
+            self.write_count += 1
+
+    def release(self, pin_number: int):
+        with self.lock:
+            self.pin_states.pop(pin_number, None)
+
+    def cleanup(self):
+        with self.lock:
+            self.pin_states.clear()
+
+    def get_transitions(self, pin_number: int | None = None) -> List[Tuple[int, bool, float]]:
+        with self.lock:
+            return [transition for transition in self.transitions
+                    if pin_number is None or transition[0] == pin_number]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "backend": self.name,
+                "pins": len(self.pin_states),
+                "pins_on": sum(1 for value in self.pin_states.values() if value),
+                "writes": self.write_count
+            }
+
+
+GPIO_BACKENDS = {
+    GpiozeroBackend.name: GpiozeroBackend,
+    LgpioBackend.name: LgpioBackend,
+    SimulatedBackend.name: SimulatedBackend,
+}
+
+
+def create_gpio_backend(name: str) -> GPIOBackend:
+    if name not in GPIO_BACKENDS:
+        raise Exception(
+            f"[GPIO] Unknown GPIO backend '{name}', expected one of {', '.join(GPIO_BACKENDS)}.")
+    print(f"[GPIO] Using the {name} GPIO backend.")
+    return GPIO_BACKENDS[name]()
+
+
+# Created on first use, not at import, so importing the data models or the
+# database actions (CLIs, benchmarks) does not open the GPIO chip
+_gpio_backend: GPIOBackend | None = None
+_gpio_backend_lock = threading.Lock()
+
+
+def get_gpio_backend() -> GPIOBackend:
+    '''The backend named by `GPIO_BACKEND`, created on the first call.'''
+    global _gpio_backend
+    with _gpio_backend_lock:
+        if _gpio_backend is None:
+            _gpio_backend = create_gpio_backend(
+                os.environ.get("GPIO_BACKEND", GpiozeroBackend.name))
+        return _gpio_backend
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class RelayStateStore():
+    '''Last known state of every relay, kept in a local append-only file.
+
+    Each switch appends a `<pin> <1|0>` line (`<pin> -` once a pin is no
+    longer used) and is fsynced before returning, so the file is current
+    even after a power cut. On boot the file is replayed, the last line per
+    pin wins, which takes milliseconds and needs no database. The file is
+    rewritten as a snapshot once it holds `compact_after` lines.
+    '''
+    file_path: str
+    compact_after: int
+    sync_writes: bool
+
+    states: Dict[int, bool]
+    lock: threading.Lock
+    line_count: int = 0
+
+    write_count: int = 0
+    compaction_count: int = 0
+    last_load_duration_seconds: float = 0.0
+
+    def __init__(self, file_path: str = "data/relay_state.log", compact_after: int = 4096, sync_writes: bool = True):
+        self.file_path = file_path
+        self.compact_after = compact_after
+        self.sync_writes = sync_writes
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[int, bool]:
+        '''Replays the state file and returns the status of every known pin.'''
+        started_at = time.perf_counter()
+        with self.lock:
+            self.states = {}
+            self.line_count = 0
+            is_torn = False
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self.line_count += 1
+                        is_torn = not self.apply_line(line) or not line.endswith("\n")
+            if is_torn:
+                # Appending after a torn line would corrupt the next record
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    print(f"[Relay State] Writing {self.file_path} failed. {e}")
+            self.last_load_duration_seconds = time.perf_counter() - started_at
+            return dict(self.states)
+
+    def apply_line(self, line: str) -> bool:
+        parts = line.split()
+        if len(parts) != 2 or not parts[0].isdigit() or parts[1] not in ["1", "0", "-"]:
+            # A torn last line from a crash mid-write
+            print(f"[Relay State] Skipping unreadable line: {line.strip()}")
+            return False
+        pin_number = int(parts[0])
+        if parts[1] == "-":
+            self.states.pop(pin_number, None)
+        else:
+            self.states[pin_number] = parts[1] == "1"
+        return True
+
+    def get_states(self) -> Dict[int, bool]:
+        with self.lock:
+            return dict(self.states)
+
+    def record(self, pin_number: int, status: bool):
+        self.record_many([(pin_number, status)])
+
+    def record_many(self, changes: List[Tuple[int, bool | None]]):
+        '''Appends the changed pins in one write, `None` forgets a pin.'''
+        with self.lock:
+            lines: List[str] = []
+            for pin_number, status in changes:
+                if status is None:
+                    if pin_number not in self.states:
+                        continue
+                    self.states.pop(pin_number)
+                    lines.append(f"{pin_number} -\n")
+                else:
+                    if self.states.get(pin_number) == status:
+                        continue
+                    self.states[pin_number] = status
+                    lines.append(f"{pin_number} {1 if status else 0}\n")
+            if len(lines) == 0:
+                return
+            try:
+                self.append_lines(lines)
+                if self.line_count >= self.compact_after:
+                    self.write_snapshot()
+            except OSError as e:
+                print(f"[Relay State] Writing {self.file_path} failed. {e}")
+
+    def forget(self, pin_number: int):
+        self.record_many([(pin_number, None)])
+
+    def replace(self, states: Dict[int, bool]):
+        '''Makes `states` the whole relay state, used after reconciling.'''
+        with self.lock:
+            self.states = dict(states)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"[Relay State] Writing {self.file_path} failed. {e}")
+
+    def append_lines(self, lines: List[str]):
+        self.ensure_directory()
+        with open(self.file_path, 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            if self.sync_writes:
+                os.fsync(f.fileno())
+        self.line_count += len(lines)
+        self.write_count += 1
+
+    def write_snapshot(self):
+        # Written aside and renamed, a crash leaves either file whole
+        self.ensure_directory()
+        temp_file_path = f"{self.file_path}.tmp"
+        with open(temp_file_path, 'w', encoding='utf-8') as f:
+            f.write("".join(f"{pin_number} {1 if status else 0}\n"
+                            for pin_number, status in sorted(self.states.items())))
+            f.flush()
+            if self.sync_writes:
+                os.fsync(f.fileno())
+        os.replace(temp_file_path, self.file_path)
+        self.line_count = len(self.states)
+        self.compaction_count += 1
+
+    def ensure_directory(self):
+        state_dir = os.path.dirname(self.file_path)
+        if state_dir != "":
+            os.makedirs(state_dir, exist_ok=True)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "pins": len(self.states),
+                "lines": self.line_count,
+                "writes": self.write_count,
+                "compactions": self.compaction_count,
+                "last_load_ms": self.last_load_duration_seconds * 1000
+            }
+
+
+relay_state = RelayStateStore(
+    file_path=os.environ.get("RELAY_STATE_FILE", "data/relay_state.log"),
+    sync_writes=os.environ.get(
+        "RELAY_STATE_FSYNC", "true").lower() in ["1", "true", "yes"])
@@ -1,18 +1,157 @@
 
-from datetime import datetime
-from typing import List
-from sqlalchemy import or_
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+from sqlalchemy import func, insert, or_, select, text, update
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
 
 from database.database import get_db
-from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog
-from helpers.data_models import HouseMember as HouseMemberData, Room as RoomData, Device as DeviceData, House as HouseData, DeviceControlLog as DeviceControlLogData
+from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog, DeviceEnergyDailySummary, EnergyCheckpoint, Scene, SceneAction
+from helpers.data_models import HouseMember as HouseMemberData, Room as RoomData, Device as DeviceData, House as HouseData, DeviceControlLog as DeviceControlLogData, EnergyCheckpoint as EnergyCheckpointData, DeviceEnergyConsumption as DeviceEnergyConsumptionData, Scene as SceneData
 
+from services.access_cache import AccessCache, access_cache
+from services.energy_consumption import ENERGY_PERIODS
 from services.scheduled_device import get_scheduled_device_status
 
+from controller.expanders import get_expander_manager
 from helpers.header_pins import HeaderPinType, HeaderPinConfigDataModel, pin_header_config
 
 
+# The house graph is read as plain column tuples in a fixed number of
+# queries (house, rooms, devices) and mapped straight to the data models,
+# instead of lazy loading `rooms` and `devices` one room at a time.
+HOUSE_COLUMNS_QUERY = select(*Houses.__table__.c).limit(1)
+
+
+def get_room_columns_query(house_id):
+    return select(*Room.__table__.c).where(Room.houseId == house_id).order_by(Room.createdAt)
+
+
+def get_device_columns_query(house_id):
+    return select(*Device.__table__.c).join(Room.__table__, Room.roomId == Device.roomId).where(
+        Room.houseId == house_id).order_by(Device.createdAt)
+
+
+def get_daily_energy_summaries_query(start_date: datetime, end_date: datetime):
+    columns = DeviceEnergyDailySummary.__table__.c
+    return select(columns.deviceId, columns.day, columns.wattHours).where(
+        columns.day >= start_date.astimezone(timezone.utc).date(),
+        columns.day <= end_date.astimezone(timezone.utc).date()).order_by(columns.deviceId, columns.day)
+
+
+def build_daily_energy_consumption(row) -> DeviceEnergyConsumptionData:
+    consumption = DeviceEnergyConsumptionData()
+    consumption.device_id = str(row.deviceId)
+    consumption.period_start = row.day.isoformat()
+    consumption.watt_hours = float(row.wattHours)
+    return consumption
+
+
+def build_house_data(house_row, room_rows, device_rows) -> HouseData:
+    room_devices: Dict[Any, List[DeviceData]] = {
+        room_row.roomId: [] for room_row in room_rows}
+    for device_row in device_rows:
+        room_devices[device_row.roomId].append(
+            Device.data_from_row(device_row))
+    return Houses.data_from_row(house_row, [Room.data_from_row(room_row, room_devices[room_row.roomId])
+                                            for room_row in room_rows])
+
+
+# Statements shared with `database.async_actions`, which runs them on the
+# async engine for the request handlers
+def get_house_member_query(user_id: str):
+    return select(HouseMember).where(HouseMember.userId == user_id)
+
+
+def get_default_device_query(room_id: str):
+    return select(Device).where(Device.roomId == room_id, Device.isDefault == True).limit(1)
+
+
+def build_new_device(device_name: str, pin_number: int, wattage: float, room_id: str, current_default_device) -> Device:
+    return Device(deviceName=device_name, pinNumber=pin_number, wattage=wattage, roomId=room_id,
+                  status=False, isScheduled=False, isDefault=current_default_device is None)
+
+
+def get_configure_device_statements(current_device, device_id: str, device_name: str, pin_number: int, status: bool, is_default: bool, is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, wattage: float, user_id: str):
+    '''Returns the UPDATEs of `configure_device`, in order, and the
+    `DeviceControlLog` to add when the status changes (or None).'''
+    statements = []
+    # If current device is set a sdefault then remove all other devices from default devices of the room
+    old_is_default = getattr(current_device, "isDefault", None)
+    is_new_default = old_is_default != None and old_is_default != is_default
+    if is_new_default and current_device is not None:
+        statements.append(update(Device).where(
+            Device.roomId == current_device.roomId, Device.isDefault == True).values(isDefault=False))
+
+    new_status = get_scheduled_device_status(
+        start_time, off_time) if is_scheduled else status
+    statements.append(update(Device).where(Device.deviceId == device_id).values(
+        deviceName=device_name,
+        pinNumber=pin_number,
+        isScheduled=is_scheduled,
+        daysScheduled=days_scheduled if is_scheduled else "",
+        startTime=start_time if is_scheduled else "",
+        offTime=off_time if is_scheduled else "",
+        status=new_status,
+        isDefault=is_default,
+        scheduledBy=user_id,
+        wattage=wattage
+    ))
+
+    control_log = None
+    old_status = getattr(current_device, "status", None)
+    if old_status != new_status:
+        control_log = DeviceControlLog(statusChangedFrom=old_status,
+                                       statusChangedTo=new_status,
+                                       deviceId=device_id,
+                                       deviceWattage=getattr(
+                                           current_device, "wattage", None),
+                                       userId=user_id)
+    return statements, control_log
+
+
+def build_new_scene(scene_name: str, house_id: str, actions: List[Tuple[str, bool]], user_id: str) -> Scene:
+    return Scene(sceneName=scene_name, houseId=house_id, createdBy=user_id,
+                 actions=[SceneAction(deviceId=device_id, status=status)
+                          for device_id, status in dict(actions).items()])
+
+
+SCENES_QUERY = select(Scene).options(
+    selectinload(Scene.actions)).order_by(Scene.createdAt)
+
+
+def get_scene_query(scene_id: str):
+    return select(Scene).options(selectinload(Scene.actions)).where(Scene.sceneId == scene_id)
+
+
+USED_GPIO_PINS_QUERY = select(Device.pinNumber)
+
+
+def build_available_gpio_pins(used_gpio_pins) -> List[HeaderPinConfigDataModel]:
+    used_gpio_pins = {int(pin_number) for pin_number in used_gpio_pins}
+    return [pin_config.get_data() for pin_config in pin_header_config + get_expander_manager().get_pin_configs()
+            if pin_config.type in [HeaderPinType.GPIO, HeaderPinType.EXPANDER] and pin_config.gpio_pin_number not in used_gpio_pins]
+
+
+def get_specific_device_control_logs_query(start_date: datetime, end_date: datetime, device_id="all", order_by_device=False):
+    query = select(DeviceControlLog).where(
+        DeviceControlLog.createdAt >= start_date,
+        DeviceControlLog.createdAt <= end_date)
+    if (device_id != "all"):
+        query = query.where(DeviceControlLog.deviceId == device_id)
+    if order_by_device:
+        query = query.order_by(DeviceControlLog.deviceId)
+    return query.order_by(DeviceControlLog.createdAt)
+
+
+def load_house_data(db) -> HouseData | None:
+    house_row = db.execute(HOUSE_COLUMNS_QUERY).first()
+    if house_row is None:
+        return None
+    return build_house_data(house_row, db.execute(get_room_columns_query(house_row.houseId)).all(),
+                            db.execute(get_device_columns_query(house_row.houseId)).all())
+
+
 def init_house_db(house_password_hash: str):
     db = get_db()
     try:
@@ -22,7 +161,10 @@ def init_house_db(house_password_hash: str):
                                passwordHash=house_password_hash)
             db.add(new_house)
             db.flush()
-            return new_house.get_data()
+            house = new_house.get_data()
+        # Once committed, so no reader can cache the state before it
+        access_cache.clear()
+        return house
     except SQLAlchemyError as SQLError:
         print("[DB] Initializing House Failed.")
         print(SQLError)
@@ -35,12 +177,10 @@ def get_house() -> HouseData | None | SQLAlchemyError:
     db = get_db()
     try:
         with db.begin() as txn:  # Automatically handles commit/rollback
-            # Use `first()` to avoid IndexError
-            house = db.query(Houses).first()
+            house = load_house_data(db)
             if house is None:
                 print("[House] House is not initialized.")
-            db.flush()
-            return house.get_data() if house is not None else None
+            return house
     except SQLAlchemyError as SQLError:
         print("[DB] Retrieving House Failed.")
         print(SQLError)
@@ -71,6 +211,8 @@ def add_user(user_id: str) -> HouseMemberData | SQLAlchemyError:
         print(SQLError)
         return SQLError
     finally:
+        # Drop anything cached while the transaction was in flight
+        access_cache.invalidate(user_id)
         db.close()
 
 
@@ -90,14 +232,18 @@ def get_house_members() -> List[HouseMemberData] | SQLAlchemyError:
 
 
 def get_user(user_id: str) -> HouseMemberData | None | SQLAlchemyError:
+    cached_user = access_cache.get(user_id)
+    if cached_user is not AccessCache.MISS:
+        return cached_user
+    # Taken before the query, an invalidation meanwhile makes `set` a no-op
+    generation = access_cache.get_generation()
     db = get_db()
     try:
         with db.begin() as txn:  # Automatically handles commit/rollback
-            # Use `first()` to avoid IndexError
-            house_member = db.query(HouseMember).filter(
-                HouseMember.userId == user_id).first()
-            db.flush()
+            house_member = db.execute(
+                get_house_member_query(user_id)).scalars().first()
             user = house_member.get_data() if house_member is not None else None
+            access_cache.set(user_id, user, generation)
             return user
     except SQLAlchemyError as SQLError:
         print("[DB] Retrieving User Failed.")
@@ -120,33 +266,17 @@ def delete_user(user_id: str) -> int | SQLAlchemyError:
         print(SQLError)
         return SQLError
     finally:
+        # Drop anything cached while the transaction was in flight
+        access_cache.invalidate(user_id)
         db.close()
 
 
 def get_access(user_id: str) -> bool | SQLAlchemyError:
-    db = get_db()
-    try:
-        with db.begin() as txn:  # Automatically handles commit/rollback
-            # Use `first()` to avoid IndexError
-            house = db.query(Houses).first()
-            if house is None:
-                print("[DB] House not initialized.")
-                raise Exception(SQLAlchemyError)
-
-            # Query for access
-            access = db.query(HouseMember).filter(
-                HouseMember.houseId == house.houseId,
-                HouseMember.userId == user_id
-            ).first()  # Use `first()` to get the result or None
-
-            db.flush()
-            return bool(access)  # Return True if access is found
-    except SQLAlchemyError as SQLError:
-        print("[DB] Retrieving Access Failed.")
-        print(SQLError)
-        return SQLError
-    finally:
-        db.close()
+    # Every member belongs to the one house, so access is membership
+    user = get_user(user_id)
+    if isinstance(user, SQLAlchemyError):
+        return user
+    return user is not None
 
 
 def create_room(room_name: str, house_id: str) -> RoomData | SQLAlchemyError:
@@ -185,10 +315,10 @@ def create_device(device_name: str, pin_number: int, wattage: float, room_id: st
     db = get_db()
     try:
         with db.begin() as txn:
-            current_default_device = db.query(Device).filter(
-                Device.roomId == room_id, Device.isDefault == True).first()
-            new_device = Device(deviceName=device_name, pinNumber=pin_number, wattage=wattage,
-                                roomId=room_id, status=False, isScheduled=False, isDefault=True if current_default_device is None else False)
+            current_default_device = db.execute(
+                get_default_device_query(room_id)).scalars().first()
+            new_device = build_new_device(
+                device_name, pin_number, wattage, room_id, current_default_device)
             db.add(new_device)
             db.flush()
             return new_device.get_data()
@@ -227,45 +357,72 @@ def switch_device(device_id: str, from_status: bool, to_status: bool, user_id: s
         db.close()
 
 
-def configure_device(device_id: str, device_name: str, pin_number: int, status: bool, is_default: bool, is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, wattage: float, user_id: str) -> int | SQLAlchemyError:
+def bulk_switch_devices(control_logs: List[Dict[str, Any]]) -> int | SQLAlchemyError:
+    '''Persists a batch of switch events in one transaction.
+
+    Each control log is a dict of `DeviceControlLogs` column values. Device
+    statuses are coalesced to the last event per device and written with at
+    most two multi-row UPDATEs, the logs with a single multi-row INSERT.
+    '''
     db = get_db()
     try:
         with db.begin() as txn:
-            device = db.query(Device).filter(Device.deviceId == device_id)
-            current_device = device.first()
-            current_device_wattage = current_device.wattage if current_device is not None else None
-            # If current device is set a sdefault then remove all other devices from default devices of the room
-            old_is_default = getattr(current_device, "isDefault", None)
-            is_new_default = old_is_default != None and old_is_default != is_default
-            if is_new_default and current_device is not None:
-                db.query(Device).filter(Device.roomId == current_device.roomId, Device.isDefault == True).update({
-                    Device.isDefault: False
-                })
-
-            new_status = get_scheduled_device_status(
-                start_time, off_time) if is_scheduled else status
-            count = device.update(
-                {
-                    Device.deviceName: device_name,
-                    Device.pinNumber: pin_number,
-                    Device.isScheduled: is_scheduled,
-                    Device.daysScheduled: days_scheduled if is_scheduled else "",
-                    Device.startTime: start_time if is_scheduled else "",
-                    Device.offTime: off_time if is_scheduled else "",
-                    Device.status: new_status,
-                    Device.isDefault: is_default,
-                    Device.scheduledBy: user_id,
-                    Device.wattage: wattage
-                }
-            )
+            latest_status: Dict[Any, bool] = {}
+            for control_log in control_logs:
+                latest_status[control_log["deviceId"]] = control_log["statusChangedTo"]
+            for to_status in (True, False):
+                device_ids = [device_id for device_id, status in latest_status.items()
+                              if status == to_status]
+                if len(device_ids) > 0:
+                    db.execute(update(Device.__table__).where(
+                        Device.__table__.c.deviceId.in_(device_ids)).values(status=to_status))
+            if len(control_logs) > 0:
+                db.execute(insert(DeviceControlLog.__table__), control_logs)
+            db.flush()
+            return len(control_logs)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Bulk Switch Devices Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
 
-            old_status = getattr(current_device, "status", None)
-            if old_status != new_status:
-                db.add(DeviceControlLog(statusChangedFrom=old_status,
-                                        statusChangedTo=new_status,
-                                        deviceId=device_id,
-                                        deviceWattage=current_device_wattage,
-                                        userId=user_id))
+def set_device_statuses(statuses: Dict[str, bool]) -> int | SQLAlchemyError:
+    '''Overwrites device statuses without logging a switch, used to bring
+    the table in line with the relays restored at boot.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            for to_status in (True, False):
+                device_ids = [device_id for device_id, status in statuses.items()
+                              if status == to_status]
+                if len(device_ids) > 0:
+                    db.execute(update(Device.__table__).where(
+                        Device.__table__.c.deviceId.in_(device_ids)).values(status=to_status))
+            db.flush()
+            return len(statuses)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Set Device Statuses Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def configure_device(device_id: str, device_name: str, pin_number: int, status: bool, is_default: bool, is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, wattage: float, user_id: str) -> int | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            current_device = db.execute(select(Device).where(
+                Device.deviceId == device_id)).scalars().first()
+            statements, control_log = get_configure_device_statements(
+                current_device, device_id, device_name, pin_number, status, is_default, is_scheduled,
+                days_scheduled, start_time, off_time, wattage, user_id)
+            for statement in statements:
+                count = db.execute(statement).rowcount
+            if control_log is not None:
+                db.add(control_log)
             db.flush()
             return count
     except SQLAlchemyError as SQLError:
@@ -293,15 +450,76 @@ def remove_device(device_id: str) -> int | SQLAlchemyError:
         db.close()
 
 
+def create_scene(scene_name: str, house_id: str, actions: List[Tuple[str, bool]], user_id: str) -> SceneData | SQLAlchemyError:
+    '''Saves a scene of `(device_id, status)` actions.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            new_scene = build_new_scene(scene_name, house_id, actions, user_id)
+            db.add(new_scene)
+            db.flush()
+            return new_scene.get_data()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Scene Creation Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_scenes() -> List[SceneData] | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            scenes = db.execute(SCENES_QUERY).scalars().all()
+            return [scene.get_data() for scene in scenes]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Scenes Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_scene(scene_id: str) -> SceneData | None | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            scene = db.execute(get_scene_query(scene_id)).scalars().first()
+            return scene.get_data() if scene is not None else None
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Scene Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def remove_scene(scene_id: str) -> int | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            count = db.query(Scene).filter(Scene.sceneId == scene_id).delete()
+            print(f"[DB] {count} Scene(s) Deleted.")
+            db.flush()
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Scene Deleting Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
 def get_house_data() -> HouseData | SQLAlchemyError:
     db = get_db()
     try:
         with db.begin() as txn:
-            house = db.query(Houses).first()
+            house = load_house_data(db)
             if house is None:
                 print("[DB] House not initialized.")
                 raise Exception(SQLAlchemyError)
-            return house.get_data()
+            return house
     except SQLAlchemyError as SQLError:
         print("[DB] Retrieve House Data Failed.")
         print(SQLError)
@@ -325,20 +543,33 @@ def get_scheduled_devices() -> List[DeviceData] | SQLAlchemyError:
         db.close()
 
 
-def get_available_gpio_pins() -> List[HeaderPinConfigDataModel] | SQLAlchemyError:
+def get_devices_updated_since(updated_after: datetime | None, updated_until: datetime | None = None) -> List[DeviceData] | SQLAlchemyError:
+    '''Devices whose `updatedAt` is after `updated_after` (every device when
+    it is None) and up to `updated_until`.'''
     db = get_db()
     try:
         with db.begin() as txn:
-            all_devices = db.query(Device).all()
-            used_gpio_pins = [int(str(device.pinNumber))
-                              for device in all_devices]
-            available_gpio_pins: List[HeaderPinConfigDataModel] = []
+            columns = Device.__table__.c
+            query = select(*columns).order_by(columns.updatedAt)
+            if updated_after is not None:
+                query = query.where(columns.updatedAt > updated_after)
+            if updated_until is not None:
+                query = query.where(columns.updatedAt <= updated_until)
+            return [Device.data_from_row(row) for row in db.execute(query)]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Updated Devices Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
 
-            for pin_config in pin_header_config:
-                if pin_config.type == HeaderPinType.GPIO and pin_config.gpio_pin_number not in used_gpio_pins:
-                    available_gpio_pins.append(pin_config.get_data())
 
-            return available_gpio_pins
+def get_available_gpio_pins() -> List[HeaderPinConfigDataModel] | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            return build_available_gpio_pins(
+                db.execute(USED_GPIO_PINS_QUERY).scalars().all())
     except SQLAlchemyError as SQLError:
         print("[DB] Retrieve Scheduled Devices Failed.")
         print(SQLError)
@@ -364,23 +595,283 @@ def get_device_control_logs() -> List[DeviceControlLogData] | SQLAlchemyError:
         db.close()
 
 
-def get_specific_device_control_logs(start_date: datetime, end_date: datetime, device_id="all") -> List[DeviceControlLogData] | SQLAlchemyError:
+def count_device_control_logs() -> int | SQLAlchemyError:
     db = get_db()
     try:
         with db.begin() as txn:
-            query = db.query(DeviceControlLog).filter(
-                DeviceControlLog.createdAt >= start_date,
-                DeviceControlLog.createdAt <= end_date)
-            if (device_id != "all"):
-                query = query.filter(DeviceControlLog.deviceId == device_id)
-            logs = query.all()
-            logs_data = [log.get_data()
-                         for log in logs] if len(logs) > 0 else []
-            db.flush()
-            return logs_data
+            return db.execute(select(func.count()).select_from(DeviceControlLog.__table__)).scalar_one()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Count Device Control Logs Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def stream_device_control_logs(on_batch: Callable[[List[DeviceControlLogData]], None], batch_size: int = 5000, inserted_after: datetime | None = None, inserted_until: datetime | None = None) -> int | SQLAlchemyError:
+    '''Reads every control log in `createdAt` order through a server-side
+    cursor and hands them to `on_batch` `batch_size` at a time.
+
+    Only one batch is held in memory, however large the table is. Returns
+    the number of logs read. `inserted_after` (exclusive) and
+    `inserted_until` (inclusive) limit the logs to those inserted in that
+    range, whatever their `createdAt`.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            columns = DeviceControlLog.__table__.c
+            query = select(*columns).order_by(columns.createdAt)
+            if inserted_after is not None:
+                query = query.where(columns.insertedAt > inserted_after)
+            if inserted_until is not None:
+                query = query.where(columns.insertedAt <= inserted_until)
+            result = db.execute(
+                query.execution_options(yield_per=batch_size))
+            count = 0
+            for rows in result.partitions():
+                on_batch([DeviceControlLog.data_from_row(row) for row in rows])
+                count += len(rows)
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Stream Device Control Logs Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_specific_device_control_logs(start_date: datetime, end_date: datetime, device_id="all", order_by_device=False) -> List[DeviceControlLogData] | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            logs = db.execute(get_specific_device_control_logs_query(
+                start_date, end_date, device_id, order_by_device)).scalars().all()
+            return [log.get_data() for log in logs]
     except SQLAlchemyError as SQLError:
         print("[DB] Fetch Specific Device Control Logs Failed.")
         print(SQLError)
         return SQLError
     finally:
         db.close()
+
+
+def stream_specific_device_control_logs(on_batch: Callable[[List[DeviceControlLogData]], None], start_date: datetime, end_date: datetime, batch_size: int = 5000) -> int | SQLAlchemyError:
+    '''`get_specific_device_control_logs` through a server-side cursor,
+    handing the logs to `on_batch` `batch_size` at a time.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            columns = DeviceControlLog.__table__.c
+            query = select(*columns).where(columns.createdAt >= start_date,
+                                           columns.createdAt <= end_date).order_by(columns.createdAt)
+            result = db.execute(
+                query.execution_options(yield_per=batch_size))
+            count = 0
+            for rows in result.partitions():
+                on_batch([DeviceControlLog.data_from_row(row) for row in rows])
+                count += len(rows)
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Stream Specific Device Control Logs Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def save_energy_checkpoints(energy_checkpoints: List[Dict[str, Any]]) -> int | SQLAlchemyError:
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            if len(energy_checkpoints) > 0:
+                db.execute(insert(EnergyCheckpoint.__table__),
+                           energy_checkpoints)
+            db.flush()
+            return len(energy_checkpoints)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Save Energy Checkpoints Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_latest_energy_checkpoints(before: datetime | None = None) -> List[EnergyCheckpointData] | SQLAlchemyError:
+    '''Returns the latest checkpoint of every device, optionally at or before `before`.
+
+    Reads `ix_EnergyCheckpoints_deviceId_checkpointAt` in order, without a sort.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            query = db.query(EnergyCheckpoint)
+            if before is not None:
+                query = query.filter(EnergyCheckpoint.checkpointAt <= before)
+            energy_checkpoints = query.distinct(EnergyCheckpoint.deviceId).order_by(
+                EnergyCheckpoint.deviceId, EnergyCheckpoint.checkpointAt.desc()).all()
+            return [energy_checkpoint.get_data() for energy_checkpoint in energy_checkpoints]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Energy Checkpoints Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+# Keeps the last checkpoint of every device and UTC day before :before
+COMPACT_ENERGY_CHECKPOINTS_SQL = """
+DELETE FROM "EnergyCheckpoints"
+WHERE "energyCheckpointId" IN (
+    SELECT "energyCheckpointId" FROM (
+        SELECT "energyCheckpointId",
+               ROW_NUMBER() OVER (PARTITION BY "deviceId", date_trunc('day', "checkpointAt", 'UTC')
+                                  ORDER BY "checkpointAt" DESC) AS day_rank
+        FROM "EnergyCheckpoints"
+        WHERE "checkpointAt" < :before
+    ) ranked
+    WHERE day_rank > 1
+)
+"""
+
+
+def compact_energy_checkpoints(before: datetime) -> int | SQLAlchemyError:
+    '''Deletes the checkpoints before `before` except each device's last of the day.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            return db.execute(text(COMPACT_ENERGY_CHECKPOINTS_SQL), {"before": before}).rowcount
+    except SQLAlchemyError as SQLError:
+        print("[DB] Compact Energy Checkpoints Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+# Pairs every ON event with the device's next state change when that one is
+# an OFF (or there is none, in which case the device is ON until the end
+# date). Repeated ON/ON and OFF/OFF events change nothing and are left out
+# before pairing, as `calculate_energy_consumption` and
+# `calculate_energy_breakdown` skip them. A closed interval is charged at
+# the OFF event's wattage, an open one at the ON event's.
+ENERGY_INTERVALS_SQL = """
+WITH logs AS (
+    SELECT "deviceId", "statusChangedFrom", "statusChangedTo", "deviceWattage", "createdAt",
+           LEAD("createdAt") OVER w AS next_at,
+           LEAD("statusChangedFrom") OVER w AS next_from,
+           LEAD("statusChangedTo") OVER w AS next_to,
+           LEAD("deviceWattage") OVER w AS next_wattage
+    FROM "DeviceControlLogs"
+    WHERE "createdAt" >= :start_date AND "createdAt" <= :end_date
+      AND "statusChangedFrom" <> "statusChangedTo" {device_filter}
+    WINDOW w AS (PARTITION BY "deviceId" ORDER BY "createdAt")
+),
+intervals AS (
+    SELECT "deviceId" AS device_id,
+           "createdAt" AS on_at,
+           COALESCE(next_at, :end_date) AS off_at,
+           CASE WHEN next_at IS NULL THEN "deviceWattage" ELSE next_wattage END AS wattage
+    FROM logs
+    WHERE "statusChangedTo" AND NOT "statusChangedFrom"
+      AND (next_at IS NULL OR (next_from AND NOT next_to))
+)
+"""
+
+ENERGY_BY_DEVICE_SQL = ENERGY_INTERVALS_SQL + """
+SELECT device_id, NULL AS period_start,
+       SUM(wattage * EXTRACT(EPOCH FROM (off_at - on_at)) / 3600) AS watt_hours
+FROM intervals
+GROUP BY device_id
+ORDER BY device_id
+"""
+
+# Periods are cut in the request's UTC offset (:tz_offset), not the session
+# time zone, so they line up with `get_period_start` in the replay.
+# `{period_interval}` is an interval literal for a period of ENERGY_PERIODS,
+# asyncpg only binds a timedelta to an interval and a month is not one.
+ENERGY_BY_DEVICE_AND_PERIOD_SQL = ENERGY_INTERVALS_SQL + """,
+local_intervals AS (
+    SELECT device_id, wattage,
+           on_at AT TIME ZONE CAST(:tz_offset AS interval) AS on_local,
+           off_at AT TIME ZONE CAST(:tz_offset AS interval) AS off_local
+    FROM intervals
+    WHERE off_at > on_at
+)
+SELECT device_id, local_period_start AT TIME ZONE CAST(:tz_offset AS interval) AS period_start,
+       SUM(wattage * EXTRACT(EPOCH FROM (
+           LEAST(off_local, local_period_start + {period_interval}) - GREATEST(on_local, local_period_start)
+       )) / 3600) AS watt_hours
+FROM local_intervals,
+     LATERAL generate_series(date_trunc(:period, on_local), off_local, {period_interval}) AS local_period_start
+WHERE local_period_start < off_local
+GROUP BY device_id, local_period_start
+ORDER BY device_id, local_period_start
+"""
+
+
+def get_device_energy_consumption_query(start_date: datetime, end_date: datetime, device_id="all", period: str | None = None):
+    params: Dict[str, Any] = {
+        "start_date": start_date, "end_date": end_date}
+    device_filter = ""
+    if (device_id != "all"):
+        device_filter = 'AND "deviceId" = CAST(:device_id AS uuid)'
+        params["device_id"] = device_id
+    if period is None:
+        sql = ENERGY_BY_DEVICE_SQL
+    else:
+        if period not in ENERGY_PERIODS:
+            raise SQLAlchemyError(f"Unknown energy period '{period}'.")
+        sql = ENERGY_BY_DEVICE_AND_PERIOD_SQL
+        params["period"] = period
+        params["tz_offset"] = start_date.utcoffset()
+    return text(sql.format(device_filter=device_filter, period_interval=f"interval '1 {period}'")).bindparams(**params)
+
+
+def build_device_energy_consumption(row, start_date: datetime) -> DeviceEnergyConsumptionData:
+    '''Period starts are keyed like `get_period_start(...).isoformat()`, in `start_date`'s offset.'''
+    consumption = DeviceEnergyConsumptionData()
+    consumption.device_id = str(row.device_id)
+    consumption.period_start = row.period_start.astimezone(start_date.tzinfo).isoformat(
+    ) if row.period_start is not None else None
+    consumption.watt_hours = float(
+        row.watt_hours) if row.watt_hours is not None else 0.0
+    return consumption
+
+
+def get_device_energy_consumption(start_date: datetime, end_date: datetime, device_id="all", period: str | None = None) -> List[DeviceEnergyConsumptionData] | SQLAlchemyError:
+    '''Computes watt-hours per device (and per hour/day/month `period`) inside Postgres.
+
+    Uses the same date and device filters as `get_specific_device_control_logs`
+    but only returns one row per device and period. `start_date` must be
+    timezone aware, its offset decides where periods start.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            rows = db.execute(get_device_energy_consumption_query(
+                start_date, end_date, device_id, period)).all()
+            return [build_device_energy_consumption(row, start_date) for row in rows]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Calculate Device Energy Consumption Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_daily_energy_summaries(start_date: datetime, end_date: datetime) -> List[DeviceEnergyConsumptionData] | SQLAlchemyError:
+    '''Watt-hours per device and UTC day (`period_start` is the date) for
+    the days whose control logs were rolled up and dropped by the log
+    retention.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            return [build_daily_energy_consumption(row) for row in db.execute(
+                get_daily_energy_summaries_query(start_date, end_date))]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Daily Energy Summaries Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
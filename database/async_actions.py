@@ -0,0 +1,331 @@
+
+from datetime import datetime
+from typing import List, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import HOUSE_COLUMNS_QUERY, SCENES_QUERY, USED_GPIO_PINS_QUERY, build_available_gpio_pins, build_daily_energy_consumption, build_device_energy_consumption, build_house_data, build_new_device, build_new_scene, get_configure_device_statements, get_daily_energy_summaries_query, get_default_device_query, get_device_columns_query, get_device_energy_consumption_query, get_house_member_query, get_room_columns_query, get_scene_query, get_specific_device_control_logs_query
+from database.database import get_async_db
+from database.db_models import Houses, HouseMember, Room, Device, Scene
+from helpers.data_models import HouseMember as HouseMemberData, Room as RoomData, Device as DeviceData, House as HouseData, DeviceControlLog as DeviceControlLogData, DeviceEnergyConsumption as DeviceEnergyConsumptionData, Scene as SceneData
+
+from services.access_cache import AccessCache, access_cache
+from helpers.header_pins import HeaderPinConfigDataModel
+
+# Async counterparts of the `database.actions` the request handlers call, so
+# a Postgres round trip no longer blocks the event loop. Background threads
+# (schedule, control log writer, energy ledger, log retention) keep using the
+# sync actions. The statements are built by `database.actions`, only their
+# execution differs. An AsyncSession cannot lazy load on attribute access, so
+# the house graph is read with the column queries.
+
+
+async def load_house_data(db) -> HouseData | None:
+    house_row = (await db.execute(HOUSE_COLUMNS_QUERY)).first()
+    if house_row is None:
+        return None
+    return build_house_data(house_row, (await db.execute(get_room_columns_query(house_row.houseId))).all(),
+                            (await db.execute(get_device_columns_query(house_row.houseId))).all())
+
+
+async def add_user(user_id: str) -> HouseMemberData | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            house = (await db.execute(select(Houses).limit(1))).scalars().first()
+            if house is None:
+                raise SQLAlchemyError("[House] House is not initialized.")
+            house_member = (await db.execute(select(HouseMember).where(
+                HouseMember.houseId == house.houseId, HouseMember.userId == user_id))).scalars().first()
+            if house_member is not None:
+                return house_member.get_data()
+            new_house_member = HouseMember(
+                userId=user_id, houseId=house.houseId)
+            db.add(new_house_member)
+            await db.flush()
+            return new_house_member.get_data()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Adding House Member Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        # Drop anything cached while the transaction was in flight
+        access_cache.invalidate(user_id)
+        await db.close()
+
+
+async def get_user(user_id: str) -> HouseMemberData | None | SQLAlchemyError:
+    cached_user = access_cache.get(user_id)
+    if cached_user is not AccessCache.MISS:
+        return cached_user
+    # Taken before the query, an invalidation meanwhile makes `set` a no-op
+    generation = access_cache.get_generation()
+    db = get_async_db()
+    try:
+        async with db.begin():
+            house_member = (await db.execute(
+                get_house_member_query(user_id))).scalars().first()
+            user = house_member.get_data() if house_member is not None else None
+            access_cache.set(user_id, user, generation)
+            return user
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieving User Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def delete_user(user_id: str) -> int | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            result = await db.execute(delete(HouseMember).where(
+                HouseMember.userId == user_id))
+            return result.rowcount
+    except SQLAlchemyError as SQLError:
+        print("[DB] Deleting User Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        # Drop anything cached while the transaction was in flight
+        access_cache.invalidate(user_id)
+        await db.close()
+
+
+async def get_access(user_id: str) -> bool | SQLAlchemyError:
+    # Every member belongs to the one house, so access is membership
+    user = await get_user(user_id)
+    if isinstance(user, SQLAlchemyError):
+        return user
+    return user is not None
+
+
+async def create_room(room_name: str, house_id: str) -> RoomData | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            # A new room has no devices, set it so `get_data` does not lazy load
+            new_room = Room(roomName=room_name, houseId=house_id, devices=[])
+            db.add(new_room)
+            await db.flush()
+            await db.refresh(new_room, ["createdAt", "updatedAt"])
+            return new_room.get_data()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Room Creation Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def remove_room(room_id: str) -> int | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            count = (await db.execute(delete(Room).where(Room.roomId == room_id))).rowcount
+            print(f"[DB] {count} Room(s) Deleted.")
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Room Deleting Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def create_device(device_name: str, pin_number: int, wattage: float, room_id: str) -> DeviceData | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            current_default_device = (await db.execute(
+                get_default_device_query(room_id))).scalars().first()
+            new_device = build_new_device(
+                device_name, pin_number, wattage, room_id, current_default_device)
+            db.add(new_device)
+            await db.flush()
+            await db.refresh(new_device, ["createdAt", "updatedAt"])
+            return new_device.get_data()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Device Creation Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def configure_device(device_id: str, device_name: str, pin_number: int, status: bool, is_default: bool, is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, wattage: float, user_id: str) -> int | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            current_device = (await db.execute(select(Device).where(
+                Device.deviceId == device_id))).scalars().first()
+            statements, control_log = get_configure_device_statements(
+                current_device, device_id, device_name, pin_number, status, is_default, is_scheduled,
+                days_scheduled, start_time, off_time, wattage, user_id)
+            for statement in statements:
+                count = (await db.execute(statement)).rowcount
+            if control_log is not None:
+                db.add(control_log)
+            await db.flush()
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Switch Device Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def remove_device(device_id: str) -> int | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            count = (await db.execute(delete(Device).where(
+                Device.deviceId == device_id))).rowcount
+            print(f"[DB] {count} Device(s) Deleted.")
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Device Deleting Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def create_scene(scene_name: str, house_id: str, actions: List[Tuple[str, bool]], user_id: str) -> SceneData | SQLAlchemyError:
+    '''Saves a scene of `(device_id, status)` actions.'''
+    db = get_async_db()
+    try:
+        async with db.begin():
+            new_scene = build_new_scene(scene_name, house_id, actions, user_id)
+            db.add(new_scene)
+            await db.flush()
+            await db.refresh(new_scene, ["createdAt", "updatedAt"])
+            return new_scene.get_data()
+    except SQLAlchemyError as SQLError:
+        print("[DB] Scene Creation Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_scenes() -> List[SceneData] | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            scenes = (await db.execute(SCENES_QUERY)).scalars().all()
+            return [scene.get_data() for scene in scenes]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Scenes Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_scene(scene_id: str) -> SceneData | None | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            scene = (await db.execute(get_scene_query(scene_id))).scalars().first()
+            return scene.get_data() if scene is not None else None
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Scene Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def remove_scene(scene_id: str) -> int | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            count = (await db.execute(delete(Scene).where(Scene.sceneId == scene_id))).rowcount
+            print(f"[DB] {count} Scene(s) Deleted.")
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Scene Deleting Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_house_data() -> HouseData | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            house = await load_house_data(db)
+            if house is None:
+                print("[DB] House not initialized.")
+                raise Exception(SQLAlchemyError)
+            return house
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve House Data Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_available_gpio_pins() -> List[HeaderPinConfigDataModel] | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            return build_available_gpio_pins(
+                (await db.execute(USED_GPIO_PINS_QUERY)).scalars().all())
+    except SQLAlchemyError as SQLError:
+        print("[DB] Retrieve Scheduled Devices Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_specific_device_control_logs(start_date: datetime, end_date: datetime, device_id="all", order_by_device=False) -> List[DeviceControlLogData] | SQLAlchemyError:
+    db = get_async_db()
+    try:
+        async with db.begin():
+            logs = (await db.execute(get_specific_device_control_logs_query(
+                start_date, end_date, device_id, order_by_device))).scalars().all()
+            return [log.get_data() for log in logs]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Specific Device Control Logs Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_device_energy_consumption(start_date: datetime, end_date: datetime, device_id="all", period: str | None = None) -> List[DeviceEnergyConsumptionData] | SQLAlchemyError:
+    '''Async `database.actions.get_device_energy_consumption`.'''
+    db = get_async_db()
+    try:
+        async with db.begin():
+            rows = (await db.execute(get_device_energy_consumption_query(
+                start_date, end_date, device_id, period))).all()
+            return [build_device_energy_consumption(row, start_date) for row in rows]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Calculate Device Energy Consumption Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
+
+
+async def get_daily_energy_summaries(start_date: datetime, end_date: datetime) -> List[DeviceEnergyConsumptionData] | SQLAlchemyError:
+    '''Async `database.actions.get_daily_energy_summaries`.'''
+    db = get_async_db()
+    try:
+        async with db.begin():
+            return [build_daily_energy_consumption(row) for row in await db.execute(
+                get_daily_energy_summaries_query(start_date, end_date))]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Daily Energy Summaries Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        await db.close()
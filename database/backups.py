@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import get_devices_updated_since, get_house_data, get_house_members, stream_device_control_logs
+from database.bulk_import import LOG_COLUMNS, iter_json_records, parse_uuid, to_device_row, to_house_row, to_log_row, to_room_row
+from database.database import get_db
+from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog
+from helpers.data_files import ProgressReporter, open_data_file
+from helpers.data_models import DeviceControlLog as DeviceControlLogData
+from services.membership_listener import notify_house_members_changed
+
+MANIFEST_VERSION = 1
+
+
+def get_file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BackupManager():
+    '''Incremental backups of the house as numbered segments.
+
+    Each segment holds the logs inserted after the previous segment's
+    watermark up to its own, the devices updated since that watermark, and
+    the small tables
+    (house, rooms, members and the list of device ids) in full. Segments
+    are gzipped NDJSON, one `{"type", "data"}` record per line, listed in
+    `manifest.json` with their watermarks, counts and sha256.
+
+    The watermark is on `insertedAt`, the time the row was inserted, not
+    `createdAt`, the switch time, which the control log writer and its
+    spill replay can write hours late. `insertedAt` is the inserting
+    transaction's start, so the watermark trails the clock by `lag_seconds`,
+    longer than any such transaction, to let it commit first. A segment is written aside and only counted
+    once the manifest lists it, so an interrupted backup is redone by the
+    next run. Restore replays the segments in order, one transaction each,
+    and records how far it got so an interrupted restore can resume.
+    '''
+    backup_dir: str
+    lag_seconds: float
+    batch_size: int
+
+    def __init__(self, backup_dir: str = "data/backups", lag_seconds: float = 300, batch_size: int = 5000):
+        self.backup_dir = backup_dir
+        self.lag_seconds = lag_seconds
+        self.batch_size = batch_size
+
+    def get_manifest_path(self) -> str:
+        return os.path.join(self.backup_dir, "manifest.json")
+
+    def get_restore_state_path(self) -> str:
+        return os.path.join(self.backup_dir, "restore_state.json")
+
+    def get_segment_path(self, segment: Dict[str, Any]) -> str:
+        return os.path.join(self.backup_dir, segment["file"])
+
+    def load_manifest(self) -> Dict[str, Any]:
+        if not os.path.exists(self.get_manifest_path()):
+            return {"version": MANIFEST_VERSION, "segments": []}
+        with open(self.get_manifest_path(), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise Exception(
+                f"[Backup] Unsupported manifest version {manifest.get('version')}.")
+        return manifest
+
+    def write_json_atomically(self, file_path: str, data: Dict[str, Any]):
+        temp_file_path = f"{file_path}.tmp"
+        with open(temp_file_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file_path, file_path)
+
+    def backup(self) -> Dict[str, Any]:
+        '''Writes the next segment and returns its manifest entry.'''
+        os.makedirs(self.backup_dir, exist_ok=True)
+        manifest = self.load_manifest()
+        segments: List[Dict[str, Any]] = manifest["segments"]
+        number = segments[-1]["number"] + 1 if len(segments) > 0 else 1
+        watermark_after = datetime.fromisoformat(
+            segments[-1]["watermark"]) if len(segments) > 0 else None
+        watermark = datetime.now(timezone.utc) - \
+            timedelta(seconds=self.lag_seconds)
+        if watermark_after is not None and watermark <= watermark_after:
+            raise Exception("[Backup] Nothing to back up since the last segment.")
+
+        house = get_house_data()
+        if isinstance(house, SQLAlchemyError):
+            raise Exception(house._message())
+        house_members = get_house_members()
+        if isinstance(house_members, SQLAlchemyError):
+            raise Exception(house_members._message())
+        # Not capped at the watermark, a device in two segments is upserted twice
+        devices = get_devices_updated_since(watermark_after)
+        if isinstance(devices, SQLAlchemyError):
+            raise Exception(devices._message())
+
+        segment = {
+            "number": number,
+            "file": f"segment-{number:06d}.ndjson.gz",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "watermark_after": watermark_after.isoformat() if watermark_after is not None else None,
+            "watermark": watermark.isoformat(),
+            "devices": len(devices),
+            "logs": 0
+        }
+        segment_path = self.get_segment_path(segment)
+        temp_segment_path = f"{segment_path}.tmp"
+        progress = ProgressReporter(f"Backup Segment {number}")
+
+        with open_data_file(temp_segment_path, "w", "gzip") as f:
+            def write_record(record_type: str, data: Any):
+                f.write(json.dumps({"type": record_type, "data": data},
+                        ensure_ascii=False) + "\n")
+
+            house_data = house.to_unsafe_dict()
+            write_record("house", {key: value for key, value in house_data.items()
+                                   if key != "rooms"})
+            for room in house_data["rooms"]:
+                write_record("room", {key: value for key, value in room.items()
+                                      if key != "devices"})
+            for house_member in house_members:
+                write_record("member", house_member.to_dict())
+            write_record("device_ids", [device.device_id
+                                        for room in house.rooms for device in room.devices])
+            for device in devices:
+                write_record("device", device.to_dict())
+
+            def write_logs(logs: List[DeviceControlLogData]):
+                f.write("".join(json.dumps({"type": "log", "data": log.to_dict()}, ensure_ascii=False) + "\n"
+                                for log in logs))
+                progress.add(len(logs))
+
+            logs_written = stream_device_control_logs(
+                write_logs, batch_size=self.batch_size, inserted_after=watermark_after, inserted_until=watermark)
+            if isinstance(logs_written, SQLAlchemyError):
+                raise Exception(logs_written._message())
+            segment["logs"] = logs_written
+
+        os.replace(temp_segment_path, segment_path)
+        segment["bytes"] = os.path.getsize(segment_path)
+        segment["sha256"] = get_file_sha256(segment_path)
+        segments.append(segment)
+        self.write_json_atomically(self.get_manifest_path(), manifest)
+        progress.finish()
+        return segment
+
+    def verify(self) -> List[str]:
+        '''Returns a problem per missing or corrupt segment.'''
+        problems: List[str] = []
+        for segment in self.load_manifest()["segments"]:
+            segment_path = self.get_segment_path(segment)
+            if not os.path.exists(segment_path):
+                problems.append(f"Segment {segment['number']} is missing.")
+            elif get_file_sha256(segment_path) != segment["sha256"]:
+                problems.append(
+                    f"Segment {segment['number']} does not match its checksum.")
+        return problems
+
+    def restore(self, resume: bool = False) -> int:
+        '''Replays the segments in order and returns how many were applied.
+
+        With `resume` the segments already applied by an interrupted
+        restore are skipped.
+        '''
+        segments = self.load_manifest()["segments"]
+        restored_through = 0
+        if resume and os.path.exists(self.get_restore_state_path()):
+            with open(self.get_restore_state_path(), "r", encoding="utf-8") as f:
+                restored_through = json.load(f)["restored_through"]
+
+        applied = 0
+        for segment in segments:
+            if segment["number"] <= restored_through:
+                continue
+            segment_path = self.get_segment_path(segment)
+            if get_file_sha256(segment_path) != segment["sha256"]:
+                raise Exception(
+                    f"[Backup] Segment {segment['number']} does not match its checksum.")
+            result = self.apply_segment(segment_path, segment["number"])
+            if isinstance(result, SQLAlchemyError):
+                raise Exception(result._message())
+            self.write_json_atomically(self.get_restore_state_path(), {
+                "restored_through": segment["number"]})
+            applied += 1
+        return applied
+
+    def apply_segment(self, segment_path: str, number: int) -> int | SQLAlchemyError:
+        '''Upserts a segment in one transaction, returns the logs inserted.
+
+        Logs already present are skipped, so replaying a segment twice is
+        harmless.
+        '''
+        progress = ProgressReporter(f"Restore Segment {number}")
+        db = get_db()
+        try:
+            with db.begin() as txn:
+                house_row: Dict[str, Any] | None = None
+                room_rows: List[Dict[str, Any]] = []
+                member_rows: List[Dict[str, Any]] = []
+                device_wattages: Dict[Any, float | None] = {}
+                log_rows: List[tuple] = []
+                inserted = 0
+
+                def insert_logs():
+                    nonlocal inserted
+                    if len(log_rows) > 0:
+                        result = db.execute(pg_insert(DeviceControlLog.__table__).on_conflict_do_nothing(), [
+                                            dict(zip(LOG_COLUMNS, row)) for row in log_rows])
+                        inserted += max(result.rowcount, 0)
+                        progress.add(len(log_rows))
+                        log_rows.clear()
+
+                for record in iter_json_records(segment_path):
+                    record_type, data = record["type"], record["data"]
+                    if record_type == "house":
+                        house_row = to_house_row(data)
+                        db.execute(pg_insert(Houses.__table__).values(house_row).on_conflict_do_update(
+                            index_elements=["houseId"], set_={key: value for key, value in house_row.items() if key != "houseId"}))
+                    elif record_type == "room" and house_row is not None:
+                        room_rows.append(to_room_row(
+                            data, house_row["houseId"]))
+                    elif record_type == "member" and house_row is not None:
+                        member_rows.append(
+                            {"userId": str(data["user_id"]), "houseId": house_row["houseId"]})
+                    elif record_type == "device_ids" and house_row is not None:
+                        # Rooms and members are complete, replace them before the devices
+                        self.replace_rooms_and_members(
+                            db, house_row["houseId"], room_rows, member_rows)
+                        device_ids = [parse_uuid(device_id, "device_id")
+                                      for device_id in data]
+                        device_wattages = {
+                            device_id: None for device_id in device_ids}
+                        db.execute(delete(Device.__table__).where(
+                            Device.__table__.c.deviceId.not_in(device_ids)))
+                    elif record_type == "device":
+                        device_row = to_device_row(
+                            data, parse_uuid(data["room_id"], "room_id"))
+                        device_wattages[device_row["deviceId"]] = device_row["wattage"]
+                        db.execute(pg_insert(Device.__table__).values(device_row).on_conflict_do_update(
+                            index_elements=["deviceId"], set_={key: value for key, value in device_row.items() if key != "deviceId"}))
+                    elif record_type == "log":
+                        log_rows.append(to_log_row(
+                            data, device_wattages, allow_unknown_devices=True))
+                        if len(log_rows) >= self.batch_size:
+                            insert_logs()
+                insert_logs()
+            progress.finish()
+            return inserted
+        except SQLAlchemyError as SQLError:
+            print("[DB] Restoring Backup Segment Failed.")
+            print(SQLError)
+            return SQLError
+        finally:
+            db.close()
+
+    def replace_rooms_and_members(self, db, house_id, room_rows: List[Dict[str, Any]], member_rows: List[Dict[str, Any]]):
+        room_ids = [room_row["roomId"] for room_row in room_rows]
+        # Devices of a dropped room go with it
+        db.execute(delete(Room.__table__).where(Room.__table__.c.houseId == house_id,
+                                                Room.__table__.c.roomId.not_in(room_ids)))
+        for room_row in room_rows:
+            db.execute(pg_insert(Room.__table__).values(room_row).on_conflict_do_update(
+                index_elements=["roomId"], set_={key: value for key, value in room_row.items() if key != "roomId"}))
+        db.execute(delete(HouseMember.__table__).where(
+            HouseMember.__table__.c.houseId == house_id))
+        if len(member_rows) > 0:
+            db.execute(insert(HouseMember.__table__), member_rows)
+        # The running server drops its access cache once this commits
+        notify_house_members_changed(db)
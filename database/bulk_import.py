@@ -0,0 +1,294 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.database import get_db
+from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog
+from helpers.data_files import ProgressReporter, open_data_file
+from services.membership_listener import notify_house_members_changed
+
+# Column order of the log rows built by `to_log_row`
+LOG_COLUMNS = ["deviceControlLogId", "statusChangedFrom", "statusChangedTo",
+               "deviceId", "deviceWattage", "userId", "createdAt", "updatedAt"]
+
+IMPORT_METHODS = ["copy", "executemany"]
+
+# Validation errors printed in full, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+def iter_json_records(file_path: str) -> Iterator[Dict[str, Any]]:
+    '''Yields the objects of an export file one at a time.
+
+    Reads NDJSON, and JSON arrays with one element per line as written by
+    `save_house_data.py`. Arrays laid out otherwise (the indented exports of
+    older versions) are loaded whole.
+    '''
+    yielded = 0
+    with open_data_file(file_path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            stripped = line.strip().rstrip(",")
+            if stripped in ["", "[", "]", "[]"]:
+                continue
+            try:
+                record = json.loads(stripped)
+            except json.JSONDecodeError:
+                if yielded > 0:
+                    raise Exception(
+                        f"[Import] Unreadable line {line_number} in {file_path}.")
+                break
+            yielded += 1
+            yield record
+        else:
+            return
+
+    with open_data_file(file_path, "r") as f:
+        yield from json.load(f)
+
+
+def parse_uuid(value: Any, field: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ValueError(f"'{field}' is not a UUID: {value!r}")
+
+
+def parse_bool(value: Any, field: str) -> bool:
+    if not isinstance(value, bool):
+        raise ValueError(f"'{field}' is not a boolean: {value!r}")
+    return value
+
+
+def parse_datetime(value: Any, field: str) -> datetime:
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"'{field}' is not a timestamp: {value!r}")
+
+
+def to_log_row(log: Dict[str, Any], device_wattages: Dict[uuid.UUID, float | None], allow_unknown_devices: bool = False) -> Tuple:
+    '''Validates an exported control log and returns its `LOG_COLUMNS` values.
+
+    Logs of devices missing from `device_wattages` are rejected, unless
+    `allow_unknown_devices` (logs outlive the device they were made for).
+    '''
+    try:
+        device_id = parse_uuid(log["device_id"], "device_id")
+        if device_id not in device_wattages and not allow_unknown_devices:
+            raise ValueError(f"unknown device {device_id}")
+        created_at = parse_datetime(log["created_at"], "created_at")
+        updated_at = parse_datetime(log["updated_at"], "updated_at") if log.get(
+            "updated_at") is not None else created_at
+        wattage = log.get("device_wattage")
+        return (parse_uuid(log["device_control_log_id"], "device_control_log_id"),
+                parse_bool(log["status_changed_from"], "status_changed_from"),
+                parse_bool(log["status_changed_to"],
+                           "status_changed_to"),
+                device_id,
+                float(wattage) if wattage is not None else device_wattages.get(device_id),
+                str(log["user_id"]),
+                created_at,
+                updated_at)
+    except KeyError as e:
+        raise ValueError(f"missing {e}")
+
+
+def to_house_row(house: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "houseId": parse_uuid(house["house_id"], "house_id"),
+        "houseName": str(house["house_name"]),
+        "passwordHash": str(house["house_password_hash"]),
+        "createdAt": parse_datetime(house["created_at"], "created_at"),
+        "updatedAt": parse_datetime(house["updated_at"], "updated_at")
+    }
+
+
+def to_room_row(room: Dict[str, Any], house_id: uuid.UUID) -> Dict[str, Any]:
+    return {
+        "roomId": parse_uuid(room["room_id"], "room_id"),
+        "roomName": room["room_name"],
+        "houseId": house_id,
+        "createdAt": parse_datetime(room["created_at"], "created_at"),
+        "updatedAt": parse_datetime(room["updated_at"], "updated_at")
+    }
+
+
+def to_device_row(device: Dict[str, Any], room_id: uuid.UUID) -> Dict[str, Any]:
+    return {
+        "deviceId": parse_uuid(device["device_id"], "device_id"),
+        "deviceName": str(device["device_name"]),
+        "pinNumber": int(device["pin_number"]),
+        "status": parse_bool(device["status"], "status"),
+        "isDefault": parse_bool(device["is_default"], "is_default"),
+        "roomId": room_id,
+        "isScheduled": parse_bool(device["is_scheduled"], "is_scheduled"),
+        "daysScheduled": device.get("days_scheduled"),
+        "startTime": device.get("start_time"),
+        "offTime": device.get("off_time"),
+        "scheduledBy": device.get("scheduled_by"),
+        "wattage": float(device["wattage"]) if device.get("wattage") is not None else None,
+        "createdAt": parse_datetime(device["created_at"], "created_at"),
+        "updatedAt": parse_datetime(device["updated_at"], "updated_at")
+    }
+
+
+def copy_log_rows(db, rows: List[Tuple]):
+    '''Sends `LOG_COLUMNS` rows with Postgres `COPY` on the session's connection.'''
+    buffer = io.StringIO()
+    # Strings are quoted so an empty one is not read as NULL
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow([str(value) if isinstance(value, (uuid.UUID, datetime)) else value
+                         for value in row])
+    buffer.seek(0)
+    columns = ", ".join(f'"{column}"' for column in LOG_COLUMNS)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{DeviceControlLog.__tablename__}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    except Exception as e:
+        raise SQLAlchemyError(f"[Import] COPY failed. {e}")
+    finally:
+        cursor.close()
+
+
+class BulkImporter():
+    '''Restores an export of `save_house_data.py` into an empty database.
+
+    The house, rooms, devices and members keep their exported ids, so logs
+    are matched to their device through a dict index instead of a scan per
+    device. Logs are streamed from the export and inserted `batch_size` at
+    a time with Postgres `COPY` (or a batched `executemany`), all in one
+    transaction: a failed import leaves the database untouched.
+
+    With `dry_run` the files are only read and validated, the database is
+    not touched.
+    '''
+    method: str
+    batch_size: int
+    dry_run: bool
+
+    house_row: Dict[str, Any] | None
+    room_rows: List[Dict[str, Any]]
+    device_rows: List[Dict[str, Any]]
+    member_rows: List[Dict[str, Any]]
+    device_wattages: Dict[uuid.UUID, float | None]
+
+    logs_imported: int = 0
+    logs_skipped: int = 0
+    errors: List[str]
+
+    def __init__(self, method: str = "copy", batch_size: int = 5000, dry_run: bool = False):
+        if method not in IMPORT_METHODS:
+            raise Exception(f"[Import] Unknown import method '{method}'.")
+        self.method = method
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.house_row = None
+        self.room_rows = []
+        self.device_rows = []
+        self.member_rows = []
+        self.device_wattages = {}
+        self.errors = []
+
+    def add_error(self, message: str):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            print(f"[Import] {message}")
+        self.errors.append(message)
+
+    def read_house(self, house_data: Dict[str, Any], house_members: List[Dict[str, Any]]):
+        '''Validates the house export and builds its rows, invalid rows raise.'''
+        self.house_row = to_house_row(house_data)
+        house_id = self.house_row["houseId"]
+        for room in house_data["rooms"]:
+            room_row = to_room_row(room, house_id)
+            self.room_rows.append(room_row)
+            for device in room["devices"]:
+                device_row = to_device_row(device, room_row["roomId"])
+                if device_row["deviceId"] in self.device_wattages:
+                    raise ValueError(
+                        f"device {device_row['deviceId']} is listed twice")
+                self.device_wattages[device_row["deviceId"]] = device_row["wattage"]
+                self.device_rows.append(device_row)
+        self.member_rows = [{"userId": str(house_member["user_id"]), "houseId": house_id}
+                            for house_member in house_members]
+
+    def iter_log_batches(self, logs_path: str, progress: ProgressReporter) -> Iterator[List[Tuple]]:
+        batch: List[Tuple] = []
+        for line_number, log in enumerate(iter_json_records(logs_path), start=1):
+            try:
+                batch.append(to_log_row(log, self.device_wattages))
+            except (ValueError, TypeError) as e:
+                self.logs_skipped += 1
+                self.add_error(f"Skipping log {line_number}, {e}.")
+                continue
+            if len(batch) >= self.batch_size:
+                progress.add(len(batch))
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            progress.add(len(batch))
+            yield batch
+
+    def insert_logs(self, db, rows: List[Tuple]):
+        if self.method == "copy":
+            copy_log_rows(db, rows)
+        else:
+            db.execute(insert(DeviceControlLog.__table__), [
+                       dict(zip(LOG_COLUMNS, row)) for row in rows])
+        self.logs_imported += len(rows)
+
+    def run(self, house_data: Dict[str, Any], house_members: List[Dict[str, Any]], logs_path: str) -> Dict[str, Any] | SQLAlchemyError:
+        self.read_house(house_data, house_members)
+        progress = ProgressReporter(
+            "Import Device Control Logs" if not self.dry_run else "Validate Device Control Logs")
+
+        if self.dry_run:
+            for batch in self.iter_log_batches(logs_path, progress):
+                pass
+            progress.finish()
+            return self.get_report(progress)
+
+        db = get_db()
+        try:
+            with db.begin() as txn:
+                if db.execute(select(Houses.__table__.c.houseId).limit(1)).first() is not None:
+                    raise SQLAlchemyError(
+                        "[Import] The database already has a house, restore into an empty database.")
+                db.execute(insert(Houses.__table__), [self.house_row])
+                if len(self.room_rows) > 0:
+                    db.execute(insert(Room.__table__), self.room_rows)
+                if len(self.device_rows) > 0:
+                    db.execute(insert(Device.__table__), self.device_rows)
+                if len(self.member_rows) > 0:
+                    db.execute(insert(HouseMember.__table__), self.member_rows)
+                for batch in self.iter_log_batches(logs_path, progress):
+                    self.insert_logs(db, batch)
+                notify_house_members_changed(db)
+            progress.finish()
+            return self.get_report(progress)
+        except SQLAlchemyError as SQLError:
+            print("[DB] Bulk Import Failed.")
+            print(SQLError)
+            return SQLError
+        finally:
+            db.close()
+
+    def get_report(self, progress: ProgressReporter) -> Dict[str, Any]:
+        return {
+            "dry_run": self.dry_run,
+            "method": self.method,
+            "rooms": len(self.room_rows),
+            "devices": len(self.device_rows),
+            "house_members": len(self.member_rows),
+            "logs": progress.count if self.dry_run else self.logs_imported,
+            "logs_skipped": self.logs_skipped,
+            "logs_per_second": progress.get_rows_per_second(),
+            "errors": len(self.errors)
+        }
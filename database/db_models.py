@@ -1,12 +1,12 @@
 from typing import List
 
-from sqlalchemy import Column, Integer, Boolean, Float, Text, ForeignKey, DateTime, func, VARCHAR
+from sqlalchemy import Column, Integer, Boolean, Date, Float, Text, ForeignKey, DateTime, Index, func, VARCHAR
 from sqlalchemy.orm import relationship, Mapped
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from .database import Base
 
-from helpers.data_models import House, Room as RoomData, Device as DeviceData, HouseMember as HouseMemberData, DeviceControlLog as DeviceControlLogData
+from helpers.data_models import House, Room as RoomData, Device as DeviceData, HouseMember as HouseMemberData, DeviceControlLog as DeviceControlLogData, EnergyCheckpoint as EnergyCheckpointData, Scene as SceneData, SceneAction as SceneActionData
 
 
 class Houses(Base):
@@ -25,13 +25,18 @@ class Houses(Base):
                                                cascade='all, delete-orphan')
 
     def get_data(self):
+        return Houses.data_from_row(self, [room.get_data() for room in self.rooms])
+
+    @staticmethod
+    def data_from_row(row, rooms: List[RoomData]):
+        '''Builds the data model from a `Houses` instance or a row of its columns.'''
         house = House()
-        house.house_id = str(self.houseId)
-        house.house_name = str(self.houseName)
-        house.house_password_hash = str(self.passwordHash)
-        house.created_at = str(self.createdAt)
-        house.updated_at = str(self.updatedAt)
-        house.rooms = [room.get_data() for room in self.rooms]
+        house.house_id = str(row.houseId)
+        house.house_name = str(row.houseName)
+        house.house_password_hash = str(row.passwordHash)
+        house.created_at = str(row.createdAt)
+        house.updated_at = str(row.updatedAt)
+        house.rooms = rooms
         return house
 
 
@@ -68,13 +73,18 @@ class Room(Base):
                                                    cascade='all, delete-orphan')
 
     def get_data(self):
+        return Room.data_from_row(self, [device.get_data() for device in self.devices])
+
+    @staticmethod
+    def data_from_row(row, devices: List[DeviceData]):
+        '''Builds the data model from a `Room` instance or a row of its columns.'''
         room = RoomData()
-        room.room_id = str(self.roomId)
-        room.room_name = str(self.roomName)
-        room.house_id = str(self.houseId)
-        room.created_at = str(self.createdAt)
-        room.updated_at = str(self.updatedAt)
-        room.devices = [device.get_data() for device in self.devices]
+        room.room_id = str(row.roomId)
+        room.room_name = str(row.roomName)
+        room.house_id = str(row.houseId)
+        room.created_at = str(row.createdAt)
+        room.updated_at = str(row.updatedAt)
+        room.devices = devices
         return room
 
 
@@ -100,31 +110,48 @@ class Device(Base):
     ), onupdate=func.now(), nullable=False)
 
     def get_data(self):
+        return Device.data_from_row(self)
+
+    @staticmethod
+    def data_from_row(row):
+        '''Builds the data model from a `Device` instance or a row of its columns.'''
         device = DeviceData()
-        device.device_id = str(self.deviceId)
-        device.device_name = str(self.deviceName)
-        device.pin_number = int(str(self.pinNumber))
-        device.status = bool(self.status)
-        device.is_default = bool(self.isDefault)
-        device.room_id = str(self.roomId)
-        device.is_scheduled = bool(self.isScheduled)
+        device.device_id = str(row.deviceId)
+        device.device_name = str(row.deviceName)
+        device.pin_number = int(row.pinNumber)
+        device.status = bool(row.status)
+        device.is_default = bool(row.isDefault)
+        device.room_id = str(row.roomId)
+        device.is_scheduled = bool(row.isScheduled)
         device.days_scheduled = str(
-            self.daysScheduled) if self.daysScheduled is not None else None
+            row.daysScheduled) if row.daysScheduled is not None else None
         device.start_time = str(
-            self.startTime) if self.startTime is not None else None
+            row.startTime) if row.startTime is not None else None
         device.off_time = str(
-            self.offTime) if self.offTime is not None else None
+            row.offTime) if row.offTime is not None else None
         device.scheduled_by = str(
-            self.scheduledBy) if self.scheduledBy is not None else None
+            row.scheduledBy) if row.scheduledBy is not None else None
         device.wattage = float(
-            str(self.wattage)) if self.wattage is not None else None
-        device.created_at = str(self.createdAt)
-        device.updated_at = str(self.updatedAt)
+            row.wattage) if row.wattage is not None else None
+        device.created_at = str(row.createdAt)
+        device.updated_at = str(row.updatedAt)
         return device
 
 
 class DeviceControlLog(Base):
     __tablename__ = "DeviceControlLogs"
+    __table_args__ = (
+        # Energy queries filter on a createdAt range, optionally per device
+        Index("ix_DeviceControlLogs_deviceId_createdAt",
+              "deviceId", "createdAt"),
+        # Logs are append-only, so createdAt follows the physical row order
+        # and a BRIN index covers time ranges at a fraction of a B-tree's size
+        Index("ix_DeviceControlLogs_createdAt_brin",
+              "createdAt", postgresql_using="brin"),
+        # Incremental backups read the logs inserted since their watermark
+        Index("ix_DeviceControlLogs_insertedAt_brin",
+              "insertedAt", postgresql_using="brin"),
+    )
 
     deviceControlLogId = Column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -133,19 +160,112 @@ class DeviceControlLog(Base):
     deviceId = Column(UUID(as_uuid=True), nullable=False)
     deviceWattage = Column(Float, nullable=True)
     userId = Column(Text, nullable=False)
-    createdAt = Column(DateTime(timezone=True),
+    # Part of the primary key, the table is partitioned on it
+    createdAt = Column(DateTime(timezone=True), primary_key=True,
                        server_default=func.now(), nullable=False)
     updatedAt = Column(DateTime(timezone=True), server_default=func.now(
     ), onupdate=func.now(), nullable=False)
+    # When the row reached the table, `createdAt` is the switch time and
+    # the write-behind writer may insert it much later
+    insertedAt = Column(DateTime(timezone=True),
+                        server_default=func.now(), nullable=False)
 
     def get_data(self):
+        return DeviceControlLog.data_from_row(self)
+
+    @staticmethod
+    def data_from_row(row):
+        '''Builds the data model from a `DeviceControlLog` instance or a row of its columns.'''
         device_control_log = DeviceControlLogData()
-        device_control_log.device_control_log_id = str(self.deviceControlLogId)
-        device_control_log.device_id = str(self.deviceId)
-        device_control_log.device_wattage = float(str(self.deviceWattage))
-        device_control_log.user_id = str(self.userId)
-        device_control_log.status_changed_from = bool(self.statusChangedFrom)
-        device_control_log.status_changed_to = bool(self.statusChangedTo)
-        device_control_log.created_at = self.createdAt.isoformat()
-        device_control_log.updated_at = self.updatedAt.isoformat()
+        device_control_log.device_control_log_id = str(row.deviceControlLogId)
+        device_control_log.device_id = str(row.deviceId)
+        device_control_log.device_wattage = float(
+            str(row.deviceWattage)) if row.deviceWattage is not None else None
+        device_control_log.user_id = str(row.userId)
+        device_control_log.status_changed_from = bool(row.statusChangedFrom)
+        device_control_log.status_changed_to = bool(row.statusChangedTo)
+        device_control_log.created_at = row.createdAt.isoformat()
+        device_control_log.updated_at = row.updatedAt.isoformat()
         return device_control_log
+
+
+class EnergyCheckpoint(Base):
+    __tablename__ = "EnergyCheckpoints"
+    __table_args__ = (
+        # The latest checkpoint per device, optionally before a time
+        Index("ix_EnergyCheckpoints_deviceId_checkpointAt",
+              "deviceId", "checkpointAt"),
+    )
+
+    energyCheckpointId = Column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    deviceId = Column(UUID(as_uuid=True), nullable=False)
+    cumulativeWattHours = Column(Float, nullable=False)
+    isOn = Column(Boolean, nullable=False)
+    wattage = Column(Float, nullable=True)
+    checkpointAt = Column(DateTime(timezone=True), nullable=False)
+
+    def get_data(self):
+        energy_checkpoint = EnergyCheckpointData()
+        energy_checkpoint.device_id = str(self.deviceId)
+        energy_checkpoint.cumulative_watt_hours = float(
+            str(self.cumulativeWattHours))
+        energy_checkpoint.is_on = bool(self.isOn)
+        energy_checkpoint.wattage = float(
+            str(self.wattage)) if self.wattage is not None else None
+        energy_checkpoint.checkpoint_at = self.checkpointAt.isoformat()
+        return energy_checkpoint
+
+
+class DeviceEnergyDailySummary(Base):
+    __tablename__ = "DeviceEnergyDailySummaries"
+
+    deviceId = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    onSeconds = Column(Float, nullable=False, default=0.0)
+    wattHours = Column(Float, nullable=False, default=0.0)
+
+
+class Scene(Base):
+    __tablename__ = "Scenes"
+
+    sceneId = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    sceneName = Column(Text, nullable=False)
+    houseId = Column(UUID(as_uuid=True), ForeignKey(
+        'House.houseId', ondelete='CASCADE'), nullable=False)
+    createdBy = Column(Text, nullable=False)
+    createdAt = Column(DateTime(timezone=True),
+                       server_default=func.now(), nullable=False)
+    updatedAt = Column(DateTime(timezone=True), server_default=func.now(
+    ), onupdate=func.now(), nullable=False)
+
+    # Relationships
+    actions: Mapped[List["SceneAction"]] = relationship('SceneAction',
+                                                        cascade='all, delete-orphan')
+
+    def get_data(self):
+        scene = SceneData()
+        scene.scene_id = str(self.sceneId)
+        scene.scene_name = str(self.sceneName)
+        scene.house_id = str(self.houseId)
+        scene.created_by = str(self.createdBy)
+        scene.created_at = str(self.createdAt)
+        scene.updated_at = str(self.updatedAt)
+        scene.actions = [action.get_data() for action in self.actions]
+        return scene
+
+
+class SceneAction(Base):
+    __tablename__ = "SceneActions"
+
+    sceneId = Column(UUID(as_uuid=True), ForeignKey(
+        'Scenes.sceneId', ondelete='CASCADE'), primary_key=True)
+    deviceId = Column(UUID(as_uuid=True), ForeignKey(
+        'Devices.deviceId', ondelete='CASCADE'), primary_key=True)
+    status = Column(Boolean, nullable=False)
+
+    def get_data(self):
+        scene_action = SceneActionData()
+        scene_action.device_id = str(self.deviceId)
+        scene_action.status = bool(self.status)
+        return scene_action
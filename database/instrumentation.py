@@ -0,0 +1,143 @@
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class DatabaseMetrics():
+    '''Statement latency, pool checkout wait and slow query samples.
+
+    Fed by SQLAlchemy engine events and the instrumented pools below, for
+    both the sync and the async engine.
+    '''
+    slow_query_ms: float
+    statement_count: int
+    statement_seconds: float
+    statement_max_seconds: float
+    statement_latencies: Deque[float]
+    checkout_count: int
+    checkout_wait_seconds: float
+    checkout_max_wait_seconds: float
+    checkout_waits: Deque[float]
+    slow_queries: Deque[Dict]
+
+    lock: threading.Lock
+
+    def __init__(self, slow_query_ms: float = 200, sample_size: int = 1000, slow_query_samples: int = 20):
+        self.slow_query_ms = slow_query_ms
+        self.statement_count = 0
+        self.statement_seconds = 0.0
+        self.statement_max_seconds = 0.0
+        self.statement_latencies = deque(maxlen=sample_size)
+        self.checkout_count = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_max_wait_seconds = 0.0
+        self.checkout_waits = deque(maxlen=sample_size)
+        self.slow_queries = deque(maxlen=slow_query_samples)
+        self.lock = threading.Lock()
+
+    def instrument(self, engine: Engine):
+        '''Times every statement run on `engine` (pass `sync_engine` for an AsyncEngine).'''
+        event.listen(engine, "before_cursor_execute",
+                     self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute",
+                     self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    # A connection runs one statement at a time, so a single start time is
+    # kept, overwritten by the next statement and dropped when one fails
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["statement_started_at"] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info.pop("statement_started_at", None)
+        if started_at is not None:
+            self.record_statement(statement, time.perf_counter() - started_at)
+
+    def _handle_error(self, exception_context):
+        if exception_context.connection is not None:
+            exception_context.connection.info.pop(
+                "statement_started_at", None)
+
+    def record_statement(self, statement: str, seconds: float):
+        with self.lock:
+            self.statement_count += 1
+            self.statement_seconds += seconds
+            self.statement_max_seconds = max(
+                self.statement_max_seconds, seconds)
+            self.statement_latencies.append(seconds)
+            if seconds * 1000 >= self.slow_query_ms:
+                self.slow_queries.append({
+                    "statement": " ".join(statement.split())[:500],
+                    "duration_ms": seconds * 1000,
+                    "at": datetime.now().astimezone().isoformat()
+                })
+
+    def record_checkout(self, seconds: float):
+        with self.lock:
+            self.checkout_count += 1
+            self.checkout_wait_seconds += seconds
+            self.checkout_max_wait_seconds = max(
+                self.checkout_max_wait_seconds, seconds)
+            self.checkout_waits.append(seconds)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "statements": {
+                    "count": self.statement_count,
+                    "avg_ms": self.statement_seconds / self.statement_count * 1000 if self.statement_count > 0 else 0.0,
+                    "max_ms": self.statement_max_seconds * 1000,
+                    **get_percentiles_ms(list(self.statement_latencies))
+                },
+                "pool_checkout": {
+                    "count": self.checkout_count,
+                    "avg_wait_ms": self.checkout_wait_seconds / self.checkout_count * 1000 if self.checkout_count > 0 else 0.0,
+                    "max_wait_ms": self.checkout_max_wait_seconds * 1000,
+                    **get_percentiles_ms(list(self.checkout_waits))
+                },
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries": list(self.slow_queries)
+            }
+
+
+def get_percentiles_ms(samples: List[float]):
+    if len(samples) < 2:
+        latest_ms = samples[0] * 1000 if len(samples) > 0 else 0.0
+        return {"p50_ms": latest_ms, "p99_ms": latest_ms}
+    quantiles = statistics.quantiles(samples, n=100)
+    return {"p50_ms": quantiles[49] * 1000, "p99_ms": quantiles[98] * 1000}
+
+
+class InstrumentedQueuePool(QueuePool):
+    '''QueuePool that reports how long each checkout waited for a connection.'''
+    metrics: DatabaseMetrics | None = None
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_checkout(
+                    time.perf_counter() - started_at)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    '''AsyncAdaptedQueuePool that reports how long each checkout waited for a connection.'''
+    metrics: DatabaseMetrics | None = None
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_checkout(
+                    time.perf_counter() - started_at)
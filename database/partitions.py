@@ -0,0 +1,274 @@
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.database import get_db
+from database.db_models import DeviceControlLog
+
+LOG_TABLE = "DeviceControlLogs"
+# Catches logs outside every monthly partition, e.g. restored or replayed
+# logs older than the oldest partition
+DEFAULT_PARTITION = f"{LOG_TABLE}_default"
+# Lower bound of the default partition's roll-up range
+EARLIEST = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+
+def get_month_start(at: datetime) -> datetime:
+    at = at.astimezone(timezone.utc)
+    return datetime(at.year, at.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month_start: datetime, months: int) -> datetime:
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def get_partition_name(month_start: datetime) -> str:
+    return f"{LOG_TABLE}_{month_start.year:04d}_{month_start.month:02d}"
+
+
+def is_log_table_partitioned() -> bool | None | SQLAlchemyError:
+    '''Returns None when the log table does not exist yet.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            relkind = db.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+                                 {"table": f'"{LOG_TABLE}"'}).scalar()
+            return None if relkind is None else relkind == "p"
+    except SQLAlchemyError as SQLError:
+        print("[DB] Checking Log Partitioning Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def partition_log_table() -> int | SQLAlchemyError:
+    '''Converts the plain log table into one range-partitioned by month on
+    createdAt, moving the existing rows. Returns the number of rows moved.
+
+    Runs in a single transaction that locks the table until every row is
+    moved, so it is left to `partition_control_logs.py` rather than the
+    server.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            db.execute(text(
+                f'ALTER TABLE "{LOG_TABLE}" RENAME TO "{LOG_TABLE}_unpartitioned"'))
+            db.execute(text(
+                f'ALTER TABLE "{LOG_TABLE}_unpartitioned" RENAME CONSTRAINT "{LOG_TABLE}_pkey" TO "{LOG_TABLE}_unpartitioned_pkey"'))
+            for index in DeviceControlLog.__table__.indexes:
+                db.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+            db.execute(text(
+                f'CREATE TABLE "{LOG_TABLE}" (LIKE "{LOG_TABLE}_unpartitioned" INCLUDING DEFAULTS) PARTITION BY RANGE ("createdAt")'))
+            # The partition key has to be part of the primary key
+            db.execute(text(
+                f'ALTER TABLE "{LOG_TABLE}" ADD CONSTRAINT "{LOG_TABLE}_pkey" PRIMARY KEY ("deviceControlLogId", "createdAt")'))
+
+            first_created_at, last_created_at = db.execute(text(
+                f'SELECT MIN("createdAt"), MAX("createdAt") FROM "{LOG_TABLE}_unpartitioned"')).one()
+            now = datetime.now(timezone.utc)
+            month_start = get_month_start(
+                first_created_at if first_created_at is not None else now)
+            last_month_start = add_months(get_month_start(
+                max(last_created_at, now) if last_created_at is not None else now), 1)
+            while month_start <= last_month_start:
+                create_log_partition(db, month_start)
+                month_start = add_months(month_start, 1)
+            create_default_log_partition(db)
+
+            moved = db.execute(text(
+                f'INSERT INTO "{LOG_TABLE}" SELECT * FROM "{LOG_TABLE}_unpartitioned"')).rowcount
+            db.execute(text(f'DROP TABLE "{LOG_TABLE}_unpartitioned"'))
+            for index in DeviceControlLog.__table__.indexes:
+                index.create(db.connection())
+            return moved
+    except SQLAlchemyError as SQLError:
+        print("[DB] Partitioning Device Control Logs Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def create_log_partition(db, month_start: datetime):
+    db.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{get_partition_name(month_start)}" PARTITION OF "{LOG_TABLE}" '
+        f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{add_months(month_start, 1).isoformat()}')"))
+
+
+def create_default_log_partition(db):
+    db.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{LOG_TABLE}" DEFAULT'))
+
+
+def ensure_log_partitions(first_month: datetime, last_month: datetime) -> int | SQLAlchemyError:
+    '''Creates any missing monthly partition between the two months,
+    inclusive, and the default partition.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            create_default_log_partition(db)
+            count = 0
+            month_start = get_month_start(first_month)
+            while month_start <= get_month_start(last_month):
+                create_log_partition(db, month_start)
+                month_start = add_months(month_start, 1)
+                count += 1
+            return count
+    except SQLAlchemyError as SQLError:
+        print("[DB] Creating Log Partitions Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def get_log_partitions() -> List[Tuple[str, datetime]] | SQLAlchemyError:
+    '''Returns (partition name, month start) of every monthly log partition,
+    the default partition is left out.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            names = db.execute(text("""
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = :table
+                ORDER BY child.relname
+            """), {"table": LOG_TABLE}).scalars().all()
+            partitions: List[Tuple[str, datetime]] = []
+            for name in names:
+                if name == DEFAULT_PARTITION:
+                    continue
+                year, month = name[len(LOG_TABLE) + 1:].split("_")
+                partitions.append(
+                    (name, datetime(int(year), int(month), 1, tzinfo=timezone.utc)))
+            return partitions
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Log Partitions Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+# Pairs every ON log in [range_start, range_end) of `source` with the
+# device's next OFF log in the range, like `ENERGY_INTERVALS_SQL` in
+# database.actions, and splits the intervals into UTC days. No-op logs
+# (e.g. a configure that kept the status) are left out. A device that was
+# on at range_start, going by its last log at or before it, starts on
+# there, and a device still on at range_end is closed there.
+ROLL_UP_LOGS_SQL = """
+WITH carried_in AS (
+    SELECT DISTINCT ON ("deviceId") "deviceId", "statusChangedTo", "deviceWattage"
+    FROM "DeviceControlLogs"
+    WHERE "createdAt" <= :range_start
+    ORDER BY "deviceId", "createdAt" DESC
+),
+events AS (
+    SELECT "deviceId", false AS "statusChangedFrom", true AS "statusChangedTo", "deviceWattage",
+           CAST(:range_start AS timestamptz) AS "createdAt"
+    FROM carried_in
+    WHERE "statusChangedTo"
+    UNION ALL
+    SELECT "deviceId", "statusChangedFrom", "statusChangedTo", "deviceWattage", "createdAt"
+    FROM "{source}"
+    WHERE "createdAt" >= :range_start AND "createdAt" < :range_end
+      AND "statusChangedFrom" <> "statusChangedTo"
+),
+logs AS (
+    SELECT "deviceId", "statusChangedFrom", "statusChangedTo", "deviceWattage", "createdAt",
+           LEAD("createdAt") OVER w AS next_at,
+           LEAD("statusChangedFrom") OVER w AS next_from,
+           LEAD("statusChangedTo") OVER w AS next_to,
+           LEAD("deviceWattage") OVER w AS next_wattage
+    FROM events
+    WINDOW w AS (PARTITION BY "deviceId" ORDER BY "createdAt")
+),
+intervals AS (
+    SELECT "deviceId" AS device_id, "createdAt" AS on_at,
+           COALESCE(next_at, :range_end) AS off_at,
+           COALESCE(CASE WHEN next_at IS NULL THEN "deviceWattage" ELSE next_wattage END, 0) AS wattage
+    FROM logs
+    WHERE "statusChangedTo" AND NOT "statusChangedFrom"
+      AND (next_at IS NULL OR (next_from AND NOT next_to))
+),
+days AS (
+    SELECT device_id, wattage, day,
+           EXTRACT(EPOCH FROM (LEAST(off_at, day + interval '1 day') - GREATEST(on_at, day))) AS on_seconds
+    FROM intervals,
+         LATERAL generate_series(date_trunc('day', on_at, 'UTC'), off_at, interval '1 day') AS day
+)
+INSERT INTO "DeviceEnergyDailySummaries" ("deviceId", "day", "onSeconds", "wattHours")
+SELECT device_id, CAST(day AT TIME ZONE 'UTC' AS date), SUM(on_seconds), SUM(on_seconds * wattage / 3600)
+FROM days
+WHERE on_seconds > 0
+GROUP BY device_id, CAST(day AT TIME ZONE 'UTC' AS date)
+ON CONFLICT ("deviceId", "day") DO UPDATE
+SET "onSeconds" = "DeviceEnergyDailySummaries"."onSeconds" + EXCLUDED."onSeconds",
+    "wattHours" = "DeviceEnergyDailySummaries"."wattHours" + EXCLUDED."wattHours"
+"""
+
+# The logs a dropped partition ends with are gone for the next month's
+# roll-up, so a device still on at range_end gets a no-op ON log there.
+# The energy queries skip no-op logs, `ROLL_UP_LOGS_SQL` carries it in.
+CARRY_OUT_ON_STATE_SQL = """
+INSERT INTO "DeviceControlLogs" ("deviceControlLogId", "statusChangedFrom", "statusChangedTo",
+                                 "deviceId", "deviceWattage", "userId", "createdAt", "updatedAt")
+SELECT gen_random_uuid(), true, true, "deviceId", "deviceWattage", :user_id, :range_end, :range_end
+FROM (
+    SELECT DISTINCT ON ("deviceId") "deviceId", "statusChangedTo", "deviceWattage"
+    FROM "DeviceControlLogs"
+    WHERE "createdAt" < :range_end
+    ORDER BY "deviceId", "createdAt" DESC
+) AS last_logs
+WHERE "statusChangedTo" AND "deviceId" IN (SELECT "deviceId" FROM "Devices")
+"""
+CARRY_OUT_USER_ID = "Log Retention"
+
+
+def roll_up_log_partition(partition_name: str, month_start: datetime) -> int | SQLAlchemyError:
+    '''Adds the partition's on-time to the daily summaries and drops it, in one transaction.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            params = {"range_start": month_start,
+                      "range_end": add_months(month_start, 1)}
+            summarized = db.execute(text(ROLL_UP_LOGS_SQL.format(
+                source=partition_name)), params).rowcount
+            db.execute(text(CARRY_OUT_ON_STATE_SQL), {
+                **params, "user_id": CARRY_OUT_USER_ID})
+            db.execute(text(f'DROP TABLE "{partition_name}"'))
+            return summarized
+    except SQLAlchemyError as SQLError:
+        print(f"[DB] Rolling Up Log Partition {partition_name} Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def roll_up_default_log_partition(cutoff: datetime) -> int | SQLAlchemyError:
+    '''Adds the on-time of the default partition's logs before `cutoff` to
+    the daily summaries and deletes them, in one transaction.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            params = {"range_start": EARLIEST, "range_end": cutoff}
+            summarized = db.execute(text(ROLL_UP_LOGS_SQL.format(
+                source=DEFAULT_PARTITION)), params).rowcount
+            db.execute(text(CARRY_OUT_ON_STATE_SQL), {
+                **params, "user_id": CARRY_OUT_USER_ID})
+            db.execute(text(
+                f'DELETE FROM "{DEFAULT_PARTITION}" WHERE "createdAt" >= :range_start AND "createdAt" < :range_end'), params)
+            return summarized
+    except SQLAlchemyError as SQLError:
+        print(f"[DB] Rolling Up Log Partition {DEFAULT_PARTITION} Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
@@ -0,0 +1,80 @@
+import gzip
+import io
+import time
+from typing import TextIO
+
+COMPRESSIONS = ["none", "gzip", "zstd"]
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def get_compression(file_path: str) -> str:
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if file_path.endswith(extension):
+            return compression
+    return "none"
+
+
+def with_compression_extension(file_path: str, compression: str) -> str:
+    return file_path + COMPRESSION_EXTENSIONS.get(compression, "")
+
+
+def open_data_file(file_path: str, mode: str, compression: str | None = None) -> TextIO:
+    '''Opens an export file as text for reading ("r") or writing ("w"),
+    compressed as given or as its extension says.
+
+    zstd needs the optional `zstandard` package.
+    '''
+    compression = compression if compression is not None else get_compression(
+        file_path)
+    if compression == "gzip":
+        # A low level keeps the Pi's CPU from becoming the bottleneck
+        return gzip.open(file_path, mode + "t", encoding="utf-8", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard  # type: ignore
+        except ImportError:
+            raise Exception(
+                "[Data Files] zstd compression needs the 'zstandard' package.")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(
+                open(file_path, "wb"), closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                open(file_path, "rb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(file_path, mode, encoding="utf-8")
+
+
+class ProgressReporter():
+    '''Prints how many rows went through, at most every `interval_seconds`.'''
+
+    def __init__(self, label: str, total: int | None = None, interval_seconds: float = 2.0):
+        self.label = label
+        self.total = total
+        self.interval_seconds = interval_seconds
+        self.count = 0
+        self.started_at = time.perf_counter()
+        self.reported_at = self.started_at
+
+    def add(self, count: int):
+        self.count += count
+        now = time.perf_counter()
+        if now - self.reported_at >= self.interval_seconds:
+            self.reported_at = now
+            self.report()
+
+    def get_rows_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.started_at
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        progress = f"{self.count}"
+        if self.total is not None and self.total > 0:
+            progress += f"/{self.total} ({self.count / self.total * 100:.1f}%)"
+        print(
+            f"[{self.label}] {progress}, {self.get_rows_per_second():.0f} rows/s")
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started_at
+        print(
+            f"[{self.label}] Done, {self.count} rows in {elapsed:.1f}s ({self.get_rows_per_second():.0f} rows/s)")
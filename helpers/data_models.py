@@ -1,6 +1,6 @@
 from typing import List
 
-from gpiozero import OutputDevice
+from controller.gpio_backend import OutputPin
 
 
 class Device():
@@ -18,7 +18,7 @@ class Device():
     wattage: float | None = None
     created_at: str
     updated_at: str
-    output_device: OutputDevice | None = None
+    output_device: OutputPin | None = None
 
     def to_dict(self):
         return {
@@ -104,7 +104,7 @@ class DeviceControlLog():
     user_id: str
     status_changed_from: bool
     status_changed_to: bool
-    device_wattage: float
+    device_wattage: float | None
     created_at: str
     updated_at: str
 
@@ -119,3 +119,65 @@ class DeviceControlLog():
             "created_at": self.created_at,
             "updated_at": self.updated_at
         }
+
+
+class EnergyCheckpoint():
+    device_id: str
+    cumulative_watt_hours: float
+    is_on: bool
+    wattage: float | None
+    checkpoint_at: str
+
+    def to_dict(self):
+        return {
+            "device_id": self.device_id,
+            "cumulative_watt_hours": self.cumulative_watt_hours,
+            "is_on": self.is_on,
+            "wattage": self.wattage,
+            "checkpoint_at": self.checkpoint_at
+        }
+
+
+class DeviceEnergyConsumption():
+    device_id: str
+    period_start: str | None
+    watt_hours: float
+
+    def to_dict(self):
+        return {
+            "device_id": self.device_id,
+            "period_start": self.period_start,
+            "watt_hours": self.watt_hours
+        }
+
+
+class SceneAction():
+    device_id: str
+    status: bool
+
+    def to_dict(self):
+        return {
+            "device_id": self.device_id,
+            "status": self.status
+        }
+
+
+class Scene():
+    scene_id: str
+    scene_name: str
+    house_id: str
+    created_by: str
+    created_at: str
+    updated_at: str
+    actions: List[SceneAction]
+
+    def to_dict(self):
+        return {
+            "scene_id": self.scene_id,
+            "scene_name": self.scene_name,
+            "house_id": self.house_id,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "actions": [action.to_dict() for action in self.actions]
+        }
@@ -3,7 +3,7 @@ from typing import List, Optional
 
 
 class HeaderPinConfigDataModel:
-    header_pin_number: int
+    header_pin_number: int | None
     gpio_pin_number: int | None
     type: str
     voltage: str | None
@@ -21,6 +21,8 @@ class HeaderPinType(Enum):
     POWER = "POWER"
     GPIO = "GPIO"
     GROUND = "GROUND"
+    # Relay channel of a port expander or shift register, not a header pin
+    EXPANDER = "EXPANDER"
 
 
 class Voltage(Enum):
@@ -29,7 +31,7 @@ class Voltage(Enum):
 
 
 class HeaderPinConfig:
-    def __init__(self, header_pin_number: int, type: HeaderPinType,
+    def __init__(self, header_pin_number: Optional[int], type: HeaderPinType,
                  gpio_pin_number: Optional[int] = None, voltage: Optional[Voltage] = None):
         self.header_pin_number = header_pin_number
         self.gpio_pin_number = gpio_pin_number
@@ -119,3 +121,7 @@ pin_header_config: List[HeaderPinConfig] = [
     HeaderPinConfig(header_pin_number=40,
                     type=HeaderPinType.GPIO, gpio_pin_number=21),
 ]
+
+
+gpio_pin_numbers = {pin_config.gpio_pin_number for pin_config in pin_header_config
+                    if pin_config.type == HeaderPinType.GPIO}
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -36,6 +38,41 @@ class SwitchDeviceRequest(BaseModel):
     statusTo: bool
 
 
+class DeviceSwitch(BaseModel):
+    deviceId: str
+    statusTo: bool
+
+
+class SwitchDevicesRequest(BaseModel):
+    houseId: str
+    userId: str
+    userName: str
+    devices: List[DeviceSwitch]
+
+
+class AddSceneRequest(BaseModel):
+    houseId: str
+    userId: str
+    userName: str
+    sceneName: str
+    devices: List[DeviceSwitch]
+
+
+class ActivateSceneRequest(BaseModel):
+    houseId: str
+    userId: str
+    userName: str
+    sceneId: str
+
+
+class RemoveSceneRequest(BaseModel):
+    houseId: str
+    userId: str
+    userName: str
+    sceneId: str
+    sceneName: str
+
+
 class ConfigureDeviceRequest(BaseModel):
     houseId: str
     userId: str
@@ -70,6 +107,7 @@ class ResponseStatusCodes():
     INVALID_REQUEST = "INVALID_REQUEST"
     REQUEST_FULLFILLED = "REQUEST_FULLFILLED"
     SWITCH_DEVICE_ERROR = "SWITCH_DEVICE_ERROR"
+    SERVICE_WARMING_UP = "SERVICE_WARMING_UP"
 
 
 def is_valid_request(request_body: list):
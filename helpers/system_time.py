@@ -4,18 +4,43 @@ from time import ctime
 import datetime
 
 import subprocess
+import threading
+from typing import Callable, List
 
 
 class SystemTime():
+    '''Sets the system clock from NTP on a background thread, so a slow or
+    unreachable NTP server does not hold up startup.'''
 
-    def __init__(self):
-        self.set_system_time_from_server()
+    def __init__(self, timeout_seconds: float = 5.0, enabled: bool = True):
+        self.timeout_seconds = timeout_seconds
+        self.synced = threading.Event()
+        self.sync_listeners: List[Callable[[], None]] = []
+        self.listeners_lock = threading.Lock()
+        if not enabled:
+            # e.g. benchmarks, which must not touch the host's clock
+            print("System time sync from NTP is disabled.")
+            return
+        self.sync_thread = threading.Thread(
+            target=self.set_system_time_from_server)
+        self.sync_thread.daemon = True
+        self.sync_thread.start()
+
+    def add_sync_listener(self, listener: Callable[[], None]):
+        '''Registers a callback invoked once the clock is set, right away if
+        it already was.'''
+        with self.listeners_lock:
+            self.sync_listeners.append(listener)
+            if not self.synced.is_set():
+                return
+        listener()
 
     def fetch_time_from_server(self):
         client = ntplib.NTPClient()
         try:
             # Replace 'pool.ntp.org' with your preferred NTP server
-            response = client.request('pool.ntp.org', version=3)
+            response = client.request(
+                'pool.ntp.org', version=3, timeout=self.timeout_seconds)
             return datetime.datetime.strptime(ctime(response.tx_time), "%a %b %d %H:%M:%S %Y")
         except Exception as e:
             print(f"Failed to fetch time from NTP server: {e}")
@@ -27,8 +52,14 @@ class SystemTime():
             new_time = server_time.strftime("%Y-%m-%d %H:%M:%S")
             try:
                 # Run the 'date' command to set the system time
-                subprocess.run(['sudo', 'date', '--set', new_time], check=True)
+                subprocess.run(['sudo', 'date', '--set', new_time],
+                               check=True, timeout=self.timeout_seconds)
                 print(f"System time set to {new_time}")
+                with self.listeners_lock:
+                    self.synced.set()
+                    listeners = list(self.sync_listeners)
+                for listener in listeners:
+                    listener()
             except subprocess.CalledProcessError as e:
                 print(f"Failed to set system time: {e}")
             except Exception as e:
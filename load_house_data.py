@@ -1,76 +1,51 @@
+import argparse
 import json
-from typing import Any
+import os
 
-from database.actions import add_user,  create_room, init_house_db
-from database.database import get_db
-from database.db_models import Device, DeviceControlLog, HouseMember
 from sqlalchemy.exc import SQLAlchemyError
+from database.bulk_import import IMPORT_METHODS, BulkImporter
 
-logs: Any
+# Tried in order when --logs is not given
+LOGS_FILE_NAMES = ["logs.ndjson.zst", "logs.ndjson.gz", "logs.ndjson",
+                   "logs.json.zst", "logs.json.gz", "logs.json"]
 
-with open('data/logs.json', 'r', encoding='utf-8') as f:
-    logs = json.load(f)
 
+parser = argparse.ArgumentParser(
+    description="Restores the export of save_house_data.py into an empty database.")
+parser.add_argument("--data-dir", default="data",
+                    help="directory holding house_data.json, house_members.json and the logs")
+parser.add_argument("--logs", default=None,
+                    help="logs export to read, found in --data-dir when not given")
+parser.add_argument("--method", choices=IMPORT_METHODS, default="copy",
+                    help="copy streams logs with Postgres COPY, executemany uses batched INSERTs")
+parser.add_argument("--batch-size", type=int, default=5000,
+                    help="logs sent per COPY / INSERT")
+parser.add_argument("--dry-run", action="store_true",
+                    help="only read and validate the export, the database is not touched")
+args = parser.parse_args()
 
-with open('data/house_data.json', 'r', encoding='utf-8') as f:
-    house_data = json.load(f)
-    house: Any = init_house_db(house_data["house_password_hash"])
-
-    if isinstance(house, SQLAlchemyError):
-        raise Exception(house._message())
 
-    for room in house.rooms:
-        room: Any = create_room(room.room_name, house.house_id)
-
-        if isinstance(room, SQLAlchemyError):
-            raise Exception(room._message())
+with open(os.path.join(args.data_dir, 'house_data.json'), 'r', encoding='utf-8') as f:
+    house_data = json.load(f)
 
-        for device in room.devices:
-            # device = create_device(device.device_name, device.pin_number, room.room_id)
-            db = get_db()
-            try:
-                with db.begin() as txn:
-                    new_device = Device(deviceName=device["device_name"], pinNumber=device["pin_number"],
-                                        roomId=room["room_id"], status=device["status"], isScheduled=device["is_scheduled"],
-                                        isDefault=device["is_default"], daysScheduled=device["days_scheduled"], startTime=device[
-                                            "start_time"], offTime=device["off_time"], scheduledBy=device["scheduled_by"], wattage=device["wattage"]
-                                        )
-                    db.add(new_device)
-                    db.flush()
-                    for log in logs:
-                        if log.device_id == device.device_id:
-                            db = get_db()
-                            try:
-                                with db.begin() as txn:
-                                    new_log = DeviceControlLog(statusChangedFrom=log["status_changed_from"],
-                                                               statusChangedTo=log["status_changed_to"],
-                                                               deviceId=new_device.get_data().device_id,
-                                                               deviceWattage=float(
-                                                                   str(new_device.wattage)),
-                                                               userId=log["user_id"])
-                                    db.add(new_log)
-                                    db.flush
-                            except SQLAlchemyError as SQLError:
-                                print("[DB] Device Creation Failed.")
-                                print(SQLError)
-                            finally:
-                                db.close()
-            except SQLAlchemyError as SQLError:
-                print("[DB] Device Creation Failed.")
-                print(SQLError)
-            finally:
-                db.close()
+with open(os.path.join(args.data_dir, 'house_members.json'), 'r', encoding='utf-8') as f:
+    house_members_data = json.load(f)
 
-print("[Loaded] House Data")
-print("[Loaded] Device Control Logs")
+logs_path = args.logs
+if logs_path is None:
+    logs_path = next((os.path.join(args.data_dir, file_name) for file_name in LOGS_FILE_NAMES
+                      if os.path.exists(os.path.join(args.data_dir, file_name))), None)
+if logs_path is None:
+    raise Exception(f"[Import] No logs export found in {args.data_dir}.")
 
-with open('data/house_members.json', 'r', encoding='utf-8') as f:
-    house_members_data: Any = json.load(f)
 
-    for house_member in house_members_data:
-        user = add_user(house_member["user_id"])
+importer = BulkImporter(method=args.method,
+                        batch_size=args.batch_size, dry_run=args.dry_run)
+report = importer.run(house_data, house_members_data, logs_path)
 
-        if isinstance(user, SQLAlchemyError):
-            raise Exception(user._message())
+if isinstance(report, SQLAlchemyError):
+    raise Exception(report._message())
 
-print("[Loaded] House Members Data")
+print(f"[{'Validated' if args.dry_run else 'Loaded'}] House Data, {report['rooms']} room(s), {report['devices']} device(s)")
+print(f"[{'Validated' if args.dry_run else 'Loaded'}] House Members Data, {report['house_members']} member(s)")
+print(f"[{'Validated' if args.dry_run else 'Loaded'}] Device Control Logs, {report['logs']} log(s) at {report['logs_per_second']:.0f} rows/s, {report['logs_skipped']} skipped")
@@ -0,0 +1,27 @@
+import argparse
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.partitions import is_log_table_partitioned, partition_log_table
+
+
+parser = argparse.ArgumentParser(
+    description="Converts DeviceControlLogs into a table partitioned by month. Stop the server first, the table is locked while the logs are moved.")
+args = parser.parse_args()
+
+
+is_partitioned = is_log_table_partitioned()
+if isinstance(is_partitioned, SQLAlchemyError):
+    raise Exception("[Partitions] Checking Device Control Logs failed.")
+
+if is_partitioned is None:
+    print("[Partitions] Device Control Logs table does not exist yet. (Skipped)")
+elif is_partitioned:
+    print("[Partitions] Device Control Logs are already partitioned. (Skipped)")
+else:
+    print("[Partitions] Partitioning Device Control Logs by month...")
+    moved = partition_log_table()
+    if isinstance(moved, SQLAlchemyError):
+        raise Exception(
+            f"[Partitions] Partitioning Device Control Logs failed. {moved._message()}")
+    print(f"[Partitions] Moved {moved} log(s) into monthly partitions.")
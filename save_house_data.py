@@ -1,8 +1,23 @@
+import argparse
 import os
 import json
+from typing import List
 
 from sqlalchemy.exc import SQLAlchemyError
-from database.actions import get_device_control_logs, get_house_data, get_house_members
+from database.actions import count_device_control_logs, get_house_data, get_house_members, stream_device_control_logs
+from helpers.data_files import COMPRESSIONS, ProgressReporter, open_data_file, with_compression_extension
+from helpers.data_models import DeviceControlLog
+
+
+parser = argparse.ArgumentParser(
+    description="Exports the house, its members and the device control logs to data/.")
+parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                    help="json writes logs.json as one array, ndjson writes logs.ndjson with one log per line")
+parser.add_argument("--compress", choices=COMPRESSIONS, default="none",
+                    help="compresses logs.json / logs.ndjson while it is written")
+parser.add_argument("--batch-size", type=int, default=5000,
+                    help="logs fetched per round trip of the server-side cursor")
+args = parser.parse_args()
 
 
 # Ensure the directory exists
@@ -30,12 +45,36 @@ with open('data/house_members.json', 'w', encoding='utf-8') as f:
     print("[Saved] House Members Data.")
 
 
-logs = get_device_control_logs()
+# Logs are streamed from a server-side cursor and written a batch at a time,
+# so memory use does not grow with the size of the table.
+logs_count = count_device_control_logs()
+
+if isinstance(logs_count, SQLAlchemyError):
+    raise Exception(logs_count._message())
+
+logs_path = with_compression_extension(
+    f"data/logs.{args.format}", args.compress)
+progress = ProgressReporter("Export Device Control Logs", total=logs_count)
+
+with open_data_file(logs_path, 'w', args.compress) as f:
+    def write_logs(logs: List[DeviceControlLog]):
+        if args.format == "ndjson":
+            f.write("".join(json.dumps(log.to_dict(), ensure_ascii=False) + "\n"
+                            for log in logs))
+        else:
+            f.write("".join(("[\n" if progress.count == 0 and index == 0 else ",\n") +
+                            json.dumps(log.to_dict(), ensure_ascii=False)
+                            for index, log in enumerate(logs)))
+        progress.add(len(logs))
+
+    logs_written = stream_device_control_logs(
+        write_logs, batch_size=args.batch_size)
+
+    if isinstance(logs_written, SQLAlchemyError):
+        raise Exception(logs_written._message())
 
-if isinstance(logs, SQLAlchemyError):
-    raise Exception(logs._message())
+    if args.format == "json":
+        f.write("[]\n" if logs_written == 0 else "\n]\n")
 
-with open('data/logs.json', 'w', encoding='utf-8') as f:
-    json.dump([log.to_dict()
-              for log in logs] if len(logs) > 0 else [], f, ensure_ascii=False, indent=4)
-    print("[Saved] Device Control Logs Data.")
+progress.finish()
+print(f"[Saved] Device Control Logs Data to {logs_path}.")
@@ -1,23 +1,45 @@
-from fastapi import FastAPI, status, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from services.startup_tracer import startup_tracer
+
+import asyncio
+from fastapi import FastAPI, Header, Request, status, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import json
+from contextlib import AsyncExitStack
 from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
 
 from sqlalchemy.exc import SQLAlchemyError
 
-from controller.controller_device import ControllerDevice
+from controller.controller_device import ControllerDevice, restore_relay_outputs
+from controller.expanders import ExpanderManager, get_expander_manager
+from controller.gpio_backend import GPIOBackend, OutputPin, get_gpio_backend
+from controller.relay_state import relay_state
 
-from database.actions import add_user, get_specific_device_control_logs, get_user, delete_user, get_access, create_room, remove_room, create_device, switch_device, configure_device, remove_device, get_house_data, get_available_gpio_pins
+from database.database import async_engine, database_metrics, engine
+from database.async_actions import add_user, create_scene, get_scene, get_scenes, remove_scene, get_daily_energy_summaries, get_device_energy_consumption, get_specific_device_control_logs, get_user, delete_user, get_access, create_room, remove_room, create_device, configure_device, remove_device, get_house_data, get_available_gpio_pins
 
-from helpers.request_models import is_valid_request, AddRoomRequest, RemoveRoomRequest, AddDeviceRequest, SwitchDeviceRequest, ConfigureDeviceRequest, RemoveDeviceRequest, ResponseStatusCodes
+from helpers.data_models import Device
+from helpers.header_pins import gpio_pin_numbers
+from helpers.request_models import is_valid_request, AddRoomRequest, RemoveRoomRequest, AddDeviceRequest, SwitchDeviceRequest, SwitchDevicesRequest, AddSceneRequest, ActivateSceneRequest, RemoveSceneRequest, ConfigureDeviceRequest, RemoveDeviceRequest, ResponseStatusCodes
 
-from services.energy_consumption import calculate_energy_consumption
+from services.access_cache import access_cache
+from services.control_log_writer import control_log_writer
+from services.energy_consumption import ENERGY_PERIODS, build_energy_breakdown, calculate_energy_breakdown, calculate_energy_consumption
+from services.energy_ledger import as_aware, energy_ledger
+from services.log_retention import log_retention_manager
+from services.membership_listener import membership_listener
 from services.sys_init import SystemInitializer
 from services.socket import SocketEvents, SocketManager
+from services.command_bus import SwitchCommandBus
 from services.schedule import ScheduleDeviceAssistant
 from services.scheduled_device import get_scheduled_device_status
 
+startup_tracer.mark("imports")
+
+
+# NTP sync continues in the background, the house is checked by `warm_up`
 sys = SystemInitializer()
 
 
@@ -29,20 +51,121 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
 socket_manager = SocketManager()
 
 
-controller_device = ControllerDevice()
-
-
-schedule_assistant = ScheduleDeviceAssistant(controller_device, socket_manager)
+# Assigned by `warm_up` once the house model is loaded. Until then only the
+# routes in WARM_UP_READY_PATHS are served, the rest answer 503.
+gpio_backend: GPIOBackend | None = None
+expander_manager: ExpanderManager | None = None
+restored_outputs: Dict[int, OutputPin] | None = None
+controller_device: ControllerDevice | None = None
+command_bus: SwitchCommandBus
+schedule_assistant: ScheduleDeviceAssistant
+
+WARM_UP_READY_PATHS = ["/metrics", "/house-login",
+                       "/get-house-member", "/delete-house-member"]
+
+# A failed warm up (Postgres not up yet after a power cut) is retried,
+# doubling the wait up to the maximum
+WARM_UP_RETRY_SECONDS = 1
+WARM_UP_MAX_RETRY_SECONDS = 30
+
+
+async def warm_up():
+    retry_in_seconds = WARM_UP_RETRY_SECONDS
+    while True:
+        try:
+            await run_warm_up()
+            startup_tracer.set_ready()
+            return
+        except Exception as e:
+            startup_tracer.set_failed(e, retry_in_seconds)
+        await asyncio.sleep(retry_in_seconds)
+        retry_in_seconds = min(retry_in_seconds * 2,
+                               WARM_UP_MAX_RETRY_SECONDS)
+
+
+async def run_warm_up():
+    '''One warm up attempt, skipping the phases a previous attempt finished.'''
+    global gpio_backend, expander_manager, restored_outputs, controller_device, command_bus, schedule_assistant
+    if restored_outputs is None:
+        with startup_tracer.phase("relay restore"):
+            # From the local state file, before anything waits on Postgres
+            gpio_backend = await asyncio.to_thread(get_gpio_backend)
+            expander_manager = await asyncio.to_thread(get_expander_manager)
+            restored_outputs = await asyncio.to_thread(restore_relay_outputs)
+
+    if not sys.house_initialized:
+        with startup_tracer.phase("house check"):
+            await asyncio.to_thread(sys.initialize_house)
+
+    if controller_device is None:
+        with startup_tracer.phase("house model and GPIO"):
+            controller = await asyncio.to_thread(
+                ControllerDevice, restored_outputs=restored_outputs)
+            # `load_data` only logs a failed read, retry rather than serve no house
+            if controller.house is None:
+                raise Exception("[Controller] House model could not be loaded.")
+            controller_device = controller
+
+        with startup_tracer.phase("command bus and schedule assistant"):
+            command_bus = SwitchCommandBus(controller_device, socket_manager)
+            command_bus.start()
+            schedule_assistant = ScheduleDeviceAssistant(
+                controller_device, command_bus)
+            # The heap may be built from the boot clock, rebuild once NTP sets it
+            sys.sys_time.add_sync_listener(
+                schedule_assistant.notify_clock_set)
+
+    with startup_tracer.phase("energy ledger"):
+        await asyncio.to_thread(energy_ledger.load)
+        energy_ledger.start()
+
+    with startup_tracer.phase("background writers"):
+        if energy_ledger.on_control_logs not in control_log_writer.listeners:
+            control_log_writer.add_listener(energy_ledger.on_control_logs)
+        control_log_writer.start()
+        log_retention_manager.start()
+        membership_listener.start()
+
+
+@app.on_event("startup")
+async def startup():
+    startup_tracer.mark("server start")
+    asyncio.get_running_loop().create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    control_log_writer.stop()
+    energy_ledger.stop()
+    log_retention_manager.stop()
+    membership_listener.stop()
+    await async_engine.dispose()
+
+
+@app.middleware("http")
+async def wait_for_warm_up(request: Request, call_next):
+    if not startup_tracer.ready and request.url.path not in WARM_UP_READY_PATHS:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVICE_WARMING_UP,
+                "message": "Server is starting up, please retry shortly." if startup_tracer.failed is None else f"Server failed to start, retrying. {startup_tracer.failed}"
+            },
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": f"{startup_tracer.retry_in_seconds or 1:g}"}
+        )
+    return await call_next(request)
 
 
 @app.get("/get-house-member", status_code=status.HTTP_200_OK)
-def get_house_member(userId: str):
+async def get_house_member(userId: str):
     if not is_valid_request([userId]):
         return JSONResponse(
             content={
@@ -53,7 +176,7 @@ def get_house_member(userId: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    house_member = get_user(userId)
+    house_member = await get_user(userId)
 
     if isinstance(house_member, SQLAlchemyError):
         return JSONResponse(
@@ -87,7 +210,7 @@ def get_house_member(userId: str):
 
 
 @app.delete("/delete-house-member", status_code=status.HTTP_201_CREATED)
-def delete_house_member(userId: str):
+async def delete_house_member(userId: str):
     if not is_valid_request([userId]):
         return JSONResponse(
             content={
@@ -98,7 +221,7 @@ def delete_house_member(userId: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    delete_count = delete_user(userId)
+    delete_count = await delete_user(userId)
 
     if isinstance(delete_count, SQLAlchemyError):
         return JSONResponse(
@@ -121,7 +244,7 @@ def delete_house_member(userId: str):
 
 
 @app.post("/house-login", status_code=status.HTTP_201_CREATED)
-def house_login(userId: str, password: str):
+async def house_login(userId: str, password: str):
     if not is_valid_request([userId, password]):
         return JSONResponse(
             content={
@@ -132,7 +255,11 @@ def house_login(userId: str, password: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = sys.house_login(password)
+    # bcrypt is CPU bound, keep it off the event loop
+    is_authenticated = await run_in_threadpool(sys.house_login, password)
+
+    # A fresh login always re-reads membership from the database
+    access_cache.invalidate(userId)
 
     if is_authenticated is None:
         return JSONResponse(
@@ -154,7 +281,7 @@ def house_login(userId: str, password: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    house_member = add_user(userId)
+    house_member = await add_user(userId)
 
     if isinstance(house_member, SQLAlchemyError):
         return JSONResponse(
@@ -178,7 +305,7 @@ def house_login(userId: str, password: str):
 
 
 @app.get("/get-house", status_code=status.HTTP_200_OK)
-def get_house_details(userId: str):
+async def get_house_details(userId: str, if_none_match: str | None = Header(default=None)):
     if not is_valid_request([userId]):
         return JSONResponse(
             content={
@@ -189,7 +316,7 @@ def get_house_details(userId: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    user = get_user(userId)
+    user = await get_user(userId)
 
     if isinstance(user, SQLAlchemyError):
         return JSONResponse(
@@ -211,7 +338,7 @@ def get_house_details(userId: str):
             status_code=status.HTTP_404_NOT_FOUND
         )
 
-    is_authenticated = get_access(userId)
+    is_authenticated = await get_access(userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -233,7 +360,17 @@ def get_house_details(userId: str):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    house_data = get_house_data()
+    # Served from the controller's in-memory mirror of the house, serialized
+    # once per version, so repeat loads skip the database and `to_dict`
+    house_snapshot = controller_device.get_house_snapshot()
+
+    if house_snapshot is not None:
+        etag, body = house_snapshot
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag}, status_code=status.HTTP_200_OK)
+
+    house_data = await get_house_data()
 
     if isinstance(house_data, SQLAlchemyError):
         return JSONResponse(
@@ -269,7 +406,7 @@ async def add_room(request_body: AddRoomRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -291,7 +428,7 @@ async def add_room(request_body: AddRoomRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    room = create_room(request_body.roomName, request_body.houseId)
+    room = await create_room(request_body.roomName, request_body.houseId)
 
     if isinstance(room, SQLAlchemyError):
         return JSONResponse(
@@ -340,7 +477,7 @@ async def delete_room(request_body: RemoveRoomRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -362,7 +499,7 @@ async def delete_room(request_body: RemoveRoomRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    delete_count = remove_room(request_body.roomId)
+    delete_count = await remove_room(request_body.roomId)
 
     if isinstance(delete_count, SQLAlchemyError):
         return JSONResponse(
@@ -408,7 +545,7 @@ async def add_device(request_body: AddDeviceRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -430,19 +567,17 @@ async def add_device(request_body: AddDeviceRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    available_gpio_pins = get_available_gpio_pins()
-
-    if isinstance(available_gpio_pins, SQLAlchemyError):
+    if request_body.pinNumber not in gpio_pin_numbers and not expander_manager.owns(request_body.pinNumber):
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": available_gpio_pins._message()
+                "message": f"{request_body.pinNumber} is not a GPIO or expander pin."
             },
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    if request_body.pinNumber not in [gpio_pin.gpio_pin_number for gpio_pin in available_gpio_pins]:
+    if controller_device.is_pin_in_use(request_body.pinNumber):
         return JSONResponse(
             content={
                 "status": "error",
@@ -452,7 +587,7 @@ async def add_device(request_body: AddDeviceRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    device = create_device(request_body.deviceName,
+    device = await create_device(request_body.deviceName,
                            request_body.pinNumber, request_body.wattage, request_body.roomId)
 
     if isinstance(device, SQLAlchemyError):
@@ -502,7 +637,7 @@ async def toggle_device(request_body: SwitchDeviceRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -524,9 +659,13 @@ async def toggle_device(request_body: SwitchDeviceRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
+    _state = "on" if request_body.statusTo else "off"
+
     try:
-        controller_device.switch_device(
-            request_body.deviceId, request_body.statusTo)
+        # Serialized and coalesced with every other switch of the device, the
+        # bus drives the relay, queues the control log and broadcasts
+        result = await command_bus.submit(request_body.deviceId, request_body.statusTo, request_body.userId, SocketEvents.SWITCH_DEVICE,
+                                          f"{request_body.userName} turned {_state} {request_body.deviceName}.")
     except Exception as e:
         return JSONResponse(
             content={
@@ -538,33 +677,178 @@ async def toggle_device(request_body: SwitchDeviceRequest):
             status_code=status.HTTP_200_OK
         )
 
-    update_count = switch_device(request_body.deviceId,
-                                 request_body.statusFrom, request_body.statusTo, request_body.userId)
+    # A command coalesced into one for the same status changes nothing
+    update_count = 1 if result["changed"] else 0
+
+    content = {
+        "status": "success",
+        "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+        "message": "Device Switched successfully.",
+        "data": f"{update_count} device(s) swicthed {_state}"
+    }
+
+    return JSONResponse(
+        content=content,
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+async def switch_devices_batch(switches: List[Tuple[str, bool]], user_id: str, message: str, scene_id: str | None = None):
+    '''Switches all devices in one pass, queues their control logs as one
+    batch (so they are written in a single transaction) and broadcasts one
+    aggregated event. Returns the response data.'''
+    async with AsyncExitStack() as stack:
+        # Keep the command bus off these devices, locks taken in a fixed order
+        for device_id in sorted({device_id for device_id, _ in switches}):
+            await stack.enter_async_context(command_bus.get_device_lock(device_id))
+        # Off the loop, the relay state write is fsynced
+        switched, errors = await asyncio.to_thread(
+            controller_device.switch_devices, switches)
+
+    # Only actual status changes are logged
+    control_log_writer.log_switches([(device.device_id, from_status, device.status, device.wattage, user_id)
+                                     for device, from_status in switched if from_status != device.status])
+
+    data = {
+        "sceneId": scene_id,
+        "devices": [{"deviceId": device.device_id, "state": device.status} for device, _ in switched],
+        "errors": errors
+    }
+
+    broadcast_data = {
+        "event": SocketEvents.SWITCH_DEVICES,
+        "user_id": user_id,
+        "message": message,
+        "data": data
+    }
+
+    await socket_manager.broadcast(json.dumps(broadcast_data))
+
+    return data
+
+
+@app.patch("/switch-devices", status_code=status.HTTP_202_ACCEPTED)
+async def toggle_devices(request_body: SwitchDevicesRequest):
+
+    if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.devices]):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "Please provide userId, userName, houseId and devices."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_authenticated = await get_access(request_body.userId)
 
-    if isinstance(update_count, SQLAlchemyError):
+    if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": update_count._message()
+                "message": is_authenticated._message()
             },
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-    _state = "on" if request_body.statusTo else "off"
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.userName} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    data = await switch_devices_batch([(device.deviceId, device.statusTo) for device in request_body.devices], request_body.userId,
+                                      f"{request_body.userName} switched {len(request_body.devices)} device(s).")
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": f"{len(data['devices'])} device(s) switched, {len(data['errors'])} failed.",
+            "data": data
+        },
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+@app.post("/add-scene", status_code=status.HTTP_201_CREATED)
+async def add_scene(request_body: AddSceneRequest):
+
+    if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.sceneName, request_body.devices]):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "Please provide userId, userName, houseId, sceneName and devices."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_authenticated = await get_access(request_body.userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": is_authenticated._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.userName} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    unknown_device_ids = [device.deviceId for device in request_body.devices
+                          if controller_device.get_device(device.deviceId) is None]
+
+    if len(unknown_device_ids) > 0:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": f"Devices not found: {', '.join(unknown_device_ids)}."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    scene = await create_scene(request_body.sceneName, request_body.houseId,
+                               [(device.deviceId, device.statusTo) for device in request_body.devices], request_body.userId)
+
+    if isinstance(scene, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": scene._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
     content = {
         "status": "success",
         "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-        "message": "Device Switched successfully.",
-        "data": f"{update_count} device(s) swicthed {_state}"
+        "message": "Scene created successfully.",
+        "data": scene.to_dict()
     }
 
     broadcast_data = {
-        "event": SocketEvents.SWITCH_DEVICE,
+        "event": SocketEvents.ADD_SCENE,
         "user_id": request_body.userId,
-        "message": f"{request_body.userName} turned {_state} {request_body.deviceName}.",
-        "data": {"deviceId": request_body.deviceId, "state": request_body.statusTo}
+        "message": f"{request_body.userName} created a scene {request_body.sceneName}.",
+        "data": content["data"]
     }
 
     await socket_manager.broadcast(json.dumps(broadcast_data))
@@ -575,20 +859,77 @@ async def toggle_device(request_body: SwitchDeviceRequest):
     )
 
 
-@app.put("/configure-device", status_code=status.HTTP_202_ACCEPTED)
-async def config_device(request_body: ConfigureDeviceRequest):
+@app.get("/get-scenes", status_code=status.HTTP_200_OK)
+async def get_all_scenes(userId: str):
+    if not is_valid_request([userId]):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "Please provide userId."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
 
-    if not is_valid_request([request_body.houseId, request_body.userId, request_body.userName, request_body.deviceId, request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled]):
+    is_authenticated = await get_access(userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": is_authenticated._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{userId} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    scenes = await get_scenes()
+
+    if isinstance(scenes, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": scenes._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": "Scenes retrieved successfully.",
+            "data": [scene.to_dict() for scene in scenes]
+        },
+        status_code=status.HTTP_200_OK
+    )
+
+
+@app.patch("/activate-scene", status_code=status.HTTP_202_ACCEPTED)
+async def activate_scene(request_body: ActivateSceneRequest):
+
+    if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.sceneId]):
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide houseId, userId, userName, deviceId, deviceName, pinNumber, status, isDefault and isScheduled."
+                "message": "Please provide userId, userName, houseId and sceneId."
             },
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -597,7 +938,78 @@ async def config_device(request_body: ConfigureDeviceRequest):
                 "status_code": ResponseStatusCodes.SERVER_ERROR,
                 "message": is_authenticated._message()
             },
-            status_code=status.HTTP_202_ACCEPTED
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.userName} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    scene = await get_scene(request_body.sceneId)
+
+    if isinstance(scene, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": scene._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if scene is None:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": f"Scene with id '{request_body.sceneId}' not found."
+            },
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    data = await switch_devices_batch([(action.device_id, action.status) for action in scene.actions], request_body.userId,
+                                      f"{request_body.userName} activated the scene {scene.scene_name}.", scene.scene_id)
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": f"Scene activated, {len(data['devices'])} device(s) switched, {len(data['errors'])} failed.",
+            "data": data
+        },
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+@app.delete("/remove-scene", status_code=status.HTTP_200_OK)
+async def delete_scene(request_body: RemoveSceneRequest):
+
+    if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.sceneId, request_body.sceneName]):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "Please provide userId, userName, houseId, sceneId and sceneName."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_authenticated = await get_access(request_body.userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": is_authenticated._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
     if not is_authenticated:
@@ -610,51 +1022,175 @@ async def config_device(request_body: ConfigureDeviceRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    updated_device_count = configure_device(request_body.deviceId,
-                                            request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled, request_body.daysScheduled, request_body.startTime, request_body.offTime, request_body.wattage, request_body.userId)
+    delete_count = await remove_scene(request_body.sceneId)
 
-    if isinstance(updated_device_count, SQLAlchemyError):
+    if isinstance(delete_count, SQLAlchemyError):
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": updated_device_count._message()
+                "message": delete_count._message()
             },
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-    device = controller_device.get_device(request_body.deviceId)
+    broadcast_data = {
+        "event": SocketEvents.REMOVE_SCENE,
+        "user_id": request_body.userId,
+        "message": f"{request_body.userName} deleted the scene {request_body.sceneName}.",
+        "data": {"sceneId": request_body.sceneId}
+    }
+
+    await socket_manager.broadcast(json.dumps(broadcast_data))
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": f"{delete_count} Scene(s) deleted successfully.",
+        },
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+def apply_device_configuration(device: Device, request_body: ConfigureDeviceRequest):
+    '''Mirrors a configured device in the controller and the schedule assistant.'''
+    controller_device.set_default_device(device, request_body.isDefault)
+    # Unindexed under the old pin here, `add_device` indexes the new one
+    controller_device.remove_device(device.device_id)
+
+    is_on = False
+
+    if request_body.isScheduled:
+        is_on = get_scheduled_device_status(
+            request_body.startTime, request_body.offTime)
+    else:
+        is_on = device.status
+
+    device.device_name = request_body.deviceName
+    device.pin_number = request_body.pinNumber
+    device.is_scheduled = request_body.isScheduled
+    device.days_scheduled = request_body.daysScheduled if request_body.isScheduled else ""
+    device.start_time = request_body.startTime if request_body.isScheduled else ""
+    device.off_time = request_body.offTime if request_body.isScheduled else ""
+    device.status = is_on
+    device.scheduled_by = request_body.userId
+    device.wattage = request_body.wattage
+    device.output_device = None
+
+    controller_device.add_device(device)
+    new_device = controller_device.get_device(device.device_id)
 
-    if device is not None:
-        controller_device.remove_device(device.device_id)
+    if new_device is not None:
+        # The new output starts off, drive it to the configured status
+        try:
+            controller_device.switch_device(new_device.device_id, is_on)
+        except Exception as e:
+            print(f"[Configure Device] Driving {device.device_name} failed. {e}")
 
-        is_on = False
+    energy_ledger.record(device.device_id, device.status,
+                         device.wattage, datetime.now())
 
+    if new_device is not None:
         if request_body.isScheduled:
-            is_on = get_scheduled_device_status(
-                request_body.startTime, request_body.offTime)
+            schedule_assistant.schedule_device(new_device)
         else:
-            is_on = device.status
-
-        device.device_name = request_body.deviceName
-        device.pin_number = request_body.pinNumber
-        device.is_scheduled = request_body.isScheduled
-        device.days_scheduled = request_body.daysScheduled if request_body.isScheduled else ""
-        device.start_time = request_body.startTime if request_body.isScheduled else ""
-        device.off_time = request_body.offTime if request_body.isScheduled else ""
-        device.status = is_on
-        device.scheduled_by = request_body.userId
-        device.output_device = None
-
-        controller_device.add_device(device)
-        new_device = controller_device.get_device(device.device_id)
-
-        if new_device is not None:
-            if request_body.isScheduled:
-                schedule_assistant.schedule_device(new_device)
-            else:
-                schedule_assistant.remove_scheduled_device(
-                    new_device.device_id)
+            schedule_assistant.remove_scheduled_device(
+                new_device.device_id)
+
+
+@app.put("/configure-device", status_code=status.HTTP_202_ACCEPTED)
+async def config_device(request_body: ConfigureDeviceRequest):
+
+    if not is_valid_request([request_body.houseId, request_body.userId, request_body.userName, request_body.deviceId, request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled]):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "Please provide houseId, userId, userName, deviceId, deviceName, pinNumber, status, isDefault and isScheduled."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_authenticated = await get_access(request_body.userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": is_authenticated._message()
+            },
+            status_code=status.HTTP_202_ACCEPTED
+        )
+
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.userName} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    if request_body.pinNumber not in gpio_pin_numbers and not expander_manager.owns(request_body.pinNumber):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.pinNumber} is not a GPIO or expander pin."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    # `devices_by_pin` holds one device per pin, moving a device onto a pin
+    # in use would drop the other device from the index
+    if controller_device.is_pin_in_use(request_body.pinNumber, request_body.deviceId):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{request_body.pinNumber} already in use by another device."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Held until the device is reconfigured, so no switch of the device is
+    # queued in between
+    async with command_bus.get_device_lock(request_body.deviceId):
+        # A status UPDATE still queued in the control log writer would land
+        # after the configuration and overwrite its status
+        is_flushed = await asyncio.to_thread(control_log_writer.flush_device, request_body.deviceId)
+
+        if not is_flushed:
+            return JSONResponse(
+                content={
+                    "status": "error",
+                    "status_code": ResponseStatusCodes.SERVER_ERROR,
+                    "message": f"Pending switches of {request_body.deviceName} could not be saved, try again."
+                },
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        updated_device_count = await configure_device(request_body.deviceId,
+                                                      request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled, request_body.daysScheduled, request_body.startTime, request_body.offTime, request_body.wattage, request_body.userId)
+
+        if isinstance(updated_device_count, SQLAlchemyError):
+            return JSONResponse(
+                content={
+                    "status": "error",
+                    "status_code": ResponseStatusCodes.SERVER_ERROR,
+                    "message": updated_device_count._message()
+                },
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        device = controller_device.get_device(request_body.deviceId)
+
+        if device is not None:
+            # Same order as the command bus: GPIO, then ledger, then broadcast
+            apply_device_configuration(device, request_body)
 
     broadcast_data = {
         "event": SocketEvents.CONFIGURE_DEVICE,
@@ -689,7 +1225,7 @@ async def delete_device(request_body: RemoveDeviceRequest):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = await get_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -711,7 +1247,7 @@ async def delete_device(request_body: RemoveDeviceRequest):
             status_code=status.HTTP_403_FORBIDDEN
         )
 
-    delete_count = remove_device(request_body.deviceId)
+    delete_count = await remove_device(request_body.deviceId)
 
     if isinstance(delete_count, SQLAlchemyError):
         return JSONResponse(
@@ -746,7 +1282,7 @@ async def delete_device(request_body: RemoveDeviceRequest):
 
 
 @app.get("/get-available-gpio-pins", status_code=status.HTTP_200_OK)
-def get_all_available_gpio_pins(userId: str):
+async def get_all_available_gpio_pins(userId: str):
     if not is_valid_request([userId]):
         return JSONResponse(
             content={
@@ -757,7 +1293,7 @@ def get_all_available_gpio_pins(userId: str):
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    house_member = get_user(userId)
+    house_member = await get_user(userId)
 
     if isinstance(house_member, SQLAlchemyError):
         return JSONResponse(
@@ -779,7 +1315,7 @@ def get_all_available_gpio_pins(userId: str):
             status_code=status.HTTP_404_NOT_FOUND
         )
 
-    available_gpio_pins = get_available_gpio_pins()
+    available_gpio_pins = await get_available_gpio_pins()
 
     if isinstance(available_gpio_pins, SQLAlchemyError):
         return JSONResponse(
@@ -803,18 +1339,18 @@ def get_all_available_gpio_pins(userId: str):
 
 
 @app.get("/get-energy-consumption", status_code=status.HTTP_200_OK)
-async def get_energy_consumption(userId: str):
-    if not is_valid_request([userId]):
+async def get_energy_consumption(userId: str, verify: bool = False, mode: str = "ledger"):
+    if not is_valid_request([userId]) or mode not in ["ledger", "sql"]:
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId."
+                "message": "Please provide userId and a mode out of ledger, sql."
             },
             status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    is_authenticated = get_access(userId)
+    is_authenticated = await get_access(userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
         return JSONResponse(
@@ -841,21 +1377,50 @@ async def get_energy_consumption(userId: str):
     last_month_start = (current_month_start -
                         timedelta(days=30)).replace(day=15)
 
-    logs = get_specific_device_control_logs(
-        last_month_start, current_month_start)
+    if mode == "sql":
+        consumptions = await get_device_energy_consumption(
+            as_aware(last_month_start), as_aware(current_month_start))
+        device_consumption = {consumption.device_id: consumption.watt_hours
+                              for consumption in consumptions} if not isinstance(consumptions, SQLAlchemyError) else consumptions
+    else:
+        # May rebuild past totals from the database through the sync actions
+        device_consumption = await run_in_threadpool(
+            energy_ledger.get_consumption, last_month_start, current_month_start)
+
+    if isinstance(device_consumption, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": device_consumption._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    # Days whose logs were dropped by the log retention only have daily totals
+    daily_summaries = await get_daily_energy_summaries(
+        as_aware(last_month_start), as_aware(current_month_start))
 
-    if isinstance(logs, SQLAlchemyError):
+    if isinstance(daily_summaries, SQLAlchemyError):
         return JSONResponse(
             content={
                 "status": "error",
                 "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": logs._message()
+                "message": daily_summaries._message()
             },
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-    energy_consumption_watt_hours = calculate_energy_consumption(
-        logs, current_month_start)
+    summarized_watt_hours = sum(
+        daily_summary.watt_hours for daily_summary in daily_summaries)
+
+    if mode == "sql":
+        # The ledger carries the dropped days through its checkpoints
+        for daily_summary in daily_summaries:
+            device_consumption[daily_summary.device_id] = device_consumption.get(
+                daily_summary.device_id, 0.0) + daily_summary.watt_hours
+
+    energy_consumption_watt_hours = sum(device_consumption.values())
 
     content = {
         "status": "success",
@@ -868,6 +1433,24 @@ async def get_energy_consumption(userId: str):
         }
     }
 
+    if verify:
+        # Replays the raw control logs to cross-check the ledger
+        logs = await get_specific_device_control_logs(
+            last_month_start, current_month_start)
+
+        if isinstance(logs, SQLAlchemyError):
+            return JSONResponse(
+                content={
+                    "status": "error",
+                    "status_code": ResponseStatusCodes.SERVER_ERROR,
+                    "message": logs._message()
+                },
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        content["data"]["replayed_energy_consumption_watt_hours"] = calculate_energy_consumption(
+            logs, as_aware(current_month_start)) + summarized_watt_hours
+
     broadcast_data = {
         "event": SocketEvents.ENERGY_CONSUMPTION_CALCULATED,
         "user_id": userId,
@@ -883,6 +1466,151 @@ async def get_energy_consumption(userId: str):
     )
 
 
+@app.get("/get-energy-breakdown", status_code=status.HTTP_200_OK)
+async def get_energy_breakdown(userId: str, period: str = "day", startDate: str | None = None, endDate: str | None = None, mode: str = "replay"):
+    if not is_valid_request([userId]) or period not in ENERGY_PERIODS or mode not in ["replay", "sql"]:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": f"Please provide userId, a period out of {', '.join(ENERGY_PERIODS)} and a mode out of replay, sql."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_authenticated = await get_access(userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": is_authenticated._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if not is_authenticated:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_REQUEST,
+                "message": f"{userId} is not authorized to perform this operation."
+            },
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    try:
+        end_date = as_aware(datetime.fromisoformat(endDate)
+                            ) if endDate is not None else datetime.now().astimezone()
+        start_date = as_aware(datetime.fromisoformat(startDate)
+                              ) if startDate is not None else end_date - timedelta(days=30)
+    except ValueError:
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.INVALID_DATA,
+                "message": "startDate and endDate must be ISO 8601 dates."
+            },
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    device_rooms = {device_id: device.room_id for device_id,
+                    device in controller_device.devices_by_id.items()}
+
+    if mode == "sql":
+        consumptions = await get_device_energy_consumption(
+            start_date, end_date, period=period)
+
+        if isinstance(consumptions, SQLAlchemyError):
+            return JSONResponse(
+                content={
+                    "status": "error",
+                    "status_code": ResponseStatusCodes.SERVER_ERROR,
+                    "message": consumptions._message()
+                },
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        breakdown = build_energy_breakdown(
+            consumptions, start_date, end_date, period, device_rooms)
+    else:
+        logs = await get_specific_device_control_logs(
+            start_date, end_date, order_by_device=True)
+
+        if isinstance(logs, SQLAlchemyError):
+            return JSONResponse(
+                content={
+                    "status": "error",
+                    "status_code": ResponseStatusCodes.SERVER_ERROR,
+                    "message": logs._message()
+                },
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        breakdown = calculate_energy_breakdown(
+            logs, start_date, end_date, period, device_rooms)
+
+    # Days whose logs were dropped by the log retention only have daily totals
+    daily_summaries = await get_daily_energy_summaries(start_date, end_date)
+
+    if isinstance(daily_summaries, SQLAlchemyError):
+        return JSONResponse(
+            content={
+                "status": "error",
+                "status_code": ResponseStatusCodes.SERVER_ERROR,
+                "message": daily_summaries._message()
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    breakdown.add_daily_summaries(daily_summaries)
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": "Energy breakdown calculated successfully.",
+            "data": {
+                **breakdown.to_dict(),
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat()
+            }
+        },
+        status_code=status.HTTP_200_OK
+    )
+
+
+@app.get("/metrics", status_code=status.HTTP_200_OK)
+def get_metrics():
+    return JSONResponse(
+        content={
+            "status": "success",
+            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
+            "message": "Metrics retrieved successfully.",
+            "data": {
+                "access_cache": {
+                    **access_cache.get_stats(),
+                    "membership_listener": membership_listener.get_stats()
+                },
+                "database": {
+                    **database_metrics.get_stats(),
+                    "pool": engine.pool.status(),
+                    "async_pool": async_engine.pool.status()
+                },
+                "control_log_writer": control_log_writer.get_stats(),
+                "command_bus": command_bus.get_stats() if startup_tracer.ready else None,
+                "gpio": gpio_backend.get_stats() if gpio_backend is not None else None,
+                "expanders": expander_manager.get_stats() if expander_manager is not None else None,
+                "relay_state": relay_state.get_stats(),
+                "socket": socket_manager.get_stats(),
+                "startup": startup_tracer.get_stats()
+            }
+        },
+        status_code=status.HTTP_200_OK
+    )
+
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await socket_manager.connect(websocket)
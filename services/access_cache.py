@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from helpers.data_models import HouseMember
+
+
+class AccessCache():
+    '''In-process cache of house membership keyed by userId.
+
+    A cached value of `None` means the user is known not to be a member, so
+    repeated requests from unknown users do not hit the database either.
+
+    Every invalidation bumps `generation`. A reader takes the generation
+    before its query and passes it to `set`, which drops the result if an
+    invalidation happened in between, so a stale read is never cached.
+    '''
+    MISS = object()
+
+    max_size: int
+    ttl_seconds: float
+
+    entries: "OrderedDict[str, Tuple[float, HouseMember | None]]"
+    lock: threading.Lock
+    generation: int = 0
+
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    evictions: int = 0
+    stale_sets: int = 0
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str) -> HouseMember | None | Any:
+        '''Returns the cached membership or `AccessCache.MISS`.'''
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return AccessCache.MISS
+            expires_at, house_member = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id]
+                self.misses += 1
+                return AccessCache.MISS
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return house_member
+
+    def get_generation(self) -> int:
+        with self.lock:
+            return self.generation
+
+    def set(self, user_id: str, house_member: HouseMember | None, generation: int):
+        '''Caches a result read after `get_generation()` returned `generation`.'''
+        with self.lock:
+            if generation != self.generation:
+                self.stale_sets += 1
+                return
+            self.entries[user_id] = (
+                time.monotonic() + self.ttl_seconds, house_member)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        with self.lock:
+            self.generation += 1
+            if self.entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def get_stats(self) -> Dict[str, int | float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "stale_sets": self.stale_sets
+            }
+
+
+access_cache = AccessCache()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List
+
+from services.control_log_writer import control_log_writer
+from services.socket import SocketManager
+
+
+class SwitchCommand():
+    device_id: str
+    status: bool
+    user_id: str
+    event: str
+    message: str
+    submitted_at: float
+    future: asyncio.Future
+
+    def __init__(self, device_id: str, status: bool, user_id: str, event: str, message: str, future: asyncio.Future):
+        self.device_id = device_id
+        self.status = status
+        self.user_id = user_id
+        self.event = event
+        self.message = message
+        self.submitted_at = time.perf_counter()
+        self.future = future
+
+
+class SwitchCommandBus():
+    '''Single path for switching a device, run on the server's event loop.
+
+    Commands for a device are applied one at a time under the device's
+    lock. Commands arriving within `coalesce_window_seconds` of each other
+    collapse into the last one, so an on/off/on burst drives the relay
+    once. Each applied command goes GPIO write, then control log (which
+    also feeds the energy ledger), then broadcast.
+    '''
+    controller_device: Any
+    socket_manager: SocketManager
+    coalesce_window_seconds: float
+
+    loop: asyncio.AbstractEventLoop | None = None
+    ready: threading.Event
+    pending: Dict[str, List[SwitchCommand]]
+    device_locks: Dict[str, asyncio.Lock]
+
+    submitted_count: int = 0
+    applied_count: int = 0
+    coalesced_count: int = 0
+    failed_count: int = 0
+    queue_latency_total_seconds: float = 0.0
+    queue_latency_max_seconds: float = 0.0
+    started_at: float = 0.0
+
+    def __init__(self, controller_device: Any, socket_manager: SocketManager, coalesce_window_seconds: float = 0.02):
+        self.controller_device = controller_device
+        self.socket_manager = socket_manager
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.ready = threading.Event()
+        self.pending = {}
+        self.device_locks = {}
+
+    def start(self):
+        '''Binds the bus to the running event loop, call from the server startup.'''
+        self.loop = asyncio.get_running_loop()
+        self.started_at = time.perf_counter()
+        self.ready.set()
+
+    def get_device_lock(self, device_id: str) -> asyncio.Lock:
+        '''Held while a device is switched, take it to change a device's state elsewhere.'''
+        lock = self.device_locks.get(device_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.device_locks[device_id] = lock
+        return lock
+
+    async def submit(self, device_id: str, status: bool, user_id: str, event: str, message: str) -> Dict[str, Any]:
+        '''Queues a switch and returns `{"deviceId", "state", "changed"}` once applied.
+
+        Raises the switching error, like `ControllerDevice.switch_device`.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.submitted_count += 1
+        commands = self.pending.get(device_id)
+        if commands is not None:
+            # A drain for the device is already waiting, join it
+            commands.append(SwitchCommand(
+                device_id, status, user_id, event, message, future))
+        else:
+            self.pending[device_id] = [SwitchCommand(
+                device_id, status, user_id, event, message, future)]
+            asyncio.get_running_loop().create_task(self._drain(device_id))
+        return await future
+
+    def submit_threadsafe(self, device_id: str, status: bool, user_id: str, event: str, message: str) -> Future:
+        '''`submit` for callers on other threads and event loops.'''
+        self.ready.wait()
+        return asyncio.run_coroutine_threadsafe(self.submit(device_id, status, user_id, event, message), self.loop)
+
+    async def _drain(self, device_id: str):
+        async with self.get_device_lock(device_id):
+            await asyncio.sleep(self.coalesce_window_seconds)
+            commands = self.pending.pop(device_id, [])
+            if len(commands) == 0:
+                return
+            command = commands[-1]
+            self.coalesced_count += len(commands) - 1
+
+            started_at = time.perf_counter()
+            for queued_command in commands:
+                latency = started_at - queued_command.submitted_at
+                self.queue_latency_total_seconds += latency
+                self.queue_latency_max_seconds = max(
+                    self.queue_latency_max_seconds, latency)
+
+            try:
+                result = await self._apply(command)
+            except Exception as e:
+                self.failed_count += 1
+                for queued_command in commands:
+                    if not queued_command.future.done():
+                        queued_command.future.set_exception(e)
+                return
+
+            self.applied_count += 1
+            for queued_command in commands:
+                if not queued_command.future.done():
+                    queued_command.future.set_result(result)
+
+    async def _apply(self, command: SwitchCommand) -> Dict[str, Any]:
+        device = self.controller_device.get_device(command.device_id)
+        if device is None:
+            raise Exception(f"Device with id '{command.device_id}' not found.")
+        from_status = device.status
+        # Always drive the relay, it may have drifted from `device.status`.
+        # Off the loop, the relay state write is fsynced
+        await asyncio.to_thread(self.controller_device.switch_device,
+                                command.device_id, command.status)
+        result = {"deviceId": command.device_id,
+                  "state": command.status, "changed": from_status != command.status}
+        if not result["changed"]:
+            return result
+
+        control_log_writer.log_switch(command.device_id, from_status, command.status,
+                                      device.wattage, command.user_id)
+
+        await self.socket_manager.broadcast(json.dumps({
+            "event": command.event,
+            "user_id": command.user_id,
+            "message": command.message,
+            "data": {"deviceId": command.device_id, "state": command.status}
+        }))
+        return result
+
+    def get_stats(self):
+        queued_count = sum(len(commands) for commands in self.pending.values())
+        finished_count = self.submitted_count - queued_count
+        uptime_seconds = time.perf_counter() - \
+            self.started_at if self.started_at > 0 else 0.0
+        return {
+            "submitted": self.submitted_count,
+            "applied": self.applied_count,
+            "coalesced": self.coalesced_count,
+            "failed": self.failed_count,
+            "queued": queued_count,
+            "applied_per_second": self.applied_count / uptime_seconds if uptime_seconds > 0 else 0.0,
+            "avg_queue_latency_ms": self.queue_latency_total_seconds / finished_count * 1000 if finished_count > 0 else 0.0,
+            "max_queue_latency_ms": self.queue_latency_max_seconds * 1000
+        }
@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+
+from database.actions import bulk_switch_devices
+
+
+class ControlLogWriter():
+    '''Write-behind queue for device switch events.
+
+    Switch events are queued in memory and flushed by a worker thread as one
+    batched transaction once `max_batch_size` events are pending or every
+    `flush_interval_seconds`. A batch that cannot be written is appended to
+    a local spill file and retried ahead of newer events on the next flush.
+
+    The spill is replayed `max_batch_size` logs at a time, apart from the
+    live batch. A batch rejected for its data (a constraint or a value the
+    table does not accept) is retried one log at a time and the logs that
+    fail on their own are moved to the rejected file, so a single bad log
+    cannot hold back the ones after it. Any other error (the database is
+    unreachable) keeps the spill and queues the live batch behind it.
+    '''
+    spill_file_path: str
+    rejected_file_path: str
+    max_batch_size: int
+    flush_interval_seconds: float
+
+    pending: List[Dict[str, Any]]
+    listeners: List[Callable[[List[Dict[str, Any]]], None]]
+    condition: threading.Condition
+    flush_lock: threading.Lock
+    stop_event: threading.Event
+    worker_thread: threading.Thread | None = None
+
+    flushed_count: int = 0
+    spilled_count: int = 0
+    rejected_count: int = 0
+    failed_flush_count: int = 0
+    last_flush_duration_seconds: float = 0.0
+
+    def __init__(self, spill_file_path: str = "data/pending_control_logs.jsonl",
+                 max_batch_size: int = 100, flush_interval_seconds: float = 2.0):
+        self.spill_file_path = spill_file_path
+        self.rejected_file_path = f"{os.path.splitext(spill_file_path)[0]}.rejected.jsonl"
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.pending = []
+        self.listeners = []
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.worker_thread = threading.Thread(target=self._flush_worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join()
+        # Whatever is left goes to the database or, failing that, the spill file
+        self.flush()
+
+    def add_listener(self, listener: Callable[[List[Dict[str, Any]]], None]):
+        '''Registers a callback invoked with every batch of queued control logs.'''
+        self.listeners.append(listener)
+
+    def log_switch(self, device_id: str, from_status: bool, to_status: bool,
+                   wattage: float | None, user_id: str):
+        self.log_switches(
+            [(device_id, from_status, to_status, wattage, user_id)])
+
+    def log_switches(self, switches: List[tuple]):
+        '''Queues `(device_id, from_status, to_status, wattage, user_id)` events.
+
+        Events queued together are always flushed in the same transaction.
+        '''
+        created_at = datetime.now().astimezone().isoformat()
+        control_logs = [{
+            "deviceControlLogId": str(uuid.uuid4()),
+            "deviceId": device_id,
+            "statusChangedFrom": from_status,
+            "statusChangedTo": to_status,
+            "deviceWattage": wattage,
+            "userId": user_id,
+            "createdAt": created_at
+        } for device_id, from_status, to_status, wattage, user_id in switches]
+        with self.condition:
+            self.pending.extend(control_logs)
+            if len(self.pending) >= self.max_batch_size:
+                self.condition.notify()
+        for listener in self.listeners:
+            listener(control_logs)
+
+    def _flush_worker(self):
+        while not self.stop_event.is_set():
+            with self.condition:
+                if len(self.pending) < self.max_batch_size:
+                    self.condition.wait(self.flush_interval_seconds)
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                batch = self.pending
+                self.pending = []
+            spilled = self.read_spill_file()
+            if len(spilled) == 0 and len(batch) == 0:
+                return
+
+            start = time.perf_counter()
+            kept: List[Dict[str, Any]] = []
+            for index in range(0, len(spilled), self.max_batch_size):
+                kept = self.write_control_logs(
+                    spilled[index:index + self.max_batch_size])
+                if len(kept) > 0:
+                    kept += spilled[index + self.max_batch_size:]
+                    break
+            spill_kept_count = len(kept)
+            if len(kept) == 0:
+                kept = self.write_control_logs(batch)
+            else:
+                # Stay behind the spill, so device statuses are written in order
+                kept += batch
+            self.last_flush_duration_seconds = time.perf_counter() - start
+
+            if len(spilled) > 0 or len(kept) > 0:
+                self.write_spill_file(kept)
+            if len(spilled) > spill_kept_count:
+                print(
+                    f"[Control Log Writer] Replayed {len(spilled) - spill_kept_count} spilled log(s).")
+            if len(kept) > 0:
+                self.failed_flush_count += 1
+                self.spilled_count += len(kept) - spill_kept_count
+                print(
+                    f"[Control Log Writer] Flush failed, {len(kept)} log(s) kept in {self.spill_file_path}.")
+
+    def flush_device(self, device_id: str) -> bool:
+        '''Flushes now, returns whether every log of the device is written.
+
+        Call it before writing the device's row elsewhere, so a queued status
+        UPDATE cannot land after it and overwrite it.
+        '''
+        self.flush()
+        with self.condition:
+            if any(control_log["deviceId"] == device_id for control_log in self.pending):
+                return False
+        return all(control_log["deviceId"] != device_id for control_log in self.read_spill_file())
+
+    def write_control_logs(self, control_logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        '''Writes the logs in one transaction, returns those to retry later.'''
+        if len(control_logs) == 0:
+            return []
+        result = bulk_switch_devices(
+            [self.to_row(control_log) for control_log in control_logs])
+        if not isinstance(result, SQLAlchemyError):
+            self.flushed_count += len(control_logs)
+            return []
+        if not self.is_rejected(result):
+            return control_logs
+
+        # Find the logs that can never be written
+        kept: List[Dict[str, Any]] = []
+        for control_log in control_logs:
+            if len(kept) > 0:
+                kept.append(control_log)
+                continue
+            result = bulk_switch_devices([self.to_row(control_log)])
+            if not isinstance(result, SQLAlchemyError):
+                self.flushed_count += 1
+            elif self.is_rejected(result):
+                self.reject(control_log, result)
+            else:
+                kept.append(control_log)
+        return kept
+
+    def is_rejected(self, error: SQLAlchemyError) -> bool:
+        return isinstance(error, (IntegrityError, DataError))
+
+    def reject(self, control_log: Dict[str, Any], error: SQLAlchemyError):
+        rejected_dir = os.path.dirname(self.rejected_file_path)
+        if rejected_dir != "":
+            os.makedirs(rejected_dir, exist_ok=True)
+        with open(self.rejected_file_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({**control_log, "error": str(error)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.rejected_count += 1
+        print(
+            f"[Control Log Writer] Log {control_log['deviceControlLogId']} rejected, moved to {self.rejected_file_path}.")
+
+    def to_row(self, control_log: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(control_log)
+        row["deviceControlLogId"] = uuid.UUID(row["deviceControlLogId"])
+        row["deviceId"] = uuid.UUID(row["deviceId"])
+        row["createdAt"] = datetime.fromisoformat(row["createdAt"])
+        row["updatedAt"] = row["createdAt"]
+        return row
+
+    def read_spill_file(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.spill_file_path):
+            return []
+        control_logs: List[Dict[str, Any]] = []
+        with open(self.spill_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    control_logs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write
+                    print(
+                        f"[Control Log Writer] Skipping unreadable spill line: {line}")
+        return control_logs
+
+    def write_spill_file(self, control_logs: List[Dict[str, Any]]):
+        '''Replaces the spill file with `control_logs`, removing it when empty.'''
+        if len(control_logs) == 0:
+            if os.path.exists(self.spill_file_path):
+                os.remove(self.spill_file_path)
+            return
+        spill_dir = os.path.dirname(self.spill_file_path)
+        if spill_dir != "":
+            os.makedirs(spill_dir, exist_ok=True)
+        temp_file_path = f"{self.spill_file_path}.tmp"
+        with open(temp_file_path, 'w', encoding='utf-8') as f:
+            for control_log in control_logs:
+                f.write(json.dumps(control_log) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file_path, self.spill_file_path)
+
+    def get_stats(self) -> Dict[str, int | float]:
+        with self.condition:
+            pending_count = len(self.pending)
+        return {
+            "pending": pending_count,
+            "flushed": self.flushed_count,
+            "spilled": self.spilled_count,
+            "rejected": self.rejected_count,
+            "failed_flushes": self.failed_flush_count,
+            "last_flush_duration_seconds": self.last_flush_duration_seconds
+        }
+
+
+control_log_writer = ControlLogWriter()
@@ -1,36 +1,168 @@
-from datetime import datetime
-from typing import List
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List
 
-from helpers.data_models import DeviceControlLog
+from helpers.data_models import DeviceControlLog, DeviceEnergyConsumption
+
+ENERGY_PERIODS = ["hour", "day", "month"]
 
 
 def calculate_energy_consumption(logs: List[DeviceControlLog], end_date: datetime):
-    '''Returns Energy Consumption in watt-hours'''
+    '''Returns Energy Consumption in watt-hours
+
+    A closed ON/OFF interval is charged at the OFF log's wattage, one still
+    open at `end_date` at the ON log's, like the energy ledger.
+    '''
+    parse_time = datetime.fromisoformat
     total_energy_consumed = 0.0  # in watt-hours
-    last_on_time = None
+    # Pair ON/OFF events per device so overlapping devices do not mix. ON
+    # times are kept as strings and only parsed once they are paired.
+    last_on_times: Dict[str, str] = {}
+    last_on_wattages: Dict[str, float | None] = {}
 
     # Iterate through logs to calculate total on-time
     for log in logs:
-        if log.status_changed_to and not log.status_changed_from:
-            # Device was turned ON
-            last_on_time = datetime.fromisoformat(log.created_at)
-        elif log.status_changed_from and not log.status_changed_to and last_on_time:
-            # Device was turned OFF and there was a previous ON event
-            duration = datetime.fromisoformat(
-                log.created_at) - last_on_time  # timedelta
-            hours_on = duration.total_seconds() / 3600  # Convert seconds to hours
-            # Energy in watt-hours
-            energy_consumed = (
-                hours_on * log.device_wattage) if log.device_wattage is not None else 0.0
-            total_energy_consumed += energy_consumed
-            last_on_time = None  # Reset for the next on-off pair
-
-    # Handle edge case where the device was still ON at the end of the period
-    if last_on_time:
-        duration = end_date - last_on_time
-        hours_on = duration.total_seconds() / 3600
-        energy_consumed = (
-            hours_on * log.device_wattage) if log.device_wattage is not None else 0.0
-        total_energy_consumed += energy_consumed
+        if log.status_changed_to:
+            if not log.status_changed_from:
+                # Device was turned ON
+                last_on_times[log.device_id] = log.created_at
+                last_on_wattages[log.device_id] = log.device_wattage
+        elif log.status_changed_from:
+            last_on_time = last_on_times.pop(log.device_id, None)
+            if last_on_time is not None and log.device_wattage is not None:
+                # Device was turned OFF after an ON event, energy in watt-hours
+                hours_on = (parse_time(log.created_at) -
+                            parse_time(last_on_time)).total_seconds() / 3600
+                total_energy_consumed += hours_on * log.device_wattage
+
+    # Handle edge case where a device was still ON at the end of the period
+    for device_id, last_on_time in last_on_times.items():
+        device_wattage = last_on_wattages[device_id]
+        if device_wattage is not None:
+            hours_on = (end_date - parse_time(last_on_time)
+                        ).total_seconds() / 3600
+            total_energy_consumed += hours_on * device_wattage
 
     return total_energy_consumed
+
+
+def get_period_start(at: datetime, period: str) -> datetime:
+    if period == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_period_start(period_start: datetime, period: str) -> datetime:
+    if period == "hour":
+        return period_start + timedelta(hours=1)
+    if period == "day":
+        return period_start + timedelta(days=1)
+    if period_start.month == 12:
+        return period_start.replace(year=period_start.year + 1, month=1)
+    return period_start.replace(month=period_start.month + 1)
+
+
+class EnergyBreakdown():
+    '''Watt-hours split by device, room and period, filled in one pass.'''
+    total_watt_hours: float
+    devices: Dict[str, float]
+    rooms: Dict[str, float]
+    periods: Dict[str, float]
+
+    def __init__(self, start_date: datetime, end_date: datetime, period: str, device_rooms: Dict[str, str]):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.period = period
+        self.device_rooms = device_rooms
+        self.total_watt_hours = 0.0
+        self.devices = {}
+        self.rooms = {}
+        self.periods = {}
+
+    def add_interval(self, device_id: str, on_time: datetime, off_time: datetime, wattage: float | None):
+        if wattage is None:
+            return
+        on_time = max(on_time, self.start_date)
+        off_time = min(off_time, self.end_date)
+        # Split the interval at period boundaries
+        while on_time < off_time:
+            period_start = get_period_start(on_time, self.period)
+            period_end = min(get_next_period_start(
+                period_start, self.period), off_time)
+            self.add_watt_hours(device_id, period_start.isoformat(
+            ), wattage * (period_end - on_time).total_seconds() / 3600)
+            on_time = period_end
+
+    def add_watt_hours(self, device_id: str, period_key: str, watt_hours: float):
+        room_id = self.device_rooms.get(device_id)
+        self.total_watt_hours += watt_hours
+        self.devices[device_id] = self.devices.get(
+            device_id, 0.0) + watt_hours
+        if room_id is not None:
+            self.rooms[room_id] = self.rooms.get(room_id, 0.0) + watt_hours
+        self.periods[period_key] = self.periods.get(
+            period_key, 0.0) + watt_hours
+
+    def add_daily_summaries(self, summaries: List[DeviceEnergyConsumption]):
+        '''Adds the totals of days whose logs were rolled up, at day resolution.'''
+        for summary in summaries:
+            day_start = datetime.combine(date.fromisoformat(
+                summary.period_start), time(), tzinfo=self.start_date.tzinfo)
+            self.add_watt_hours(summary.device_id, get_period_start(
+                day_start, self.period).isoformat(), summary.watt_hours)
+
+    def to_dict(self):
+        return {
+            "total_watt_hours": self.total_watt_hours,
+            "period": self.period,
+            "devices": self.devices,
+            "rooms": self.rooms,
+            "periods": dict(sorted(self.periods.items()))
+        }
+
+
+def calculate_energy_breakdown(logs: List[DeviceControlLog], start_date: datetime, end_date: datetime,
+                               period: str, device_rooms: Dict[str, str]) -> EnergyBreakdown:
+    '''Returns the energy consumption per device, room and period.
+
+    `logs` must be sorted by device_id and then created_at, so only the open
+    ON event of the current device has to be kept while streaming.
+    '''
+    breakdown = EnergyBreakdown(start_date, end_date, period, device_rooms)
+    current_device_id: str | None = None
+    last_on_time: datetime | None = None
+    last_on_wattage: float | None = None
+
+    for log in logs:
+        if log.device_id != current_device_id:
+            # Device was still ON at the end of the period
+            if current_device_id is not None and last_on_time is not None:
+                breakdown.add_interval(
+                    current_device_id, last_on_time, end_date, last_on_wattage)
+            current_device_id = log.device_id
+            last_on_time = None
+        if log.status_changed_to and not log.status_changed_from:
+            last_on_time = datetime.fromisoformat(
+                log.created_at).astimezone(start_date.tzinfo)
+            last_on_wattage = log.device_wattage
+        elif log.status_changed_from and not log.status_changed_to and last_on_time is not None:
+            breakdown.add_interval(log.device_id, last_on_time, datetime.fromisoformat(
+                log.created_at).astimezone(start_date.tzinfo), log.device_wattage)
+            last_on_time = None
+
+    if current_device_id is not None and last_on_time is not None:
+        breakdown.add_interval(
+            current_device_id, last_on_time, end_date, last_on_wattage)
+
+    return breakdown
+
+
+def build_energy_breakdown(consumptions: List[DeviceEnergyConsumption], start_date: datetime, end_date: datetime,
+                           period: str, device_rooms: Dict[str, str]) -> EnergyBreakdown:
+    '''Builds the breakdown from per device and period totals aggregated in SQL.'''
+    breakdown = EnergyBreakdown(start_date, end_date, period, device_rooms)
+    for consumption in consumptions:
+        breakdown.add_watt_hours(consumption.device_id, consumption.period_start if consumption.period_start is not None else start_date.isoformat(),
+                                 consumption.watt_hours)
+    return breakdown
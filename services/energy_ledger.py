@@ -0,0 +1,225 @@
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import compact_energy_checkpoints, get_latest_energy_checkpoints, save_energy_checkpoints, stream_specific_device_control_logs
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def as_aware(value: datetime) -> datetime:
+    '''Treats naive datetimes as local time, like `datetime.now()` does.'''
+    return value if value.tzinfo is not None else value.astimezone()
+
+
+class DeviceEnergyState():
+    '''Running energy total of a single device.
+
+    `cumulative_watt_hours` covers everything up to `since`; while the device
+    is on, energy accrues from `since` at `wattage`. An on interval is
+    charged at the wattage of the OFF event that closes it, and while it is
+    still open at the ON event's, the same rule as the log replays in
+    `services.energy_consumption` and the SQL aggregation.
+    '''
+    cumulative_watt_hours: float
+    is_on: bool
+    wattage: float | None
+    since: datetime
+
+    def __init__(self, cumulative_watt_hours: float = 0.0, is_on: bool = False,
+                 wattage: float | None = None, since: datetime = EPOCH):
+        self.cumulative_watt_hours = cumulative_watt_hours
+        self.is_on = is_on
+        self.wattage = wattage
+        self.since = since
+
+    def watt_hours_at(self, at: datetime) -> float:
+        if self.is_on and self.wattage is not None and at > self.since:
+            return self.cumulative_watt_hours + self.wattage * (at - self.since).total_seconds() / 3600
+        return self.cumulative_watt_hours
+
+    def record(self, is_on: bool, wattage: float | None, at: datetime):
+        if is_on == self.is_on:
+            # A repeated event does not split the interval, the replays skip it
+            if is_on:
+                self.wattage = wattage
+            return
+        if self.is_on and wattage is not None and at > self.since:
+            self.cumulative_watt_hours += wattage * \
+                (at - self.since).total_seconds() / 3600
+        self.is_on = is_on
+        self.wattage = wattage
+        self.since = max(self.since, at)
+
+
+class EnergyLedger():
+    '''Per-device running watt-hour totals fed by switch events.
+
+    Totals are checkpointed to `EnergyCheckpoints` every
+    `checkpoint_interval_seconds`. Checkpoints older than
+    `compact_after_days` are thinned out to the last one per device and
+    day. The consumption of a period is the difference of the cumulative
+    totals at its two ends. A total in the past is rebuilt from the last
+    checkpoint before it plus at most a day of control logs, so a query no
+    longer replays the whole period.
+    '''
+    devices: Dict[str, DeviceEnergyState]
+    checkpoint_interval_seconds: float
+    compact_after_days: int
+    loaded: bool = False
+    compacted_at: datetime | None = None
+
+    lock: threading.Lock
+    stop_event: threading.Event
+    worker_thread: threading.Thread | None = None
+
+    def __init__(self, checkpoint_interval_seconds: float = 3600, compact_after_days: int = 7):
+        self.devices = {}
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds
+        self.compact_after_days = compact_after_days
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def load(self):
+        now = datetime.now().astimezone()
+        devices = self.build_device_states(now)
+        if isinstance(devices, SQLAlchemyError):
+            print("[Energy Ledger] Loading running totals failed.")
+            return
+        with self.lock:
+            self.devices = devices
+            self.loaded = True
+        print(f"[Energy Ledger] Loaded running totals of {len(devices)} device(s).")
+        # Persist right away so the next start does not replay the same logs
+        self.checkpoint()
+
+    def start(self):
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.worker_thread = threading.Thread(target=self._checkpoint_worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join()
+        self.checkpoint()
+
+    def _checkpoint_worker(self):
+        while not self.stop_event.wait(self.checkpoint_interval_seconds):
+            self.checkpoint()
+            self.compact()
+
+    def compact(self):
+        '''Thins out old checkpoints, at most once a day.'''
+        now = datetime.now(timezone.utc)
+        if self.compacted_at is not None and now - self.compacted_at < timedelta(days=1):
+            return
+        deleted = compact_energy_checkpoints(
+            now - timedelta(days=self.compact_after_days))
+        if isinstance(deleted, SQLAlchemyError):
+            return
+        self.compacted_at = now
+        print(f"[Energy Ledger] Compacted {deleted} checkpoint(s).")
+
+    def record(self, device_id: str, is_on: bool, wattage: float | None, at: datetime):
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                device = DeviceEnergyState(since=as_aware(at))
+                self.devices[device_id] = device
+            device.record(is_on, wattage, as_aware(at))
+
+    def on_control_logs(self, control_logs: List[Dict[str, Any]]):
+        '''Listener for `ControlLogWriter`, fed the queued control log rows.'''
+        for control_log in control_logs:
+            self.record(control_log["deviceId"], control_log["statusChangedTo"],
+                        control_log["deviceWattage"], datetime.fromisoformat(control_log["createdAt"]))
+
+    def checkpoint(self) -> int | SQLAlchemyError:
+        with self.lock:
+            if not self.loaded:
+                return 0
+            now = datetime.now().astimezone()
+            energy_checkpoints = [{
+                "energyCheckpointId": uuid.uuid4(),
+                "deviceId": uuid.UUID(device_id),
+                "cumulativeWattHours": device.watt_hours_at(now),
+                "isOn": device.is_on,
+                "wattage": device.wattage,
+                "checkpointAt": now
+            } for device_id, device in self.devices.items()]
+        return save_energy_checkpoints(energy_checkpoints)
+
+    def build_device_states(self, at: datetime) -> Dict[str, DeviceEnergyState] | SQLAlchemyError:
+        '''Rebuilds every device's running total as of `at` from the database.'''
+        energy_checkpoints = get_latest_energy_checkpoints(at)
+        if isinstance(energy_checkpoints, SQLAlchemyError):
+            return energy_checkpoints
+
+        devices: Dict[str, DeviceEnergyState] = {}
+        for energy_checkpoint in energy_checkpoints:
+            devices[energy_checkpoint.device_id] = DeviceEnergyState(
+                energy_checkpoint.cumulative_watt_hours, energy_checkpoint.is_on,
+                energy_checkpoint.wattage, datetime.fromisoformat(energy_checkpoint.checkpoint_at))
+
+        # Devices without a checkpoint are replayed from their first log
+        replay_from = min([device.since for device in devices.values()]) if len(
+            devices) > 0 else EPOCH
+
+        def replay_logs(logs):
+            for log in logs:
+                created_at = datetime.fromisoformat(log.created_at)
+                device = devices.get(log.device_id)
+                if device is None:
+                    device = DeviceEnergyState(since=created_at)
+                    devices[log.device_id] = device
+                elif created_at <= device.since:
+                    # Already accounted for by the device's checkpoint
+                    continue
+                device.record(log.status_changed_to,
+                              log.device_wattage, created_at)
+
+        # Streamed, the first load without checkpoints reads every log
+        replayed = stream_specific_device_control_logs(
+            replay_logs, replay_from, at)
+        if isinstance(replayed, SQLAlchemyError):
+            return replayed
+        return devices
+
+    def get_watt_hours_at(self, at: datetime) -> Dict[str, float] | SQLAlchemyError:
+        at = as_aware(at)
+        with self.lock:
+            if self.loaded and all(device.since <= at for device in self.devices.values()):
+                return {device_id: device.watt_hours_at(at) for device_id, device in self.devices.items()}
+        devices = self.build_device_states(at)
+        if isinstance(devices, SQLAlchemyError):
+            return devices
+        return {device_id: device.watt_hours_at(at) for device_id, device in devices.items()}
+
+    def get_consumption(self, start_date: datetime, end_date: datetime) -> Dict[str, float] | SQLAlchemyError:
+        '''Returns watt-hours consumed by each device between the two dates.'''
+        start_watt_hours = self.get_watt_hours_at(start_date)
+        if isinstance(start_watt_hours, SQLAlchemyError):
+            return start_watt_hours
+        end_watt_hours = self.get_watt_hours_at(end_date)
+        if isinstance(end_watt_hours, SQLAlchemyError):
+            return end_watt_hours
+        return {device_id: watt_hours - start_watt_hours.get(device_id, 0.0)
+                for device_id, watt_hours in end_watt_hours.items()}
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "loaded": self.loaded,
+                "devices": len(self.devices),
+                "checkpoint_interval_seconds": self.checkpoint_interval_seconds
+            }
+
+
+energy_ledger = EnergyLedger()
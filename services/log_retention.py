@@ -0,0 +1,94 @@
+import os
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.partitions import DEFAULT_PARTITION, add_months, ensure_log_partitions, get_log_partitions, get_month_start, is_log_table_partitioned, roll_up_default_log_partition, roll_up_log_partition
+
+
+class LogRetentionManager():
+    '''Keeps `DeviceControlLogs` partitioned by month and bounded in size.
+
+    Once a day it makes sure the partitions for this and the next month
+    exist. Partitions older than `retention_months` are rolled up into
+    `DeviceEnergyDailySummaries` (on-seconds and Wh per device and day) and
+    dropped, as are the default partition's logs from before the cutoff.
+    The energy queries read those summaries for the dropped days.
+
+    A table that is not partitioned yet is converted by
+    `partition_control_logs.py`, not here, since the conversion blocks
+    writers while it moves the rows.
+    '''
+    retention_months: int
+    interval_seconds: float
+
+    stop_event: threading.Event
+    worker_thread: threading.Thread | None = None
+
+    def __init__(self, retention_months: int = 6, interval_seconds: float = 24 * 3600):
+        self.retention_months = retention_months
+        self.interval_seconds = interval_seconds
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.worker_thread = threading.Thread(target=self._maintenance_worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join()
+
+    def _maintenance_worker(self):
+        while True:
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"[Log Retention] Maintenance failed. {e}")
+            if self.stop_event.wait(self.interval_seconds):
+                return
+
+    def run_maintenance(self):
+        is_partitioned = is_log_table_partitioned()
+        if is_partitioned is None or isinstance(is_partitioned, SQLAlchemyError):
+            return
+        if not is_partitioned:
+            print("[Log Retention] Device Control Logs are not partitioned, run partition_control_logs.py. (Skipped)")
+            return
+
+        now = datetime.now(timezone.utc)
+        ensure_log_partitions(now, add_months(get_month_start(now), 1))
+        self.roll_up_expired_partitions(now)
+
+    def roll_up_expired_partitions(self, now: datetime):
+        cutoff = add_months(get_month_start(now), -self.retention_months)
+        partitions = get_log_partitions()
+        if isinstance(partitions, SQLAlchemyError):
+            return
+        # The default partition holds the logs older than every monthly
+        # one, stop at the oldest so it is carried into that partition
+        month_starts = [month_start for _, month_start in partitions]
+        summarized = roll_up_default_log_partition(
+            min([cutoff, *month_starts]))
+        if isinstance(summarized, SQLAlchemyError):
+            return
+        if summarized > 0:
+            print(
+                f"[Log Retention] Rolled up {DEFAULT_PARTITION} logs before {min([cutoff, *month_starts]).isoformat()} into {summarized} daily summaries.")
+        for partition_name, month_start in partitions:
+            if month_start >= cutoff:
+                continue
+            summarized = roll_up_log_partition(partition_name, month_start)
+            if isinstance(summarized, SQLAlchemyError):
+                return
+            print(
+                f"[Log Retention] Rolled up {partition_name} into {summarized} daily summaries and dropped it.")
+
+
+log_retention_manager = LogRetentionManager(
+    retention_months=int(os.environ.get("LOG_RETENTION_MONTHS", "6")))
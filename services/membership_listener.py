@@ -0,0 +1,89 @@
+import select
+import threading
+
+from sqlalchemy import text
+
+from database.database import engine
+from services.access_cache import access_cache
+
+HOUSE_MEMBERS_CHANNEL = "house_members_changed"
+
+
+def notify_house_members_changed(db):
+    '''Tells every server's `MembershipListener` to drop its access cache
+    once the transaction `db` is in commits.'''
+    db.execute(text(f'NOTIFY "{HOUSE_MEMBERS_CHANNEL}"'))
+
+
+class MembershipListener():
+    '''Clears the access cache when another process changes house membership.
+
+    Restores and bulk imports run as separate scripts, so their writes never
+    reach this process's cache. They NOTIFY `HOUSE_MEMBERS_CHANNEL` in their
+    transaction and this thread LISTENs on a dedicated connection, outside
+    the pool. The cache is also cleared on every (re)connect, since a
+    notification sent while disconnected is lost.
+    '''
+    poll_interval_seconds: float
+    retry_interval_seconds: float
+
+    stop_event: threading.Event
+    worker_thread: threading.Thread | None = None
+
+    notifications: int = 0
+    connects: int = 0
+
+    def __init__(self, poll_interval_seconds: float = 5.0, retry_interval_seconds: float = 10.0):
+        self.poll_interval_seconds = poll_interval_seconds
+        self.retry_interval_seconds = retry_interval_seconds
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.worker_thread = threading.Thread(target=self._listen_worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join()
+
+    def _listen_worker(self):
+        while not self.stop_event.is_set():
+            connection = None
+            try:
+                connect_args, connect_params = engine.dialect.create_connect_args(
+                    engine.url)
+                connection = engine.dialect.dbapi.connect(
+                    *connect_args, **connect_params)
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN "{HOUSE_MEMBERS_CHANNEL}"')
+                access_cache.clear()
+                self.connects += 1
+                while not self.stop_event.is_set():
+                    if select.select([connection], [], [], self.poll_interval_seconds) == ([], [], []):
+                        continue
+                    connection.poll()
+                    if len(connection.notifies) > 0:
+                        self.notifications += len(connection.notifies)
+                        connection.notifies.clear()
+                        access_cache.clear()
+            except Exception as e:
+                print(f"[Membership Listener] Listening failed. {e}")
+                self.stop_event.wait(self.retry_interval_seconds)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def get_stats(self):
+        return {
+            "listening": self.worker_thread is not None and self.worker_thread.is_alive(),
+            "notifications": self.notifications,
+            "connects": self.connects
+        }
+
+
+membership_listener = MembershipListener()
@@ -1,38 +1,64 @@
-import json
+import heapq
+import itertools
 import threading
+import time
 from datetime import datetime
-from typing import Any, List
+from typing import Any, Dict, List, Tuple
 import asyncio
 
-from database.actions import switch_device
-
 from helpers.data_models import Device
 
-from services.scheduled_device import get_scheduled_device_status
-from services.socket import SocketEvents, SocketManager
+from services.command_bus import SwitchCommandBus
+from services.scheduled_device import get_current_schedule_status, get_next_schedule_transition, get_scheduled_days_mask
+from services.socket import SocketEvents
+
+# Upper bound on a single sleep, so a system clock change (e.g. the NTP sync
+# of a Pi without an RTC) is noticed within a minute
+MAX_WAIT_SECONDS = 60
+# The wall clock drifting this far from the monotonic clock between two
+# wake ups counts as the clock being set, every transition is then rebuilt
+CLOCK_JUMP_SECONDS = 5
 
 
 class ScheduleDeviceAssistant():
-    scheduled_devices: List[Device] = []
+    scheduled_devices: Dict[str, Device]
     controller_device: Any
-    socket_manager: SocketManager
+    command_bus: SwitchCommandBus
+
+    # Heap of (when, token, device_id, status). An entry is stale once its
+    # token no longer matches `transition_tokens[device_id]`.
+    transitions: List[Tuple[datetime, int, str, bool]]
+    transition_tokens: Dict[str, int]
+    tokens: itertools.count
 
+    # Wall and monotonic clock at the last wake up, to detect clock jumps
+    clock_checked_at: Tuple[datetime, float]
+    clock_jump_count: int = 0
+
+    condition: threading.Condition
     stop_event: threading.Event
     worker_thread: threading.Thread | None = None
 
-    def __init__(self, controller_device: Any, socket_manager: SocketManager):
-        scheduled_devices = controller_device.get_scheduled_devices()
-        scheduled_devices = scheduled_devices if scheduled_devices is not None else []
-        self.scheduled_devices = scheduled_devices
+    def __init__(self, controller_device: Any, command_bus: SwitchCommandBus):
+        self.scheduled_devices = {}
         self.controller_device = controller_device
-        self.socket_manager = socket_manager
+        self.command_bus = command_bus
+        self.transitions = []
+        self.transition_tokens = {}
+        self.tokens = itertools.count()
+        self.condition = threading.Condition()
         self.stop_event = threading.Event()
+        # Taken before the first schedule, a clock set from then on is caught
+        self.clock_checked_at = (datetime.now(), time.monotonic())
+
+        scheduled_devices = controller_device.get_scheduled_devices()
+        scheduled_devices = scheduled_devices if scheduled_devices is not None else []
+        for device in scheduled_devices:
+            self.schedule_device(device)
 
     def start_scheduled_devices_watch(self):
-        # Stop the current worker thread if it is running
         if self.worker_thread is not None and self.worker_thread.is_alive():
-            self.stop_event.set()
-            self.worker_thread.join()
+            return
 
         # Clear the stop event for the new worker thread
         self.stop_event.clear()
@@ -48,59 +74,118 @@ class ScheduleDeviceAssistant():
 
     async def _scheduled_devices_worker_async(self):
         while not self.stop_event.is_set():
-            await self.switch_scheduled_devices()
-            # Wait for 60 seconds or until stop_event is set
-            if not self.stop_event.wait(60):
-                await asyncio.sleep(0)
-
-    async def switch_scheduled_devices(self):
-        today = datetime.now().strftime("%a")
-        for device in self.scheduled_devices:
-            if today.lower() in device.days_scheduled.lower() if device.days_scheduled is not None else "":
-                is_on = get_scheduled_device_status(
-                    device.start_time if device.start_time is not None else "",
-                    device.off_time if device.off_time is not None else "")
-                if is_on != device.status:
-                    device.status = is_on
-                    try:
-                        self.controller_device.switch_device(
-                            device.device_id, is_on)
-                        broadcast_data = {
-                            "event": SocketEvents.SCHEDULED_SWITCH_DEVICE,
-                            "user_id": f"{device.scheduled_by}|-|Schedule Assistant",
-                            "message": f"Schedule Assistant turned {'on' if is_on else 'off'} {device.device_name}.",
-                            "data": {"deviceId": device.device_id, "state": is_on}
-                        }
-                        await self.socket_manager.broadcast(json.dumps(broadcast_data))
-                        switch_device(device.device_id, device.status, is_on,
-                                      f"{device.scheduled_by}|-|Schedule Assistant")
-                    except Exception as e:
-                        print(
-                            f"[Schedule Assistant] : Switch scheduled device failed. {e}")
+            for device_id, is_on in self.wait_for_due_transitions():
+                device = self.scheduled_devices.get(device_id)
+                if device is not None:
+                    await self.switch_scheduled_device(device, is_on)
+
+    def wait_for_due_transitions(self) -> List[Tuple[str, bool]]:
+        '''Blocks until the earliest transition is due and returns every due
+        (device_id, status), queueing each device's following transition.'''
+        with self.condition:
+            while not self.stop_event.is_set():
+                self._check_clock_jump()
+                if len(self.transitions) == 0:
+                    self.condition.wait()
+                    continue
+                delay = (self.transitions[0][0] -
+                         datetime.now()).total_seconds()
+                if delay > 0:
+                    self.condition.wait(min(delay, MAX_WAIT_SECONDS))
+                    continue
+
+                now = datetime.now()
+                due: List[Tuple[str, bool]] = []
+                while len(self.transitions) > 0 and self.transitions[0][0] <= now:
+                    _, token, device_id, is_on = heapq.heappop(
+                        self.transitions)
+                    if self.transition_tokens.get(device_id) != token:
+                        continue
+                    due.append((device_id, is_on))
+                    self._push_next_transition(
+                        self.scheduled_devices[device_id], now)
+                return due
+            return []
+
+    def notify_clock_set(self):
+        '''Wakes the worker to check the clock now, e.g. once NTP set it.'''
+        with self.condition:
+            self.condition.notify()
+
+    def _check_clock_jump(self):
+        '''Rebuilds every transition when the wall clock was set since the
+        last wake up, so entries queued from the old clock neither fire at
+        once with a stale status nor wait on a moved deadline.'''
+        now, monotonic_now = datetime.now(), time.monotonic()
+        checked_at = self.clock_checked_at
+        self.clock_checked_at = (now, monotonic_now)
+        drift = (now - checked_at[0]).total_seconds() - \
+            (monotonic_now - checked_at[1])
+        if abs(drift) < CLOCK_JUMP_SECONDS:
+            return
+        self.clock_jump_count += 1
+        print(
+            f"[Schedule Assistant] : System clock moved by {drift:.0f} s, rebuilding {len(self.scheduled_devices)} schedule(s).")
+        self.transitions = []
+        for device in self.scheduled_devices.values():
+            # The device gets the status of the window it is in by now
+            self._push_next_transition(device, now, catch_up=True)
+
+    def _push_next_transition(self, device: Device, now: datetime, catch_up: bool = False):
+        token = next(self.tokens)
+        self.transition_tokens[device.device_id] = token
+        start_time = device.start_time if device.start_time is not None else ""
+        off_time = device.off_time if device.off_time is not None else ""
+        days_mask = get_scheduled_days_mask(device.days_scheduled)
+        try:
+            transition = get_next_schedule_transition(
+                start_time, off_time, days_mask, now)
+            current_status = get_current_schedule_status(
+                start_time, off_time, days_mask, now) if catch_up else None
+        except ValueError as e:
+            print(
+                f"[Schedule Assistant] : Invalid schedule for {device.device_name}. {e}")
+            return
+        if current_status is not None:
+            # Apply the window the device is currently in right away
+            heapq.heappush(self.transitions,
+                           (now, token, device.device_id, current_status))
+        if transition is not None:
+            heapq.heappush(self.transitions,
+                           (transition[0], token, device.device_id, transition[1]))
+
+    async def switch_scheduled_device(self, device: Device, is_on: bool):
+        if is_on != device.status:
+            user_id = f"{device.scheduled_by}|-|Schedule Assistant"
+            try:
+                # Runs on the server loop with every other switch of the device
+                await asyncio.wrap_future(self.command_bus.submit_threadsafe(
+                    device.device_id, is_on, user_id, SocketEvents.SCHEDULED_SWITCH_DEVICE,
+                    f"Schedule Assistant turned {'on' if is_on else 'off'} {device.device_name}."))
+            except Exception as e:
+                print(
+                    f"[Schedule Assistant] : Switch scheduled device failed. {e}")
 
     def schedule_device(self, device: Device):
-        self.remove_scheduled_device(device.device_id)
-        self.scheduled_devices.append(device)
-        # Restart the watch only if the worker thread is not already running
-        if self.worker_thread is None or not self.worker_thread.is_alive():
-            self.start_scheduled_devices_watch()
+        with self.condition:
+            self.scheduled_devices[device.device_id] = device
+            self._push_next_transition(device, datetime.now(), catch_up=True)
+            self.condition.notify()
+        self.start_scheduled_devices_watch()
 
     def get_scheduled_device(self, device_id: str):
-        for device in self.scheduled_devices:
-            if device.device_id == device_id:
-                return device
+        return self.scheduled_devices.get(device_id)
 
     def remove_scheduled_device(self, device_id: str):
-        device = self.get_scheduled_device(device_id)
-        if device is not None:
-            self.scheduled_devices.remove(device)
-            # Restart the watch only if there are scheduled devices left
-            if len(self.scheduled_devices) > 0:
-                self.start_scheduled_devices_watch()
-            else:
-                self.stop_scheduled_devices_watch()
+        with self.condition:
+            if self.scheduled_devices.pop(device_id, None) is not None:
+                # Any queued transition for the device is now stale
+                self.transition_tokens.pop(device_id, None)
+                self.condition.notify()
 
     def stop_scheduled_devices_watch(self):
         if self.worker_thread is not None and self.worker_thread.is_alive():
-            self.stop_event.set()
+            with self.condition:
+                self.stop_event.set()
+                self.condition.notify()
             self.worker_thread.join()
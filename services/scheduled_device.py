@@ -1,17 +1,81 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Tuple
 
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
 
-def get_scheduled_device_status(start_time: str, off_time: str) -> bool:
-    current = datetime.now()
-    current_time = current.hour * 60 + current.minute
 
-    start_hour, start_minute = map(int, start_time.split(":"))
-    off_hour, off_minute = map(int, off_time.split(":"))
+@lru_cache(maxsize=1024)
+def get_minutes_of_day(time_of_day: str) -> int:
+    '''Minutes since midnight of an "HH:MM" time, schedules reuse a handful of them.'''
+    hour, minute = map(int, time_of_day.split(":"))
+    return hour * 60 + minute
 
-    start_total_minutes = start_hour * 60 + start_minute
-    off_total_minutes = off_hour * 60 + off_minute
+
+def get_scheduled_device_status(start_time: str, off_time: str, now: datetime | None = None) -> bool:
+    current = now if now is not None else datetime.now()
+    current_time = current.hour * 60 + current.minute
+
+    start_total_minutes = get_minutes_of_day(start_time)
+    off_total_minutes = get_minutes_of_day(off_time)
 
     if start_total_minutes <= off_total_minutes:
         return start_total_minutes <= current_time <= off_total_minutes
     # Handle overnight case
     return current_time >= start_total_minutes or current_time <= off_total_minutes
+
+
+def get_scheduled_days_mask(days_scheduled: str | None) -> int:
+    '''Returns a bit mask of scheduled weekdays, bit 0 being Monday.'''
+    if days_scheduled is None:
+        return 0
+    days = days_scheduled.lower()
+    mask = 0
+    for weekday, day in enumerate(WEEKDAYS):
+        if day in days:
+            mask |= 1 << weekday
+    return mask
+
+
+def get_schedule_transitions(start_time: str, off_time: str, days_mask: int, around: datetime) -> List[Tuple[datetime, bool]]:
+    '''Returns the sorted (time, status) transitions of every scheduled window
+    starting between the day before `around` and a week after it.
+
+    A window whose off time is earlier than its start time runs overnight and
+    switches off on the following day.
+    '''
+    start_hour, start_minute = map(int, start_time.split(":"))
+    off_hour, off_minute = map(int, off_time.split(":"))
+    start_offset = timedelta(hours=start_hour, minutes=start_minute)
+    off_offset = timedelta(hours=off_hour, minutes=off_minute)
+    if off_offset < start_offset:
+        off_offset += timedelta(days=1)
+
+    first_day = around.replace(
+        hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    transitions: List[Tuple[datetime, bool]] = []
+    for day_offset in range(9):
+        day = first_day + timedelta(days=day_offset)
+        if days_mask & (1 << day.weekday()):
+            transitions.append((day + start_offset, True))
+            transitions.append((day + off_offset, False))
+    transitions.sort(key=lambda transition: transition[0])
+    return transitions
+
+
+def get_next_schedule_transition(start_time: str, off_time: str, days_mask: int, now: datetime) -> Tuple[datetime, bool] | None:
+    for transition in get_schedule_transitions(start_time, off_time, days_mask, now):
+        if transition[0] > now:
+            return transition
+    return None
+
+
+def get_current_schedule_status(start_time: str, off_time: str, days_mask: int, now: datetime) -> bool | None:
+    '''Returns the status set by the latest transition up to `now`, or None if
+    no scheduled window has started yet.'''
+    current_status = None
+    for transition_time, status in get_schedule_transitions(start_time, off_time, days_mask, now):
+        if transition_time > now:
+            break
+        current_status = status
+    return current_status
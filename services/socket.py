@@ -1,24 +1,131 @@
+import asyncio
+import time
 from fastapi import WebSocket
-from typing import List
+from typing import Dict, List
+
+
+class SocketConnection:
+    '''Outbound queue and sender task for a single WebSocket client.'''
+
+    def __init__(self, websocket: WebSocket, max_queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue_size)
+        self.sender_task: asyncio.Task | None = None
+        self.dropped_count = 0
 
 
 class SocketManager:
-    def __init__(self):
+    '''Fans broadcasts out to every client without waiting on any of them.
+
+    Each connection gets a bounded queue drained by its own sender task, so
+    a slow client only delays itself. When a client's queue is full the
+    oldest pending message is dropped in favour of the newest one, and a
+    client whose send fails or times out is disconnected.
+    '''
+
+    def __init__(self, max_queue_size: int = 64, send_timeout_seconds: float = 5.0):
         self.active_connections: List[WebSocket] = []
+        self.connections: Dict[WebSocket, SocketConnection] = {}
+        self.max_queue_size = max_queue_size
+        self.send_timeout_seconds = send_timeout_seconds
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+        self.broadcast_count = 0
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.evicted_count = 0
+        self.send_latency_total_seconds = 0.0
+        self.send_latency_max_seconds = 0.0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
+        self.loop = asyncio.get_running_loop()
+        connection = SocketConnection(websocket, self.max_queue_size)
+        connection.sender_task = asyncio.create_task(
+            self._sender(connection))
+        self.connections[websocket] = connection
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
         self.active_connections.remove(websocket)
+        if connection.sender_task is not None and connection.sender_task is not asyncio.current_task():
+            connection.sender_task.cancel()
 
     async def is_alive(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, message)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        '''Queues `message` for every client and returns immediately.
+
+        Safe to call from event loops other than the server's one (e.g. the
+        schedule assistant's worker thread).
+        '''
+        if self.loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self._broadcast(message)
+        else:
+            self.loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _broadcast(self, message: str):
+        self.broadcast_count += 1
+        for connection in list(self.connections.values()):
+            self._enqueue(connection, message)
+
+    def _enqueue(self, connection: SocketConnection, message: str):
+        if connection.queue.full():
+            # Slow consumer: keep the newest state, drop the oldest message
+            connection.queue.get_nowait()
+            connection.dropped_count += 1
+            self.dropped_count += 1
+        connection.queue.put_nowait(message)
+
+    async def _sender(self, connection: SocketConnection):
+        while True:
+            message = await connection.queue.get()
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(connection.websocket.send_text(message), self.send_timeout_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Socket] Evicting dead connection: {e}")
+                self.evicted_count += 1
+                self.disconnect(connection.websocket)
+                try:
+                    await connection.websocket.close()
+                except Exception:
+                    pass
+                return
+            latency = time.perf_counter() - start
+            self.sent_count += 1
+            self.send_latency_total_seconds += latency
+            self.send_latency_max_seconds = max(
+                self.send_latency_max_seconds, latency)
+
+    def get_stats(self):
+        queue_depths = [connection.queue.qsize()
+                        for connection in self.connections.values()]
+        return {
+            "connections": len(self.connections),
+            "queue_depth_total": sum(queue_depths),
+            "queue_depth_max": max(queue_depths) if len(queue_depths) > 0 else 0,
+            "broadcasts": self.broadcast_count,
+            "sent": self.sent_count,
+            "dropped": self.dropped_count,
+            "evicted": self.evicted_count,
+            "send_latency_avg_seconds": self.send_latency_total_seconds / self.sent_count if self.sent_count > 0 else 0.0,
+            "send_latency_max_seconds": self.send_latency_max_seconds
+        }
 
 
 class SocketEvents():
@@ -26,6 +133,9 @@ class SocketEvents():
     REMOVE_ROOM = "REMOVE_ROOM"
     ADD_DEVICE = "ADD_DEVICE"
     SWITCH_DEVICE = "SWITCH_DEVICE"
+    SWITCH_DEVICES = "SWITCH_DEVICES"
+    ADD_SCENE = "ADD_SCENE"
+    REMOVE_SCENE = "REMOVE_SCENE"
     SCHEDULED_SWITCH_DEVICE = "SCHEDULED_SWITCH_DEVICE"
     CONFIGURE_DEVICE = "CONFIGURE_DEVICE"
     REMOVE_DEVICE = "REMOVE_DEVICE"
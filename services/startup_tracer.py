@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+
+class StartupTracer():
+    '''Records how long each startup phase takes, relative to process start.
+
+    `mark` closes a phase that ran since the previous mark, `phase` wraps one
+    in a with-block. `ready` is set once the server can serve every route.
+    `failed` holds the error of the last failed warm up attempt until one
+    succeeds.
+    '''
+    origin: float
+    last_mark: float
+    phases: List[Dict[str, Any]]
+    ready: bool = False
+    failed: str | None = None
+    failed_attempts: int = 0
+    retry_in_seconds: float | None = None
+    ready_after_seconds: float | None = None
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.last_mark = self.origin
+        self.phases = []
+
+    def record(self, name: str, started_at: float, error: Exception | None = None):
+        ended_at = time.perf_counter()
+        self.phases.append({
+            "phase": name,
+            "started_at_ms": (started_at - self.origin) * 1000,
+            "duration_ms": (ended_at - started_at) * 1000,
+            "error": str(error) if error is not None else None
+        })
+        self.last_mark = ended_at
+        print(
+            f"[Startup] {name} took {(ended_at - started_at) * 1000:.1f} ms{' (failed)' if error is not None else ''}.")
+
+    def mark(self, name: str):
+        self.record(name, self.last_mark)
+
+    @contextmanager
+    def phase(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(name, started_at, e)
+            raise
+        self.record(name, started_at)
+
+    def set_ready(self):
+        self.ready = True
+        self.failed = None
+        self.retry_in_seconds = None
+        self.ready_after_seconds = time.perf_counter() - self.origin
+        print(f"[Startup] Ready after {self.ready_after_seconds * 1000:.1f} ms.")
+
+    def set_failed(self, error: Exception, retry_in_seconds: float):
+        self.failed = str(error)
+        self.failed_attempts += 1
+        self.retry_in_seconds = retry_in_seconds
+        print(
+            f"[Startup] Warm up failed, retrying in {retry_in_seconds:g} s. {error}")
+
+    def get_stats(self):
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "failed_attempts": self.failed_attempts,
+            "retry_in_seconds": self.retry_in_seconds,
+            "ready_after_ms": self.ready_after_seconds * 1000 if self.ready_after_seconds is not None else None,
+            "phases": self.phases
+        }
+
+
+startup_tracer = StartupTracer()
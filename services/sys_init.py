@@ -1,3 +1,5 @@
+import os
+
 import bcrypt
 
 from sqlalchemy.exc import SQLAlchemyError
@@ -8,12 +10,15 @@ from helpers.system_time import SystemTime
 
 
 class SystemInitializer():
+    '''Starts the NTP sync. The house check, which waits on Postgres, is
+    left to `initialize_house`, run by the server's warm up.'''
 
     sys_time: SystemTime
+    house_initialized: bool = False
 
     def __init__(self) -> None:
-        self.sys_time = SystemTime()
-        self.initialize_house()
+        self.sys_time = SystemTime(enabled=os.environ.get(
+            "SYSTEM_TIME_SYNC", "true").lower() in ["1", "true", "yes"])
 
     def initialize_house(self):
         PrintHeading(80)
@@ -31,6 +36,7 @@ class SystemInitializer():
             print("[House] House Initialization Success.")
         else:
             print("[House] House Already Initialized. (Skipped)")
+        self.house_initialized = True
 
     def get_house_password(self):
         while True:
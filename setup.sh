@@ -34,8 +34,16 @@ python3 -m pip install RPi.GPIO # Install RPi.GPIO package
 pip install -r requirements.txt
 
 # Database 
+alembic upgrade heads # Apply the migrations shipped in alembic/versions
+# The shipped revisions start their own branch next to the hub's autogenerated
+# ones, join them so autogenerate and `upgrade head` see a single head
+if [ "$(alembic heads | grep -c '(head)')" -gt 1 ]; then
+    alembic merge heads -m "AutoPi-Hub merge"
+    alembic upgrade head
+fi
 alembic revision --autogenerate -m "AutoPi-Hub" # Regenerate and apply new migrations
 alembic upgrade head # Apply the new migration
+python3 partition_control_logs.py # Partition the control logs by month while the server is down
 
 # Reister HomeAutomationSystem Service to start automatically on boot
 
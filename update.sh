@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # Save House Data to ./data directory
-sudo venv/bin/python save_house_data.py
+sudo venv/bin/python save_house_data.py --format ndjson --compress gzip
 
 # PostgreSQL Setup
 # Uninstall PostgreSQL
@@ -30,8 +30,16 @@ python3 -m pip install RPi.GPIO # Install RPi.GPIO package
 pip install -r requirements.txt
 
 # Databse 
+alembic upgrade heads # Apply the migrations shipped in alembic/versions
+# The shipped revisions start their own branch next to the hub's autogenerated
+# ones, join them so autogenerate and `upgrade head` see a single head
+if [ "$(alembic heads | grep -c '(head)')" -gt 1 ]; then
+    alembic merge heads -m "AutoPi-Hub merge"
+    alembic upgrade head
+fi
 alembic revision --autogenerate -m "AutoPi-Hub" # Regenerate and apply new migrations
 alembic upgrade head # Apply the new migration
+sudo venv/bin/python partition_control_logs.py # Partition the control logs by month while the server is down
 
 # Load House Data from ./data directory
 sudo venv/bin/python load_house_data.py